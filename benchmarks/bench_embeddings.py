@@ -0,0 +1,97 @@
+"""
+Benchmark embedding throughput versus concurrency level.
+
+By default the Jina backend runs against a local fake embeddings server, so no
+API key or network is needed:
+
+    python -m benchmarks.bench_embeddings --texts 512 --latency 0.05
+
+With `--local-model-path`, the local CPU backend is measured instead, with
+`--concurrency` callers each embedding one query at a time so the effect of
+dynamic batching shows up:
+
+    python -m benchmarks.bench_embeddings --local-model-path models/embedding
+"""
+
+import argparse
+import asyncio
+import time
+
+from benchmarks.fake_servers import FakeEmbeddingsServer
+from src.embedders import Embedder, JinaEmbedder, LocalEmbedder
+
+
+async def embed_all(embedder: Embedder, texts: list[str]) -> int:
+    embeddings = await embedder.embed_passages(texts)
+    await embedder.close()
+    return len(embeddings)
+
+
+async def embed_one_by_one(
+    embedder: Embedder, texts: list[str], concurrency: int
+) -> int:
+    remaining = iter(texts)
+    done = 0
+
+    async def caller():
+        nonlocal done
+        for text in remaining:
+            await embedder.embed_query(text)
+            done += 1
+
+    await asyncio.gather(*(caller() for _ in range(concurrency)))
+    await embedder.close()
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--texts", type=int, default=512)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32]
+    )
+    parser.add_argument("--local-model-path")
+    args = parser.parse_args()
+
+    texts = [f"passage number {i} " * 20 for i in range(args.texts)]
+
+    if args.local_model_path:
+        print(
+            f"{args.texts} single-text requests, local model, "
+            f"max batch {args.batch_size}"
+        )
+        print(f"{'concurrency':>11} | {'seconds':>8} | {'texts/s':>9}")
+        for concurrency in args.concurrency:
+            embedder = LocalEmbedder(
+                model_path=args.local_model_path, max_batch_size=args.batch_size
+            )
+            embedder.encode(["warm-up"])
+            start = time.perf_counter()
+            count = asyncio.run(embed_one_by_one(embedder, texts, concurrency))
+            elapsed = time.perf_counter() - start
+            print(f"{concurrency:>11} | {elapsed:>8.3f} | {count / elapsed:>9.1f}")
+        return
+
+    with FakeEmbeddingsServer(latency=args.latency) as server:
+        print(
+            f"{args.texts} texts, batch size {args.batch_size}, "
+            f"{args.latency * 1000:.0f} ms server latency"
+        )
+        print(f"{'concurrency':>11} | {'seconds':>8} | {'texts/s':>9}")
+        for concurrency in args.concurrency:
+            embedder = JinaEmbedder(
+                url=server.url,
+                batch_size=args.batch_size,
+                max_concurrency=concurrency,
+            )
+            start = time.perf_counter()
+            count = asyncio.run(embed_all(embedder, texts))
+            elapsed = time.perf_counter() - start
+            assert count == len(texts)
+            print(f"{concurrency:>11} | {elapsed:>8.3f} | {count / elapsed:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Benchmark how long the app takes to import and to start.
+
+Imports `src.main` in fresh interpreters with `-X importtime`, reporting the
+total import time and the top-level packages taking the most time, then times
+a cold start (import, lifespan and first request; no upstream service is
+called unless `STARTUP_WARMUP` is set):
+
+    python -m benchmarks.bench_import_time --runs 5 --json import_time.json
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+# `import time: self [us] | cumulative | imported package`
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| *(\S+)")
+
+COLD_START = """
+import time
+
+started = time.perf_counter()
+from fastapi.testclient import TestClient
+
+from src.main import app
+
+imported = time.perf_counter()
+with TestClient(app) as client:
+    client.get("/")
+    print(imported - started, time.perf_counter() - started)
+"""
+
+
+def environment() -> dict[str, str]:
+    env = dict(os.environ)
+    # Settings needed to start, none of them is used for real
+    env.setdefault("CHAT_MODEL", "bench-model")
+    env.setdefault("OPENAI_API_KEY", "bench")
+    return env
+
+
+def import_times() -> tuple[float, dict[str, float]]:
+    """Seconds to import `src.main`, and seconds spent in each top-level package."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import src.main"],
+        env=environment(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    packages: dict[str, float] = defaultdict(float)
+    total = 0.0
+    for match in IMPORT_TIME_LINE.finditer(result.stderr):
+        own, cumulative, name = match.groups()
+        # Own times add up without counting nested imports twice
+        packages[name.split(".")[0]] += int(own) / 1e6
+        if name == "src.main":
+            total = int(cumulative) / 1e6
+    return total, packages
+
+
+def cold_start() -> tuple[float, float]:
+    """Seconds to import the app, and until the first response."""
+    result = subprocess.run(
+        [sys.executable, "-c", COLD_START],
+        env=environment(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    imported, responded = map(float, result.stdout.split())
+    return imported, responded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    totals = []
+    packages: dict[str, list[float]] = defaultdict(list)
+    for _ in range(args.runs):
+        total, by_package = import_times()
+        totals.append(total)
+        for name, seconds in by_package.items():
+            packages[name].append(seconds)
+    starts = [cold_start() for _ in range(args.runs)]
+
+    report = {
+        "runs": args.runs,
+        "import_seconds": statistics.median(totals),
+        "cold_start_import_seconds": statistics.median(s[0] for s in starts),
+        "cold_start_first_response_seconds": statistics.median(s[1] for s in starts),
+        "packages": dict(
+            sorted(
+                ((name, statistics.median(times)) for name, times in packages.items()),
+                key=lambda item: item[1],
+                reverse=True,
+            )[: args.top]
+        ),
+    }
+
+    print(f"import src.main:        {report['import_seconds'] * 1000:8.1f} ms")
+    print(
+        f"cold start, imported:   {report['cold_start_import_seconds'] * 1000:8.1f} ms"
+    )
+    print(
+        "cold start, responded:  "
+        f"{report['cold_start_first_response_seconds'] * 1000:8.1f} ms"
+    )
+    print(f"\n{'package':<28} | {'ms':>8}")
+    for name, seconds in report["packages"].items():
+        print(f"{name:<28} | {seconds * 1000:>8.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
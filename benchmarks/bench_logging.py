@@ -0,0 +1,79 @@
+"""
+Benchmark the cost of logging calls to the caller.
+
+Compares the previous setup (a synchronous file handler plus console handler
+on a DEBUG logger, with f-string messages) against `create_logger`'s queue
+handler with lazily formatted messages, for an info message and for a debug
+message formatting 10 search results that the info level drops:
+
+    python -m benchmarks.bench_logging --calls 20000
+"""
+
+import argparse
+import contextlib
+import io
+import logging
+import os
+import tempfile
+import time
+
+from src import utils
+
+# Stands in for the `ScoredPoint`s formatted by the retrieval debug message
+SEARCH_RESULT = [
+    {"id": i, "score": 0.9 - i / 100, "payload": {"text": "convolution " * 100}}
+    for i in range(10)
+]
+
+
+def sync_logger(path: str) -> logging.Logger:
+    logger = logging.getLogger("bench-sync")
+    logger.setLevel(logging.DEBUG)
+    for stream_handler in (
+        logging.FileHandler(path),
+        logging.StreamHandler(io.StringIO()),
+    ):
+        stream_handler.setFormatter(logging.Formatter(utils.LOG_FORMAT))
+        logger.addHandler(stream_handler)
+    logger.propagate = False
+    return logger
+
+
+def time_calls(log, calls: int) -> float:
+    """Microseconds per call."""
+    start = time.perf_counter()
+    for i in range(calls):
+        log(i)
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        eager = sync_logger(os.path.join(tmp, "sync.log"))
+        # Both loggers write their console output to memory
+        with contextlib.redirect_stderr(io.StringIO()):
+            queued = utils.create_logger(
+                "bench-queued", os.path.join(tmp, "queued.log"), "info"
+            )
+
+        results = {
+            "sync, f-string info": lambda i: eager.info(f"Retrieved {i} chunks."),
+            "queue, lazy info": lambda i: queued.info("Retrieved %d chunks.", i),
+            "sync, f-string debug": lambda i: eager.debug(
+                f"search_result={SEARCH_RESULT}"
+            ),
+            "queue, lazy debug (dropped)": lambda i: queued.debug(
+                "search_result=%s", SEARCH_RESULT
+            ),
+        }
+        print(f"{'case':<28} | {'us/call':>8}")
+        for name, log in results.items():
+            print(f"{name:<28} | {time_calls(log, args.calls):>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Benchmark serial versus multi-process PDF text extraction.
+
+The bundled `samples/` PDFs are replicated into large documents, which are then
+extracted with the serial path and with the process pool:
+
+    python -m benchmarks.bench_pdf_extraction --pages 250 1000 2000
+"""
+
+import argparse
+import glob
+import os
+import tempfile
+import time
+
+import pymupdf
+
+from src import pdf
+
+
+def build_document(path: str, pages: int) -> None:
+    samples = [pymupdf.open(p) for p in sorted(glob.glob("samples/*.pdf"))]
+    with pymupdf.open() as doc:
+        while doc.page_count < pages:
+            for sample in samples:
+                doc.insert_pdf(sample)
+        doc.delete_pages(range(pages, doc.page_count))
+        doc.save(path)
+    for sample in samples:
+        sample.close()
+
+
+def time_extraction(path: str, parallel: bool) -> float:
+    pdf.PDF_PARALLEL_PAGE_THRESHOLD = 1 if parallel else float("inf")
+    start = time.perf_counter()
+    pdf.extract_text(path)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, nargs="+", default=[250, 1000, 2000])
+    args = parser.parse_args()
+
+    # Start the worker processes up front so the first run doesn't pay for it
+    list(pdf.get_executor().map(abs, range(pdf.PDF_EXTRACTION_WORKERS)))
+
+    print(
+        f"{pdf.PDF_EXTRACTION_WORKERS} workers, {pdf.PDF_EXTRACTION_SHARD_PAGES} pages per shard"
+    )
+    print(f"{'pages':>6} | {'serial s':>8} | {'parallel s':>10} | {'speedup':>7}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for pages in args.pages:
+            path = os.path.join(tmp, f"{pages}.pdf")
+            build_document(path, pages)
+            serial = time_extraction(path, parallel=False)
+            parallel = time_extraction(path, parallel=True)
+            print(
+                f"{pages:>6} | {serial:>8.3f} | {parallel:>10.3f} | {serial / parallel:>6.2f}x"
+            )
+    pdf.shutdown_executor()
+
+
+if __name__ == "__main__":
+    main()
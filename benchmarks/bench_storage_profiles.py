@@ -0,0 +1,180 @@
+"""
+Benchmark recall@10, memory and search latency of the storage profiles.
+
+Passages are built from the sentences of the bundled `samples/` PDFs (windows of
+consecutive sentences, so there are enough of them for recall to mean
+something), and queries are short spans of random passages. The exact top 10 by
+full-size dot product is the ground truth for every profile:
+
+    python -m benchmarks.bench_storage_profiles --passages 5000 --queries 200
+
+Point `--qdrant-url` at a Qdrant server to measure quantization and HNSW; the
+default in-memory local mode searches exactly and only shows the effect of
+truncated dimensions. Embeddings come from `--backend` (see EMBEDDING_BACKEND).
+The default "fake" backend is not Matryoshka-trained, so it understates the
+recall of the truncated profiles; use "jina" or "local" for real numbers.
+"""
+
+import argparse
+import asyncio
+import glob
+import random
+import re
+import statistics
+import time
+import warnings
+
+import numpy as np
+from qdrant_client import QdrantClient, models
+
+from src.embedders import create_embedder
+from src.pdf import extract_text
+from src.vectorstore import STORAGE_PROFILES, StorageProfile, fit_vector
+
+DEFAULT_HNSW_M = 16
+
+
+def build_corpus(passages: int, queries: int, seed: int) -> tuple[list, list]:
+    sentences = []
+    for path in sorted(glob.glob("samples/*.pdf")):
+        text, _ = extract_text(path)
+        sentences += [s.strip() for s in re.split(r"[.!?\n]+", text) if len(s) > 20]
+
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(passages):
+        start = rng.randrange(len(sentences))
+        texts.append(". ".join(sentences[start : start + rng.randint(3, 6)]))
+    query_texts = []
+    for _ in range(queries):
+        words = rng.choice(texts).split()
+        start = rng.randrange(max(1, len(words) - 6))
+        query_texts.append(" ".join(words[start : start + 6]))
+    return texts, query_texts
+
+
+async def embed(backend: str, texts: list[str], queries: list[str]):
+    embedder = create_embedder(backend)
+    vectors = []
+    for i in range(0, len(texts), 256):
+        vectors += await embedder.embed_passages(texts[i : i + 256])
+    query_vectors = [await embedder.embed_query(query) for query in queries]
+    await embedder.close()
+    return np.array(vectors, dtype=np.float32), np.array(query_vectors, np.float32)
+
+
+def estimated_ram_mb(profile: StorageProfile, count: int, size: int) -> float:
+    """RAM for vectors, quantized vectors and HNSW links, following Qdrant's sizing guide."""
+    ram = 0 if profile.on_disk else count * size * 4
+    if profile.quantization == "scalar":
+        ram += count * size
+    elif profile.quantization == "binary":
+        ram += count * size / 8
+    # Each node has up to 2 * m links of 4 bytes on layer 0
+    ram += count * 2 * (profile.hnsw_m or DEFAULT_HNSW_M) * 4
+    return ram / 1024 / 1024
+
+
+def run_profile(
+    client: QdrantClient,
+    name: str,
+    profile: StorageProfile,
+    vectors: np.ndarray,
+    query_vectors: np.ndarray,
+    scores: np.ndarray,
+) -> dict:
+    collection_name = f"bench-{name}"
+    if client.collection_exists(collection_name):
+        client.delete_collection(collection_name)
+    config = profile.collection_config(vectors.shape[1], shared=False)
+    size = config["vectors_config"].size
+    # Index everything, otherwise small collections are searched without HNSW
+    client.create_collection(
+        collection_name=collection_name,
+        optimizers_config=models.OptimizersConfigDiff(indexing_threshold=1),
+        **config,
+    )
+    for start in range(0, len(vectors), 512):
+        batch = vectors[start : start + 512]
+        client.upsert(
+            collection_name=collection_name,
+            points=models.Batch(
+                ids=list(range(start, start + len(batch))),
+                vectors=[fit_vector(v.tolist(), size) for v in batch],
+            ),
+            wait=True,
+        )
+    while (
+        client.get_collection(collection_name).status != models.CollectionStatus.GREEN
+    ):
+        time.sleep(0.5)
+
+    latencies, recalls = [], []
+    for query, query_scores in zip(query_vectors, scores):
+        query = fit_vector(query.tolist(), size)
+        start = time.perf_counter()
+        points = client.query_points(
+            collection_name=collection_name,
+            query=query,
+            limit=10,
+            search_params=profile.search_params(),
+        ).points
+        latencies.append(time.perf_counter() - start)
+        # Passages may repeat, so any hit scoring at least the true 10th best counts
+        threshold = np.partition(query_scores, -10)[-10] - 1e-5
+        recalls.append(sum(query_scores[p.id] >= threshold for p in points) / 10)
+    client.delete_collection(collection_name)
+
+    latencies.sort()
+    return {
+        "dimension": size,
+        "recall": statistics.mean(recalls),
+        "ram_mb": estimated_ram_mb(profile, len(vectors), size),
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--passages", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--backend", default="fake")
+    parser.add_argument("--qdrant-url", default=":memory:")
+    parser.add_argument("--profiles", nargs="+", default=list(STORAGE_PROFILES))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    texts, queries = build_corpus(args.passages, args.queries, args.seed)
+    vectors, query_vectors = asyncio.run(embed(args.backend, texts, queries))
+    scores = query_vectors @ vectors.T
+
+    if args.qdrant_url == ":memory:":
+        # Local mode warns about every setting it ignores
+        warnings.simplefilter("ignore", UserWarning)
+        client = QdrantClient(location=":memory:")
+    else:
+        client = QdrantClient(url=args.qdrant_url)
+
+    print(
+        f"{len(texts)} passages, {len(queries)} queries, {args.backend} embeddings "
+        f"({vectors.shape[1]} dims), qdrant {args.qdrant_url}"
+    )
+    print(
+        f"{'profile':>8} | {'dims':>5} | {'recall@10':>9} | {'RAM MB':>7} | "
+        f"{'p50 ms':>7} | {'p99 ms':>7}"
+    )
+    for name in args.profiles:
+        result = run_profile(
+            client, name, STORAGE_PROFILES[name], vectors, query_vectors, scores
+        )
+        print(
+            f"{name:>8} | {result['dimension']:>5} | {result['recall']:>9.3f} | "
+            f"{result['ram_mb']:>7.1f} | {result['p50_ms']:>7.2f} | "
+            f"{result['p99_ms']:>7.2f}"
+        )
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Benchmark peak RSS of handling one `/ingest` upload.
+
+Builds a large PDF (the sample padded with an embedded file), then in a fresh
+subprocess per mode hands it to the upload handling code the way Starlette does
+(as an `UploadFile` spooled to disk) and extracts every page:
+
+- `in-memory`: the previous approach, `await file.read()` wrapped in `io.BytesIO`
+- `spooled`: `process_uploaded_file` streaming to a temp file opened by path
+
+    python -m benchmarks.bench_upload_memory --size-mb 200
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import pymupdf
+
+SAMPLE_PDF = "samples/markdown-file-02.pdf"
+
+
+def build_document(path: str, size_mb: int) -> None:
+    with pymupdf.open(SAMPLE_PDF) as doc:
+        doc.embfile_add("padding.bin", os.urandom(size_mb * 1024 * 1024))
+        doc.save(path)
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss survives fork+exec, so a child would inherit the parent's peak;
+    # VmHWM is reset on exec. Both are reported in kilobytes.
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def spool(path: str, spooled: tempfile.SpooledTemporaryFile) -> None:
+    with open(path, "rb") as f:
+        shutil.copyfileobj(f, spooled, 1024 * 1024)
+    spooled.seek(0)
+
+
+async def handle_upload(mode: str, path: str) -> None:
+    from starlette.datastructures import UploadFile
+
+    from src.pdf import iter_pages
+    from src.utils import process_uploaded_file
+
+    # Starlette spools multipart uploads larger than 1 MB to disk
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as spooled:
+        spool(path, spooled)
+        upload = UploadFile(file=spooled, filename="large.pdf")
+
+        before = peak_rss_mb()
+        if mode == "in-memory":
+            pdf_file = io.BytesIO(await upload.read())
+            pdf_file.name = upload.filename
+            pages = list(iter_pages(pdf_file))
+        else:
+            document = await process_uploaded_file(upload)
+            pages = list(iter_pages(document.path))
+            document.close()
+        after = peak_rss_mb()
+
+    print(
+        json.dumps({"mode": mode, "pages": len(pages), "peak_rss_mb": after - before})
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=int, default=200)
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "PATH"))
+    args = parser.parse_args()
+
+    if args.child:
+        asyncio.run(handle_upload(*args.child))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "large.pdf")
+        build_document(path, args.size_mb)
+        print(f"upload size: {os.path.getsize(path) / 1024 / 1024:.1f} MB")
+        print(f"{'mode':>10} | {'peak RSS increase MB':>20}")
+        for mode in ["in-memory", "spooled"]:
+            output = subprocess.run(
+                [
+                    sys.executable,
+                    "-m",
+                    "benchmarks.bench_upload_memory",
+                    "--child",
+                    mode,
+                    path,
+                ],
+                capture_output=True,
+                text=True,
+                check=True,
+                env={**os.environ, "CHAT_MODEL": os.environ.get("CHAT_MODEL", "bench")},
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{mode:>10} | {result['peak_rss_mb']:>20.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""
+Local stand-ins for the upstream APIs used by the benchmarks.
+
+The servers run on a background thread and bind to an ephemeral port on
+localhost, so benchmarks can point the application at them through the usual
+environment variables (e.g. `JINA_API_URL`, `OPENAI_BASE_URL`). Those are read
+when `src` modules are imported, so this module only imports them lazily.
+"""
+
+import json
+import random
+import threading
+import time
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeServer:
+    """
+    Base class for the fake upstream servers.
+
+    Subclasses implement `respond(payload)` and return the JSON body to send back.
+
+    Args:
+        latency (float): Seconds to sleep before answering each request.
+        jitter (float): Up to this many extra seconds, drawn uniformly per request.
+        rate_limit_rate (float): Share of requests rejected with 429, at random.
+        retry_after (float): The `Retry-After` of the rejections, in seconds.
+        seed (int | None): Seeds the jitter and rejections, for repeatable runs.
+    """
+
+    path = "/"
+
+    def __init__(
+        self,
+        latency: float = 0.05,
+        jitter: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        retry_after: float = 0.1,
+        seed: int | None = None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.request_count = 0
+        self.rate_limited_count = 0
+        self.cancelled_streams = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def url(self) -> str:
+        return f"{self.base_url}{self.path}"
+
+    def respond(self, payload: dict) -> dict:
+        raise NotImplementedError
+
+    def respond_stream(self, payload: dict) -> Iterator[dict]:
+        """Yield the server-sent events answering a streaming request."""
+        raise NotImplementedError
+
+    def next_request(self) -> tuple[bool, float]:
+        """Count a request and draw whether it is rate limited and how long it takes."""
+        with self._lock:
+            self.request_count += 1
+            if self._random.random() < self.rate_limit_rate:
+                self.rate_limited_count += 1
+                return True, 0.0
+            return False, self.latency + self._random.uniform(0, self.jitter)
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length))
+                rate_limited, latency = server.next_request()
+                if rate_limited:
+                    self.send_json(
+                        429,
+                        {"error": {"message": "Rate limit exceeded"}},
+                        {"Retry-After": str(server.retry_after)},
+                    )
+                    return
+                time.sleep(latency)
+
+                if payload.get("stream"):
+                    self.send_stream(server.respond_stream(payload))
+                    return
+                self.send_json(200, server.respond(payload))
+
+            def send_json(
+                self, status: int, content: dict, headers: dict | None = None
+            ):
+                body = json.dumps(content).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_stream(self, events: Iterator[dict]):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                try:
+                    for event in events:
+                        self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+                        self.wfile.flush()
+                    self.wfile.write(b"data: [DONE]\n\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client went away and generation stops, like upstream
+                    with server._lock:
+                        server.cancelled_streams += 1
+                self.close_connection = True
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class FakeEmbeddingsServer(FakeServer):
+    """Minimal HTTP server that mimics the Jina embeddings endpoint."""
+
+    path = "/v1/embeddings"
+
+    def respond(self, payload: dict) -> dict:
+        from src.embedders import hashed_embedding
+
+        texts = payload["input"]
+        if isinstance(texts, str):
+            texts = [texts]
+        return {
+            "data": [
+                {"index": i, "embedding": hashed_embedding(text, payload["dimensions"])}
+                for i, text in enumerate(texts)
+            ]
+        }
+
+
+class FakeChatServer(FakeServer):
+    """Minimal HTTP server that mimics the OpenAI chat completions endpoint."""
+
+    path = "/v1/chat/completions"
+
+    def __init__(
+        self,
+        latency: float = 0.5,
+        completion: str = "A fake completion.",
+        token_latency: float = 0.01,
+        **kwargs,
+    ):
+        super().__init__(latency=latency, **kwargs)
+        self.completion = completion
+        # Seconds between streamed tokens; `latency` is then the time to first token
+        self.token_latency = token_latency
+
+    @property
+    def base_url(self) -> str:
+        # The OpenAI client expects the base URL to include the API version
+        return f"{super().base_url}/v1"
+
+    @property
+    def url(self) -> str:
+        return f"{self.base_url}/chat/completions"
+
+    def respond(self, payload: dict) -> dict:
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload["model"],
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": self.completion},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": self.usage(payload),
+        }
+
+    def usage(self, payload: dict) -> dict:
+        """Token counts, approximated by words."""
+        prompt_tokens = sum(
+            len(message["content"].split()) for message in payload["messages"]
+        )
+        completion_tokens = len(self.completion.split())
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    def respond_stream(self, payload: dict) -> Iterator[dict]:
+        for i, word in enumerate(self.completion.split(" ")):
+            if i:
+                time.sleep(self.token_latency)
+            yield {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": payload["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": {"content": word if i == 0 else f" {word}"},
+                        "finish_reason": None,
+                    }
+                ],
+            }
+        yield {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": payload["model"],
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }
+        if payload.get("stream_options", {}).get("include_usage"):
+            yield {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": payload["model"],
+                "choices": [],
+                "usage": self.usage(payload),
+            }
@@ -0,0 +1,390 @@
+"""
+Offline end-to-end load test of ingestion and generation on a single server worker.
+
+Starts fake embeddings and chat servers (with configurable latency, jitter and
+429 rate), serves the app with uvicorn on one worker backed by an in-memory
+Qdrant, and runs a scripted workload:
+
+1. ingest `--documents` distinct PDFs built from the `samples/` PDFs, then
+2. for each `--concurrency` level, fire `--requests` requests alternating over
+   the `--endpoints` (`/generate/summary` and `/generate/questions`).
+
+It prints throughput and p50/p99 latencies, and `--report` writes them as JSON
+(with the commit, configuration and upstream counters) to compare runs across
+commits, e.g. against a previous report with `--baseline`:
+
+    python -m benchmarks.load_test --documents 4 --requests 64 --concurrency 1 4 16 \\
+        --chat-429-rate 0.05 --report after.json --baseline before.json
+"""
+
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import platform
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+import pymupdf
+
+from benchmarks.fake_servers import FakeChatServer, FakeEmbeddingsServer
+
+# The bundled sample PDFs, wherever the load test is started from
+SAMPLES_DIR = Path(__file__).resolve().parent.parent / "samples"
+
+ENDPOINTS = {
+    "summary": lambda topic, document_id: {"topic": topic, "document_id": document_id},
+    "questions": lambda topic, document_id: {
+        "topic": topic,
+        "document_id": document_id,
+        "questions_type": "MCQ",
+    },
+}
+
+
+def build_documents(directory: str, count: int, pages: int) -> list[str]:
+    """Write `count` PDFs of `pages` pages made of the sample PDFs, each with a distinct title page."""
+    sample_paths = sorted(SAMPLES_DIR.glob("*.pdf"))
+    if not sample_paths:
+        raise SystemExit(f"No sample PDFs found in {SAMPLES_DIR}")
+    samples = [pymupdf.open(path) for path in sample_paths]
+    paths = []
+    for i in range(count):
+        with pymupdf.open() as doc:
+            title = doc.new_page()
+            # Distinct content, so uploads aren't deduplicated
+            title.insert_text((72, 72), f"Benchmark document {i}")
+            while doc.page_count < pages:
+                for sample in samples[i % len(samples) :] + samples[: i % len(samples)]:
+                    doc.insert_pdf(sample)
+            if doc.page_count > pages:
+                doc.delete_pages(range(pages, doc.page_count))
+            path = os.path.join(directory, f"document-{i}.pdf")
+            doc.save(path)
+        paths.append(path)
+    for sample in samples:
+        sample.close()
+    return paths
+
+
+def start_app_server(app) -> tuple[str, object, threading.Thread]:
+    import uvicorn
+
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    host, port = sock.getsockname()
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+    thread = threading.Thread(
+        target=server.run, kwargs={"sockets": [sock]}, daemon=True
+    )
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://{host}:{port}", server, thread
+
+
+def override_qdrant_client(app):
+    """Serve every request from one in-memory Qdrant matching the code's client type."""
+    from src import vectorstore
+
+    if inspect.iscoroutinefunction(vectorstore.ingest_document):
+        from qdrant_client import AsyncQdrantClient
+
+        client = AsyncQdrantClient(location=":memory:")
+    else:
+        from qdrant_client import QdrantClient
+
+        client = QdrantClient(location=":memory:")
+    app.dependency_overrides[vectorstore.get_qdrant_client] = lambda: client
+
+
+def percentile(sorted_values: list[float], share: float) -> float | None:
+    """Nearest-rank percentile of already sorted values."""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * share))]
+
+
+def summarize_latencies(latencies: list[float]) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "mean": sum(latencies) / len(latencies) if latencies else None,
+        "p50": percentile(latencies, 0.5),
+        "p90": percentile(latencies, 0.9),
+        "p99": percentile(latencies, 0.99),
+        "max": latencies[-1] if latencies else None,
+    }
+
+
+async def run_ingest(base_url: str, paths: list[str], concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, document_ids, statuses = [], [], Counter()
+
+    async def ingest(client: httpx.AsyncClient, path: str):
+        async with semaphore:
+            content = await asyncio.to_thread(Path(path).read_bytes)
+            start = time.perf_counter()
+            response = await client.post(
+                f"{base_url}/ingest",
+                files={"file": (os.path.basename(path), content, "application/pdf")},
+            )
+            statuses[response.status_code] += 1
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - start)
+                document_ids.append(response.json()["id"])
+
+    async with httpx.AsyncClient(timeout=None) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(ingest(client, path) for path in paths))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "documents": len(paths),
+        "concurrency": concurrency,
+        "seconds": elapsed,
+        "documents_per_second": len(latencies) / elapsed,
+        "statuses": {str(status): count for status, count in statuses.items()},
+        "latency": summarize_latencies(latencies),
+        "document_ids": document_ids,
+    }
+
+
+async def run_generate(
+    base_url: str,
+    document_ids: list[str],
+    endpoints: list[str],
+    requests: int,
+    concurrency: int,
+) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = {endpoint: [] for endpoint in endpoints}
+    statuses = {endpoint: Counter() for endpoint in endpoints}
+
+    async def one_request(client: httpx.AsyncClient, i: int):
+        endpoint = endpoints[i % len(endpoints)]
+        body = ENDPOINTS[endpoint](
+            f"topic {i % 8}", document_ids[i % len(document_ids)]
+        )
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post(f"{base_url}/generate/{endpoint}", json=body)
+            statuses[endpoint][response.status_code] += 1
+            if response.status_code == 200:
+                latencies[endpoint].append(time.perf_counter() - start)
+
+    async with httpx.AsyncClient(timeout=None) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(one_request(client, i) for i in range(requests)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "seconds": elapsed,
+        "throughput": sum(map(len, latencies.values())) / elapsed,
+        "endpoints": {
+            endpoint: {
+                "requests": sum(statuses[endpoint].values()),
+                "throughput": len(latencies[endpoint]) / elapsed,
+                "statuses": {
+                    str(status): count for status, count in statuses[endpoint].items()
+                },
+                "latency": summarize_latencies(latencies[endpoint]),
+            }
+            for endpoint in endpoints
+        },
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def upstream_counts(server) -> dict:
+    return {
+        "requests": server.request_count,
+        "rate_limited": server.rate_limited_count,
+    }
+
+
+def print_report(report: dict) -> None:
+    ingest = report["ingest"]
+    print(
+        f"ingest: {ingest['documents']} documents of {report['config']['pages']} "
+        f"pages in {ingest['seconds']:.2f}s, p50 {ingest['latency']['p50']:.2f}s, "
+        f"p99 {ingest['latency']['p99']:.2f}s"
+    )
+    print(
+        f"{'concurrency':>11} | {'endpoint':>9} | {'req/s':>7} | "
+        f"{'p50 s':>6} | {'p99 s':>6} | {'errors':>6}"
+    )
+    for level in report["generate"]:
+        for endpoint, result in level["endpoints"].items():
+            errors = sum(
+                count for status, count in result["statuses"].items() if status != "200"
+            )
+            p50, p99 = result["latency"]["p50"], result["latency"]["p99"]
+            print(
+                f"{level['concurrency']:>11} | {endpoint:>9} | "
+                f"{result['throughput']:>7.2f} | "
+                f"{p50 if p50 is not None else float('nan'):>6.2f} | "
+                f"{p99 if p99 is not None else float('nan'):>6.2f} | {errors:>6}"
+            )
+
+
+def print_comparison(report: dict, baseline: dict) -> None:
+    """Print the relative change of throughput and latencies from a baseline report."""
+
+    def change(new: float | None, old: float | None) -> str:
+        if not new or not old:
+            return "n/a"
+        return f"{(new - old) / old * 100:+.1f}%"
+
+    print(f"\ncompared to {baseline.get('commit') or 'baseline'}:")
+    print(
+        f"{'concurrency':>11} | {'endpoint':>9} | {'req/s':>7} | {'p50':>7} | {'p99':>7}"
+    )
+    old_levels = {level["concurrency"]: level for level in baseline["generate"]}
+    for level in report["generate"]:
+        old_level = old_levels.get(level["concurrency"])
+        if old_level is None:
+            continue
+        for endpoint, result in level["endpoints"].items():
+            old_result = old_level["endpoints"].get(endpoint)
+            if old_result is None:
+                continue
+            print(
+                f"{level['concurrency']:>11} | {endpoint:>9} | "
+                f"{change(result['throughput'], old_result.get('throughput')):>7} | "
+                f"{change(result['latency']['p50'], old_result['latency']['p50']):>7} | "
+                f"{change(result['latency']['p99'], old_result['latency']['p99']):>7}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--documents", type=int, default=4)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--ingest-concurrency", type=int, default=2)
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument(
+        "--endpoints", nargs="+", choices=list(ENDPOINTS), default=list(ENDPOINTS)
+    )
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--embedding-jitter", type=float, default=0.02)
+    parser.add_argument("--embedding-429-rate", type=float, default=0.0)
+    parser.add_argument("--chat-latency", type=float, default=0.5)
+    parser.add_argument("--chat-jitter", type=float, default=0.2)
+    parser.add_argument("--chat-429-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--with-caches",
+        action="store_true",
+        help="keep the retrieval and response caches on (repeated topics then hit them)",
+    )
+    parser.add_argument("--report", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="a previous JSON report to compare with")
+    args = parser.parse_args()
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    with (
+        FakeEmbeddingsServer(
+            latency=args.embedding_latency,
+            jitter=args.embedding_jitter,
+            rate_limit_rate=args.embedding_429_rate,
+            retry_after=args.retry_after,
+            seed=args.seed,
+        ) as embeddings_server,
+        FakeChatServer(
+            latency=args.chat_latency,
+            jitter=args.chat_jitter,
+            rate_limit_rate=args.chat_429_rate,
+            retry_after=args.retry_after,
+            seed=args.seed + 1,
+        ) as chat_server,
+        tempfile.TemporaryDirectory() as tmp,
+    ):
+        os.environ.update(
+            {
+                "JINA_API_URL": embeddings_server.url,
+                "JINA_API_KEY": "fake",
+                "OPENAI_BASE_URL": chat_server.base_url,
+                "OPENAI_API_KEY": "fake",
+                "CHAT_MODEL": "fake-model",
+                "EMBEDDING_CACHE_PATH": "",
+                "DOCUMENT_REGISTRY_PATH": os.path.join(tmp, "registry.sqlite3"),
+            }
+        )
+        if not args.with_caches:
+            os.environ.update({"RETRIEVAL_CACHE_TTL": "0", "LLM_CACHE_TTL": "0"})
+        from src.main import app
+
+        override_qdrant_client(app)
+        base_url, server, thread = start_app_server(app)
+
+        paths = build_documents(tmp, args.documents, args.pages)
+        ingest = asyncio.run(run_ingest(base_url, paths, args.ingest_concurrency))
+        document_ids = ingest.pop("document_ids")
+        if not document_ids:
+            raise SystemExit(f"No document was ingested: {ingest['statuses']}")
+
+        generate = [
+            asyncio.run(
+                run_generate(
+                    base_url, document_ids, args.endpoints, args.requests, concurrency
+                )
+            )
+            for concurrency in args.concurrency
+        ]
+        stats = httpx.get(f"{base_url}/stats").json()
+        server.should_exit = True
+        thread.join()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "config": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("report", "baseline")
+        },
+        "ingest": ingest,
+        "generate": generate,
+        "upstream": {
+            "embeddings": upstream_counts(embeddings_server),
+            "chat": upstream_counts(chat_server),
+        },
+        "stats": stats,
+    }
+    print_report(report)
+    if baseline is not None:
+        print_comparison(report, baseline)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+import asyncio
+import inspect
+import os
+import time
+from collections import deque
+from collections.abc import Awaitable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from typing import TypeVar
+
+from src import metrics
+from src.utils import create_logger
+
+# End-to-end time budget of a generation request, in seconds
+REQUEST_DEADLINE = float(os.environ.get("REQUEST_DEADLINE", "30"))
+# Calls in flight and callers allowed to wait, per downstream service
+ADMISSION_EMBEDDING_CONCURRENCY = int(
+    os.environ.get("ADMISSION_EMBEDDING_CONCURRENCY", "16")
+)
+ADMISSION_EMBEDDING_QUEUE = int(os.environ.get("ADMISSION_EMBEDDING_QUEUE", "64"))
+ADMISSION_QDRANT_CONCURRENCY = int(os.environ.get("ADMISSION_QDRANT_CONCURRENCY", "32"))
+ADMISSION_QDRANT_QUEUE = int(os.environ.get("ADMISSION_QDRANT_QUEUE", "128"))
+ADMISSION_LLM_CONCURRENCY = int(os.environ.get("ADMISSION_LLM_CONCURRENCY", "32"))
+ADMISSION_LLM_QUEUE = int(os.environ.get("ADMISSION_LLM_QUEUE", "64"))
+# Seconds rejected clients are told to wait before retrying
+ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER", "2"))
+
+logger = create_logger(logger_name="admission", log_file="api.log", log_level="info")
+
+T = TypeVar("T")
+
+_deadline: ContextVar[float | None] = ContextVar("deadline", default=None)
+
+
+class AdmissionError(Exception):
+    """A request was rejected to protect a downstream service; it may be retried later."""
+
+    status_code = 503
+
+    def __init__(self, detail: str, retry_after: int = ADMISSION_RETRY_AFTER):
+        super().__init__(detail)
+        self.retry_after = retry_after
+
+
+class Overloaded(AdmissionError):
+    """The wait queue of a downstream service is full."""
+
+    status_code = 429
+
+
+class DeadlineExceeded(AdmissionError):
+    """The request ran out of time before a downstream call could complete."""
+
+
+@contextmanager
+def request_deadline(seconds: float) -> Iterator[None]:
+    """Give the calls made within the block (and the tasks they start) `seconds` to finish."""
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def start_without_deadline(awaitable: Awaitable[T]) -> "asyncio.Future[T]":
+    """
+    Run `awaitable` as a task that isn't bound by the current request's deadline.
+
+    For work shared by several requests, which each wait for it with their own deadline.
+    """
+    context = copy_context()
+    context.run(_deadline.set, None)
+    return context.run(asyncio.ensure_future, awaitable)
+
+
+def time_left() -> float | None:
+    """Seconds until the current request's deadline, or None without a deadline."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+async def within_deadline(awaitable: Awaitable[T], name: str = "call") -> T:
+    """Await `awaitable`, cancelling it if the request's deadline passes first."""
+    left = time_left()
+    if left is None:
+        return await awaitable
+    if left <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise DeadlineExceeded(f"Request deadline exceeded before the {name}")
+    try:
+        return await asyncio.wait_for(awaitable, left)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(f"Request deadline exceeded during the {name}")
+
+
+class Bulkhead:
+    """
+    Concurrency limit with a bounded wait queue for one downstream service.
+
+    Up to `max_concurrency` calls run at once and up to `max_queue` more wait,
+    first come first served. Callers beyond that are rejected right away with
+    `Overloaded`, and waiting callers give up with `DeadlineExceeded` once
+    their request's deadline has passed, so a spike fails fast instead of
+    piling up on the service.
+
+    Args:
+        name (str): The downstream service's name, used in errors and stats.
+        max_concurrency (int): The number of calls allowed in flight.
+        max_queue (int): The number of callers allowed to wait for a slot.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.shed = 0
+        self.timed_out = 0
+        self._waiters: deque[asyncio.Future] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def __aenter__(self):
+        if self.in_flight < self.max_concurrency and not self._waiters:
+            self.in_flight += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.shed += 1
+            logger.warning("Shedding a %s call, %d are waiting", self.name, self.queued)
+            raise Overloaded(f"Too many requests waiting for {self.name}")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await within_deadline(asyncio.shield(waiter), f"{self.name} queue")
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as this caller gave up
+                self._release()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            if isinstance(e, DeadlineExceeded):
+                self.timed_out += 1
+            raise
+        # The caller that released the slot handed it over, so `in_flight` is unchanged
+
+    async def __aexit__(self, *exc):
+        self._release()
+
+    def _release(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "shed": self.shed,
+            "timed_out": self.timed_out,
+        }
+
+
+embedding_bulkhead = Bulkhead(
+    "embeddings", ADMISSION_EMBEDDING_CONCURRENCY, ADMISSION_EMBEDDING_QUEUE
+)
+qdrant_bulkhead = Bulkhead(
+    "qdrant", ADMISSION_QDRANT_CONCURRENCY, ADMISSION_QDRANT_QUEUE
+)
+llm_bulkhead = Bulkhead("llm", ADMISSION_LLM_CONCURRENCY, ADMISSION_LLM_QUEUE)
+bulkheads = [embedding_bulkhead, qdrant_bulkhead, llm_bulkhead]
+
+
+def bulkhead_samples(attribute: str) -> metrics.Sampler:
+    return lambda: [
+        ({"service": bulkhead.name}, getattr(bulkhead, attribute))
+        for bulkhead in bulkheads
+    ]
+
+
+metrics.registry.register_callback(
+    "rag_qa_admission_in_flight",
+    "Downstream calls in flight",
+    "gauge",
+    bulkhead_samples("in_flight"),
+)
+metrics.registry.register_callback(
+    "rag_qa_admission_queued",
+    "Callers waiting to call a downstream service",
+    "gauge",
+    bulkhead_samples("queued"),
+)
+metrics.registry.register_callback(
+    "rag_qa_admission_shed_total",
+    "Calls rejected because the wait queue was full",
+    "counter",
+    bulkhead_samples("shed"),
+)
+metrics.registry.register_callback(
+    "rag_qa_admission_timed_out_total",
+    "Callers whose deadline passed while queued",
+    "counter",
+    bulkhead_samples("timed_out"),
+)
+
+
+class Slot:
+    """A slot taken in a bulkhead; releasing it more than once has no effect."""
+
+    def __init__(self, bulkhead: Bulkhead):
+        self.bulkhead = bulkhead
+        self.held = True
+
+    def release(self) -> None:
+        if self.held:
+            self.held = False
+            self.bulkhead._release()
+
+
+async def acquire(bulkhead: Bulkhead) -> Slot:
+    """
+    Take a slot in `bulkhead`, waiting within the request's deadline.
+
+    For calls that outlive the caller's scope, such as a streamed response: the
+    slot is taken before the response starts, so a shed or timed out request
+    still gets a 429/503, and is released by whatever finishes the call.
+    """
+    await bulkhead.__aenter__()
+    return Slot(bulkhead)
+
+
+async def admit(bulkhead: Bulkhead, awaitable: Awaitable[T]) -> T:
+    """Run a downstream call within its bulkhead and the request's deadline."""
+    try:
+        async with bulkhead:
+            return await within_deadline(awaitable, f"{bulkhead.name} call")
+    finally:
+        # Don't leave the coroutine unawaited if it was rejected before starting
+        if (
+            asyncio.iscoroutine(awaitable)
+            and inspect.getcoroutinestate(awaitable) == inspect.CORO_CREATED
+        ):
+            awaitable.close()
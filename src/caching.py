@@ -0,0 +1,288 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable
+from dataclasses import dataclass
+from typing import Any, TypeVar
+
+import numpy as np
+
+from src import metrics
+from src.admission import start_without_deadline, within_deadline
+
+# How long retrieved chunks are reused for the same document and topic; set
+# RETRIEVAL_CACHE_TTL to 0 to disable the cache
+RETRIEVAL_CACHE_TTL = float(os.environ.get("RETRIEVAL_CACHE_TTL", "300"))
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.environ.get("RETRIEVAL_CACHE_MAX_ENTRIES", "1024"))
+# How long generated answers are reused; set LLM_CACHE_TTL to 0 to disable the cache
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", "3600"))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "2048"))
+# Cosine similarity above which a topic reuses the answer generated for another
+# topic of the same document and endpoint; 0 disables the semantic lookup
+LLM_SEMANTIC_CACHE_THRESHOLD = float(
+    os.environ.get("LLM_SEMANTIC_CACHE_THRESHOLD", "0")
+)
+
+T = TypeVar("T")
+
+
+class TTLCache:
+    """
+    In-memory LRU cache whose entries expire `ttl` seconds after they were stored.
+
+    Args:
+        ttl (float): Seconds an entry stays valid.
+        max_entries (int): Maximum number of entries; the least recently used are evicted.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any | None:
+        """Return the value stored under `key`, or None if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SemanticCache:
+    """
+    In-memory cache looked up by embedding similarity instead of by exact key.
+
+    Entries live in namespaces (e.g. a document and an endpoint), and a lookup
+    returns the value of the most similar entry in its namespace if the cosine
+    similarity reaches `threshold`. Entries expire `ttl` seconds after they were
+    stored, and the oldest are evicted beyond `max_entries`.
+
+    Args:
+        ttl (float): Seconds an entry stays valid.
+        threshold (float): The minimum cosine similarity of a hit.
+        max_entries (int): Maximum number of entries over all namespaces.
+    """
+
+    def __init__(self, ttl: float, threshold: float, max_entries: int = 2048):
+        self.ttl = ttl
+        self.threshold = threshold
+        self.max_entries = max_entries
+
+        # namespace -> key -> (expiry, normalized vector, value)
+        self._namespaces: dict[Hashable, dict[Hashable, tuple]] = {}
+        self._order: OrderedDict[tuple[Hashable, Hashable], None] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remove(self, namespace: Hashable, key: Hashable) -> None:
+        entries = self._namespaces[namespace]
+        del entries[key]
+        if not entries:
+            del self._namespaces[namespace]
+        self._order.pop((namespace, key), None)
+
+    def get(self, namespace: Hashable, vector: list[float]) -> Any | None:
+        """Return the value of the most similar unexpired entry, if it is similar enough."""
+        query = np.asarray(vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        now = time.monotonic()
+        with self._lock:
+            entries = self._namespaces.get(namespace, {})
+            for key in [key for key, entry in entries.items() if entry[0] <= now]:
+                self._remove(namespace, key)
+            entries = self._namespaces.get(namespace)
+            if not entries:
+                return None
+            values = list(entries.values())
+            scores = np.stack([entry[1] for entry in values]) @ query
+            best = int(np.argmax(scores))
+            return values[best][2] if scores[best] >= self.threshold else None
+
+    def put(
+        self, namespace: Hashable, key: Hashable, vector: list[float], value: Any
+    ) -> None:
+        normalized = np.asarray(vector, dtype=np.float32)
+        normalized /= np.linalg.norm(normalized) or 1.0
+        with self._lock:
+            self._namespaces.setdefault(namespace, {})[key] = (
+                time.monotonic() + self.ttl,
+                normalized,
+                value,
+            )
+            self._order[(namespace, key)] = None
+            self._order.move_to_end((namespace, key))
+            while len(self._order) > self.max_entries:
+                self._remove(*next(iter(self._order)))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._namespaces.clear()
+            self._order.clear()
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key into one.
+
+    The first caller for a key starts the work as a task; callers arriving while
+    it runs wait for the same task instead of starting their own. Every caller
+    gets its result, or its exception. The task doesn't inherit the first
+    caller's request deadline; instead each caller waits for it within its own.
+    A caller being cancelled or running out of time doesn't affect the others,
+    and the work is only cancelled once nobody is waiting for it.
+    """
+
+    def __init__(self):
+        self.shared = 0
+        # key -> (task, number of callers waiting for it)
+        self._calls: dict[Hashable, list] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """Return the result of `fn()`, sharing one call among concurrent callers with the same key."""
+        call = self._calls.get(key)
+        if call is None:
+            task = start_without_deadline(fn())
+            call = self._calls[key] = [task, 0]
+            task.add_done_callback(lambda _: self._forget(key, call))
+        else:
+            self.shared += 1
+        call[1] += 1
+        try:
+            return await within_deadline(asyncio.shield(call[0]), "shared call")
+        finally:
+            call[1] -= 1
+            if call[1] == 0 and not call[0].done():
+                # Later callers must start afresh rather than join a cancelled call
+                self._forget(key, call)
+                call[0].cancel()
+
+    def _forget(self, key: Hashable, call: list) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+
+@dataclass
+class CachedResponse:
+    text: str
+    # How long generating the response took, i.e. what each hit saves
+    generation_seconds: float
+
+
+@dataclass
+class ResponseCacheStats:
+    exact_hits: int = 0
+    semantic_hits: int = 0
+    misses: int = 0
+    latency_saved_seconds: float = 0.0
+
+    def record_hit(self, kind: str, response: CachedResponse) -> None:
+        if kind == "semantic":
+            self.semantic_hits += 1
+        else:
+            self.exact_hits += 1
+        self.latency_saved_seconds += response.generation_seconds
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_ratio": self.hit_ratio,
+            "latency_saved_seconds": self.latency_saved_seconds,
+        }
+
+
+retrieval_cache = (
+    TTLCache(ttl=RETRIEVAL_CACHE_TTL, max_entries=RETRIEVAL_CACHE_MAX_ENTRIES)
+    if RETRIEVAL_CACHE_TTL > 0
+    else None
+)
+
+response_cache = (
+    TTLCache(ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES)
+    if LLM_CACHE_TTL > 0
+    else None
+)
+semantic_response_cache = (
+    SemanticCache(
+        ttl=LLM_CACHE_TTL,
+        threshold=LLM_SEMANTIC_CACHE_THRESHOLD,
+        max_entries=LLM_CACHE_MAX_ENTRIES,
+    )
+    if LLM_CACHE_TTL > 0 and LLM_SEMANTIC_CACHE_THRESHOLD > 0
+    else None
+)
+response_cache_stats = ResponseCacheStats()
+
+metrics.registry.register_callback(
+    "rag_qa_response_cache_hits_total",
+    "Generations answered from the cache, by kind (exact or semantic)",
+    "counter",
+    lambda: [
+        ({"kind": "exact"}, response_cache_stats.exact_hits),
+        ({"kind": "semantic"}, response_cache_stats.semantic_hits),
+    ],
+)
+metrics.registry.register_callback(
+    "rag_qa_response_cache_misses_total",
+    "Generations not found in the cache",
+    "counter",
+    lambda: [({}, response_cache_stats.misses)],
+)
+metrics.registry.register_callback(
+    "rag_qa_response_cache_saved_seconds_total",
+    "Generation time saved by cache hits",
+    "counter",
+    lambda: [({}, response_cache_stats.latency_saved_seconds)],
+)
+metrics.registry.register_callback(
+    "rag_qa_retrieval_cache_lookups_total",
+    "Retrieval cache lookups, by result (hit or miss)",
+    "counter",
+    lambda: (
+        []
+        if retrieval_cache is None
+        else [
+            ({"result": "hit"}, retrieval_cache.hits),
+            ({"result": "miss"}, retrieval_cache.misses),
+        ]
+    ),
+)
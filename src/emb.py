@@ -1,53 +1,86 @@
+import asyncio
 import os
 
-import requests
-
-from src.utils import create_logger, log_execution_time
-
-JINA_API_KEY = os.environ.get("JINA_API_KEY")
-MODEL = os.environ.get("JINA_MODEL", "jina-embeddings-v3")
-EMBEDDING_DIMENSION = 1024
-
-URL = "https://api.jina.ai/v1/embeddings"
+from src import metrics
+from src.admission import admit, embedding_bulkhead
+from src.caching import SingleFlight
+from src.emb_cache import EmbeddingCache
+from src.embedders import EMBEDDING_BACKEND, Embedder, create_embedder
+from src.utils import create_logger
+
+# Embedding cache; set EMBEDDING_CACHE_PATH to an empty string to disable it
+EMBEDDING_CACHE_PATH = os.environ.get(
+    "EMBEDDING_CACHE_PATH", ".cache/embeddings.sqlite3"
+)
+EMBEDDING_CACHE_MAX_ENTRIES = int(
+    os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", "200000")
+)
+EMBEDDING_CACHE_MEMORY_ENTRIES = int(
+    os.environ.get("EMBEDDING_CACHE_MEMORY_ENTRIES", "4096")
+)
 
 logger = create_logger(logger_name="embedding", log_file="api.log", log_level="info")
 
-headers = {
-    "Content-Type": "application/json",
-    "Authorization": f"Bearer {JINA_API_KEY}",
-}
-
-
-def request_embeddings(
-    input: str | list[str],
-    task: str = "retrieval.passage",
-    model: str = MODEL,
-    dimensions: int = EMBEDDING_DIMENSION,
-    late_chunking: bool = True,
-):
-    data = {
-        "input": input,
-        "model": MODEL,
-        "dimensions": EMBEDDING_DIMENSION,
-        "task": "retrieval.passage",
-        "late_chunking": True,
-    }
-    try:
-        response = requests.post(URL, headers=headers, json=data)
-        return [d["embedding"] for d in response.json()["data"]]
-    except Exception as e:
-        logger.exception(f"Failed to generate embeddigns: {e}\nResponse: {response}")
-        raise
-
-
-@log_execution_time(logger=logger)
-def embed_texts(texts: list[str]) -> list[list[float]]:
+cache = (
+    EmbeddingCache(
+        path=EMBEDDING_CACHE_PATH,
+        max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+        memory_entries=EMBEDDING_CACHE_MEMORY_ENTRIES,
+    )
+    if EMBEDDING_CACHE_PATH
+    else None
+)
+
+metrics.registry.register_callback(
+    "rag_qa_embedding_cache_lookups_total",
+    "Embedding cache lookups, by result (hit or miss)",
+    "counter",
+    lambda: (
+        []
+        if cache is None
+        else [({"result": "hit"}, cache.hits), ({"result": "miss"}, cache.misses)]
+    ),
+)
+metrics.registry.register_callback(
+    "rag_qa_embedding_cache_evictions_total",
+    "Embeddings evicted from the cache to stay within its size",
+    "counter",
+    lambda: [] if cache is None else [({}, cache.evictions)],
+)
+
+_embedder: Embedder | None = None
+
+in_flight = SingleFlight()
+
+
+def get_embedder() -> Embedder:
+    """Return the embedding backend selected by `EMBEDDING_BACKEND`, creating it on first use."""
+    global _embedder
+    if _embedder is None:
+        _embedder = create_embedder(EMBEDDING_BACKEND)
+    return _embedder
+
+
+async def close_embedder() -> None:
+    if _embedder is not None:
+        await _embedder.close()
+
+
+def cache_key(embedder: Embedder, text: str, task: str) -> str:
+    # Only passages are embedded with late chunking
+    late_chunking = embedder.late_chunking and task == "retrieval.passage"
+    return cache.make_key(text, embedder.model, task, embedder.dimension, late_chunking)
+
+
+@metrics.instrument("embedding_batch", logger=logger)
+async def embed_texts(texts: list[str]) -> list[list[float]]:
     """
-    Get embeddings for a list of texts from the Jina API.
+    Get embeddings for a list of passages, only sending cache misses to the backend.
 
-    This function implements a simple batching algorithm to avoid rate limiting.
-    It sends requests in chunks of 8 texts at a time. This needs to be refactored
-    to send concurrent requests for better performance.
+    Note that the Jina backend embeds passages with late chunking, so strictly
+    speaking their embeddings depend on the neighbouring texts in the same
+    request. The cache treats them as context-free, which is what makes
+    re-uploads free.
 
     Args:
         texts (list[str]): A list of text strings to be embedded.
@@ -55,19 +88,30 @@ def embed_texts(texts: list[str]) -> list[list[float]]:
     Returns:
         list[list[float]]: A list of embeddings, where each embedding is a list of floats.
     """
-    full_embeddings = []
-    for i in range(0, len(texts), 8):
-        batch = texts[i : i + 8]
-        batch_embeddings = request_embeddings(input=batch, task="retrieval.passage")
-        full_embeddings.extend(batch_embeddings)
+    embedder = get_embedder()
+    if cache is None:
+        return await embedder.embed_passages(texts)
+
+    keys = [cache_key(embedder, text, "retrieval.passage") for text in texts]
+    # SQLite lookups are quick but blocking, so keep them off the event loop
+    cached = await asyncio.to_thread(cache.get_many, keys)
+
+    # Deduplicate the misses so a repeated chunk is only embedded once
+    missing = {key: text for key, text in zip(keys, texts) if key not in cached}
+    if missing:
+        fresh = await embedder.embed_passages(list(missing.values()))
+        fresh_by_key = dict(zip(missing, fresh))
+        await asyncio.to_thread(cache.put_many, fresh_by_key)
+        cached.update(fresh_by_key)
+    logger.info("Embedding cache: %d/%d hits", len(texts) - len(missing), len(texts))
 
-    return full_embeddings
+    return [cached[key] for key in keys]
 
 
-@log_execution_time(logger=logger)
-def embed_query(query: str) -> list[float]:
+@metrics.instrument("query_embed", logger=logger)
+async def embed_query(query: str) -> list[float]:
     """
-    Get an embedding for a single query from the Jina API.
+    Get an embedding for a single query, consulting the cache before the backend.
 
     Args:
         query (str): The query text to be embedded.
@@ -75,5 +119,48 @@ def embed_query(query: str) -> list[float]:
     Returns:
         list[float]: The embedding for the query, represented as a list of floats.
     """
-    batch_embeddings = request_embeddings(input=query, task="retrieval.query")
-    return batch_embeddings[0]
+    # Concurrent requests for the same query share one lookup
+    return await in_flight.do(query, lambda: fetch_query_embedding(query))
+
+
+async def fetch_query_embedding(query: str) -> list[float]:
+    embedder = get_embedder()
+    if cache is None:
+        return await admit(embedding_bulkhead, embedder.embed_query(query))
+
+    key = cache_key(embedder, query, "retrieval.query")
+    cached = await asyncio.to_thread(cache.get_many, [key])
+    if key in cached:
+        return cached[key]
+
+    embedding = await admit(embedding_bulkhead, embedder.embed_query(query))
+    await asyncio.to_thread(cache.put_many, {key: embedding})
+    return embedding
+
+
+@metrics.instrument("query_embed", logger=logger)
+async def embed_queries(queries: list[str]) -> list[list[float]]:
+    """
+    Get embeddings for several queries, sending all cache misses in one backend call.
+
+    Args:
+        queries (list[str]): The query texts to be embedded.
+
+    Returns:
+        list[list[float]]: The embeddings, in the same order as `queries`.
+    """
+    embedder = get_embedder()
+    if cache is None:
+        return await admit(embedding_bulkhead, embedder.embed_queries(queries))
+
+    keys = [cache_key(embedder, query, "retrieval.query") for query in queries]
+    cached = await asyncio.to_thread(cache.get_many, keys)
+    missing = {key: query for key, query in zip(keys, queries) if key not in cached}
+    if missing:
+        fresh = await admit(
+            embedding_bulkhead, embedder.embed_queries(list(missing.values()))
+        )
+        fresh_by_key = dict(zip(missing, fresh))
+        await asyncio.to_thread(cache.put_many, fresh_by_key)
+        cached.update(fresh_by_key)
+    return [cached[key] for key in keys]
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache with an in-memory LRU in front of SQLite.
+
+    Entries are keyed by a hash of everything that influences the embedding
+    (text, model, task, dimensions and late chunking) and stored as float32 blobs.
+    The on-disk store is bounded by `max_entries`; once it grows past that, the
+    least recently used rows are evicted.
+
+    Args:
+        path (str): Path of the SQLite database, or ":memory:" for a process-local cache.
+        max_entries (int): Maximum number of embeddings kept on disk.
+        memory_entries (int): Maximum number of embeddings kept in the in-memory LRU.
+    """
+
+    def __init__(
+        self, path: str, max_entries: int = 200_000, memory_entries: int = 4096
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lru: OrderedDict[str, array] = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        # Rows on disk, counted once on open and then kept up to date, so that
+        # puts don't scan the table (rows added by other processes aren't seen)
+        self._rows = 0
+
+    @staticmethod
+    def make_key(
+        text: str, model: str, task: str, dimensions: int, late_chunking: bool
+    ) -> str:
+        payload = json.dumps([text, model, task, dimensions, late_chunking])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _connection(self) -> sqlite3.Connection:
+        # Opened lazily so importing the module never touches the filesystem
+        if self._conn is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)"
+            )
+            (self._rows,) = self._conn.execute(
+                "SELECT COUNT(*) FROM embeddings"
+            ).fetchone()
+        return self._conn
+
+    def _remember(self, key: str, vector: array) -> None:
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.memory_entries:
+            self._lru.popitem(last=False)
+
+    def get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        """
+        Look up several keys at once.
+
+        Args:
+            keys (list[str]): Cache keys built with `make_key`.
+
+        Returns:
+            dict[str, list[float]]: The embeddings that were found, by key.
+        """
+        found: dict[str, array] = {}
+        with self._lock:
+            missing = []
+            for key in keys:
+                vector = self._lru.get(key)
+                if vector is not None:
+                    self._lru.move_to_end(key)
+                    found[key] = vector
+                else:
+                    missing.append(key)
+
+            if missing:
+                conn = self._connection()
+                unique_missing = list(dict.fromkeys(missing))
+                # SQLite limits the number of bound parameters per statement
+                for i in range(0, len(unique_missing), 500):
+                    chunk = unique_missing[i : i + 500]
+                    placeholders = ",".join("?" * len(chunk))
+                    rows = conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                        chunk,
+                    ).fetchall()
+                    for key, blob in rows:
+                        vector = array("f")
+                        vector.frombytes(blob)
+                        found[key] = vector
+                        self._remember(key, vector)
+                    if rows:
+                        conn.execute(
+                            f"UPDATE embeddings SET last_used = ? WHERE key IN ({','.join('?' * len(rows))})",
+                            [time.time(), *(key for key, _ in rows)],
+                        )
+                conn.commit()
+
+            hits = sum(1 for key in keys if key in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+
+        return {key: vector.tolist() for key, vector in found.items()}
+
+    def put_many(self, items: dict[str, list[float]]) -> None:
+        """
+        Store several embeddings at once, evicting the oldest rows if needed.
+
+        Args:
+            items (dict[str, list[float]]): Embeddings by cache key.
+        """
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            rows = []
+            for key, embedding in items.items():
+                vector = array("f", embedding)
+                self._remember(key, vector)
+                rows.append((key, vector.tobytes(), now))
+
+            conn = self._connection()
+            # Inserting and updating separately tells the new rows apart
+            inserted = conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                rows,
+            ).rowcount
+            conn.executemany(
+                "UPDATE embeddings SET vector = ?, last_used = ? WHERE key = ?",
+                [(blob, last_used, key) for key, blob, last_used in rows],
+            )
+            self._rows += inserted
+            overflow = self._rows - self.max_entries
+            if overflow > 0:
+                evicted = conn.execute(
+                    "DELETE FROM embeddings WHERE key IN ("
+                    "SELECT key FROM embeddings ORDER BY last_used, rowid LIMIT ?)",
+                    (overflow,),
+                ).rowcount
+                self._rows -= evicted
+                self.evictions += evicted
+            conn.commit()
+
+    def stats(self) -> dict:
+        """Return the hit/miss/eviction counters and the current hit ratio."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._lru),
+        }
+
+    def clear(self) -> None:
+        """Drop every cached embedding and reset the counters."""
+        with self._lock:
+            self._lru.clear()
+            conn = self._connection()
+            conn.execute("DELETE FROM embeddings")
+            conn.commit()
+            self._rows = 0
+            self.hits = self.misses = self.evictions = 0
@@ -0,0 +1,510 @@
+import abc
+import asyncio
+import hashlib
+import importlib
+import os
+import re
+import threading
+
+import httpx
+
+from src.ratelimit import RateLimiter
+from src.tokens import count_tokens
+from src.utils import create_logger
+
+# "jina", "local", "fake" or the import path of an `Embedder` subclass ("package.module:Class")
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "jina")
+EMBEDDING_DIMENSION = int(os.environ.get("EMBEDDING_DIMENSION", "1024"))
+
+JINA_API_KEY = os.environ.get("JINA_API_KEY")
+JINA_MODEL = os.environ.get("JINA_MODEL", "jina-embeddings-v3")
+JINA_API_URL = os.environ.get("JINA_API_URL", "https://api.jina.ai/v1/embeddings")
+REQUEST_TIMEOUT = float(os.environ.get("EMBEDDING_REQUEST_TIMEOUT", "30"))
+
+# Batching and concurrency knobs for the Jina backend
+BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "8"))
+MAX_CONCURRENCY = int(os.environ.get("EMBEDDING_MAX_CONCURRENCY", "4"))
+MAX_RETRIES = int(os.environ.get("EMBEDDING_MAX_RETRIES", "3"))
+RETRY_BACKOFF = float(os.environ.get("EMBEDDING_RETRY_BACKOFF", "0.5"))
+# Client-side budgets for the Jina API (0 means unlimited), and the request
+# latency above which concurrency is reduced
+REQUESTS_PER_MINUTE = float(os.environ.get("EMBEDDING_REQUESTS_PER_MINUTE", "0"))
+TOKENS_PER_MINUTE = float(os.environ.get("EMBEDDING_TOKENS_PER_MINUTE", "0"))
+LATENCY_TARGET = float(os.environ.get("EMBEDDING_LATENCY_TARGET", "10"))
+
+# Local backend: a sentence-transformers model directory, or a directory holding
+# `model.onnx` and `tokenizer.json` with LOCAL_EMBEDDING_RUNTIME=onnx
+LOCAL_EMBEDDING_MODEL_PATH = os.environ.get(
+    "LOCAL_EMBEDDING_MODEL_PATH", "models/embedding"
+)
+LOCAL_EMBEDDING_RUNTIME = os.environ.get(
+    "LOCAL_EMBEDDING_RUNTIME", "sentence-transformers"
+)
+# The size of the local model's embeddings; 0 finds it out by embedding a text,
+# which loads the model
+LOCAL_EMBEDDING_DIMENSION = int(os.environ.get("LOCAL_EMBEDDING_DIMENSION", "0"))
+LOCAL_EMBEDDING_MAX_BATCH = int(os.environ.get("LOCAL_EMBEDDING_MAX_BATCH", "32"))
+LOCAL_EMBEDDING_MAX_WAIT_MS = float(os.environ.get("LOCAL_EMBEDDING_MAX_WAIT_MS", "5"))
+# Instruction prefixes some models expect (e.g. "query: " / "passage: " for E5)
+LOCAL_EMBEDDING_QUERY_PREFIX = os.environ.get("LOCAL_EMBEDDING_QUERY_PREFIX", "")
+LOCAL_EMBEDDING_PASSAGE_PREFIX = os.environ.get("LOCAL_EMBEDDING_PASSAGE_PREFIX", "")
+
+logger = create_logger(logger_name="embedding", log_file="api.log", log_level="info")
+
+
+class Embedder(abc.ABC):
+    """
+    Interface for embedding backends.
+
+    Passages and queries may be embedded differently (asymmetric models), so they
+    have separate methods. `model`, `dimension` and `late_chunking` identify the
+    embeddings a backend produces and are part of the embedding cache key.
+    """
+
+    model: str
+    late_chunking: bool = False
+
+    @property
+    @abc.abstractmethod
+    def dimension(self) -> int:
+        """The size of the embeddings."""
+
+    @property
+    @abc.abstractmethod
+    def max_batch_size(self) -> int:
+        """The largest number of texts embedded together."""
+
+    @abc.abstractmethod
+    async def embed_passages(self, texts: list[str]) -> list[list[float]]:
+        """Embed passages for storage, returning embeddings in input order."""
+
+    @abc.abstractmethod
+    async def embed_query(self, query: str) -> list[float]:
+        """Embed a search query."""
+
+    async def embed_queries(self, queries: list[str]) -> list[list[float]]:
+        """Embed several search queries, returning embeddings in input order."""
+        return list(await asyncio.gather(*map(self.embed_query, queries)))
+
+    async def warm_up(self) -> None:
+        """Get ready to embed (open connections, load the model) ahead of the first request."""
+
+    async def close(self) -> None:
+        pass
+
+
+class JinaEmbedder(Embedder):
+    """
+    Embeds texts with the Jina embeddings API.
+
+    Passages are sent in batches of `batch_size`, with late chunking; queries
+    are embedded on their own, without it. Requests go through a
+    `RateLimiter`, which keeps them within the request and token budgets, allows
+    up to `max_concurrency` in flight (fewer while the API is rate limiting or
+    slow) and retries failures with jittered exponential backoff.
+
+    Args:
+        url (str): The embeddings endpoint.
+        api_key (str | None): The Jina API key.
+        model (str): The Jina model name.
+        dimension (int): The requested embedding size (Matryoshka truncation).
+        batch_size (int): The number of texts sent in a single request.
+        max_concurrency (int): The maximum number of requests in flight.
+        max_retries (int): How many times a failed batch is retried.
+        retry_backoff (float): Base retry delay in seconds, doubled after every failure.
+        timeout (float): The request timeout in seconds.
+        requests_per_minute (float): The request budget; 0 means unlimited.
+        tokens_per_minute (float): The token budget; 0 means unlimited.
+    """
+
+    late_chunking = True
+
+    def __init__(
+        self,
+        url: str = JINA_API_URL,
+        api_key: str | None = JINA_API_KEY,
+        model: str = JINA_MODEL,
+        dimension: int = EMBEDDING_DIMENSION,
+        batch_size: int = BATCH_SIZE,
+        max_concurrency: int = MAX_CONCURRENCY,
+        max_retries: int = MAX_RETRIES,
+        retry_backoff: float = RETRY_BACKOFF,
+        timeout: float = REQUEST_TIMEOUT,
+        requests_per_minute: float = REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = TOKENS_PER_MINUTE,
+    ):
+        self.url = url
+        self.model = model
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.timeout = timeout
+        self.headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}",
+        }
+        self.rate_limiter = RateLimiter(
+            "jina-embeddings",
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+            max_concurrency=max_concurrency,
+            max_retries=max_retries,
+            retry_backoff=retry_backoff,
+            latency_target=LATENCY_TARGET,
+        )
+        self._dimension = dimension
+        self._http_client: httpx.AsyncClient | None = None
+        self._http_client_loop: asyncio.AbstractEventLoop | None = None
+
+    @property
+    def dimension(self) -> int:
+        return self._dimension
+
+    @property
+    def max_batch_size(self) -> int:
+        return self.batch_size
+
+    def get_http_client(self) -> httpx.AsyncClient:
+        """
+        Return the shared HTTP client for the embeddings API.
+
+        Connections are pooled per event loop, so a new client is created if the
+        running loop changed (e.g. between test cases).
+        """
+        loop = asyncio.get_running_loop()
+        if self._http_client is None or self._http_client_loop is not loop:
+            self._http_client = httpx.AsyncClient(
+                headers=self.headers, timeout=self.timeout
+            )
+            self._http_client_loop = loop
+        return self._http_client
+
+    async def warm_up(self) -> None:
+        # Any response will do, the point is to have a connection in the pool
+        try:
+            await self.get_http_client().head(self.url)
+        except httpx.HTTPError as e:
+            logger.warning("Failed to connect to %s: %s", self.url, e)
+
+    async def close(self) -> None:
+        if self._http_client is not None:
+            await self._http_client.aclose()
+        self._http_client = self._http_client_loop = None
+
+    async def request_embeddings(
+        self,
+        input: str | list[str],
+        task: str = "retrieval.passage",
+        late_chunking: bool = False,
+    ) -> list[list[float]]:
+        data = {
+            "input": input,
+            "model": self.model,
+            "dimensions": self.dimension,
+            "task": task,
+            "late_chunking": late_chunking,
+        }
+        response = None
+        try:
+            response = await self.get_http_client().post(self.url, json=data)
+            response.raise_for_status()
+            return [d["embedding"] for d in response.json()["data"]]
+        except Exception:
+            logger.exception("Failed to generate embeddings, response: %s", response)
+            raise
+
+    async def limited_request(
+        self, input: str | list[str], task: str, late_chunking: bool = False
+    ) -> list[list[float]]:
+        """`request_embeddings` within the rate limits, retried on failure."""
+        texts = [input] if isinstance(input, str) else input
+        return await self.rate_limiter.call(
+            lambda: self.request_embeddings(
+                input=input, task=task, late_chunking=late_chunking
+            ),
+            tokens=sum(map(count_tokens, texts)),
+        )
+
+    async def embed_batch(self, batch: list[str]) -> list[list[float]]:
+        """
+        Embed a single batch of passages, retrying failed requests with jittered exponential backoff.
+
+        Args:
+            batch (list[str]): The texts to embed in one request.
+
+        Returns:
+            list[list[float]]: The embeddings for the batch, in input order.
+        """
+        return await self.limited_request(
+            input=batch, task="retrieval.passage", late_chunking=self.late_chunking
+        )
+
+    async def embed_passages(self, texts: list[str]) -> list[list[float]]:
+        size = self.batch_size
+        batches = [texts[i : i + size] for i in range(0, len(texts), size)]
+        if not batches:
+            return []
+        # The rate limiter bounds how many batches are in flight. `gather`
+        # returns results in submission order, which keeps the output aligned
+        # with `texts` regardless of which request finishes first.
+        batch_embeddings = await asyncio.gather(*map(self.embed_batch, batches))
+        return [emb for batch in batch_embeddings for emb in batch]
+
+    async def embed_query(self, query: str) -> list[float]:
+        return (await self.limited_request(input=query, task="retrieval.query"))[0]
+
+    async def embed_queries(self, queries: list[str]) -> list[list[float]]:
+        if not queries:
+            return []
+        # Queries are independent, so late chunking would mix them together
+        return await self.limited_request(input=queries, task="retrieval.query")
+
+
+class LocalEmbedder(Embedder):
+    """
+    Embeds texts on the CPU with a model loaded from a local directory.
+
+    Requests from concurrent callers are coalesced into batches of up to
+    `max_batch_size` texts: a batch is run as soon as it is full, or once the
+    oldest text in it has waited `max_wait_ms`. Only one batch runs at a time,
+    in a worker thread, since the model already uses every core.
+
+    The model is loaded on first use. The "sentence-transformers" runtime needs
+    the `sentence-transformers` package; the "onnx" runtime needs `onnxruntime`
+    and `tokenizers`, and mean-pools the token embeddings of `model.onnx`.
+
+    Args:
+        model_path (str): The directory holding the model.
+        runtime (str): "sentence-transformers" or "onnx".
+        dimension (int): The size of the embeddings, or 0 to find it out from
+            the model, which loads it.
+        max_batch_size (int): The largest number of texts embedded together.
+        max_wait_ms (float): How long a text may wait for its batch to fill up.
+        query_prefix (str): Prepended to queries.
+        passage_prefix (str): Prepended to passages.
+    """
+
+    def __init__(
+        self,
+        model_path: str = LOCAL_EMBEDDING_MODEL_PATH,
+        runtime: str = LOCAL_EMBEDDING_RUNTIME,
+        dimension: int = LOCAL_EMBEDDING_DIMENSION,
+        max_batch_size: int = LOCAL_EMBEDDING_MAX_BATCH,
+        max_wait_ms: float = LOCAL_EMBEDDING_MAX_WAIT_MS,
+        query_prefix: str = LOCAL_EMBEDDING_QUERY_PREFIX,
+        passage_prefix: str = LOCAL_EMBEDDING_PASSAGE_PREFIX,
+    ):
+        if runtime not in ("sentence-transformers", "onnx"):
+            raise ValueError(f"Unknown local embedding runtime: {runtime}")
+        self.model = f"local:{os.path.basename(os.path.normpath(model_path))}"
+        self.model_path = model_path
+        self.runtime = runtime
+        self.max_wait = max_wait_ms / 1000
+        self.query_prefix = query_prefix
+        self.passage_prefix = passage_prefix
+        self._max_batch_size = max_batch_size
+        self._encoder = None
+        self._dimension = dimension or None
+        self._load_lock = threading.Lock()
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+
+    @property
+    def dimension(self) -> int:
+        # Blocks while the model loads, unless `warm_up` has run
+        if self._dimension is None:
+            self._dimension = len(self.encode(["dimension probe"])[0])
+        return self._dimension
+
+    @property
+    def max_batch_size(self) -> int:
+        return self._max_batch_size
+
+    def _load_sentence_transformer(self):
+        from sentence_transformers import SentenceTransformer
+
+        model = SentenceTransformer(self.model_path, device="cpu")
+        return lambda texts: model.encode(
+            texts, batch_size=len(texts), normalize_embeddings=True
+        )
+
+    def _load_onnx(self):
+        import numpy as np
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        tokenizer = Tokenizer.from_file(os.path.join(self.model_path, "tokenizer.json"))
+        tokenizer.enable_padding()
+        tokenizer.enable_truncation(max_length=512)
+        session = onnxruntime.InferenceSession(
+            os.path.join(self.model_path, "model.onnx"),
+            providers=["CPUExecutionProvider"],
+        )
+        input_names = {i.name for i in session.get_inputs()}
+
+        def encode(texts):
+            encodings = tokenizer.encode_batch(texts)
+            ids = np.array([e.ids for e in encodings], dtype=np.int64)
+            mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            inputs = {"input_ids": ids, "attention_mask": mask}
+            if "token_type_ids" in input_names:
+                inputs["token_type_ids"] = np.zeros_like(ids)
+            tokens = session.run(None, inputs)[0]
+            summed = (tokens * mask[..., None]).sum(axis=1)
+            pooled = summed / np.maximum(mask.sum(axis=1, keepdims=True), 1)
+            return pooled / np.linalg.norm(pooled, axis=1, keepdims=True)
+
+        return encode
+
+    def encode(self, texts: list[str]) -> list[list[float]]:
+        """Embed texts synchronously, loading the model on first use."""
+        with self._load_lock:
+            if self._encoder is None:
+                logger.info("Loading %s model from %s", self.runtime, self.model_path)
+                if self.runtime == "onnx":
+                    self._encoder = self._load_onnx()
+                else:
+                    self._encoder = self._load_sentence_transformer()
+        return [list(map(float, vector)) for vector in self._encoder(texts)]
+
+    def _get_queue(self) -> asyncio.Queue:
+        # The batching worker is bound to the running loop, like the HTTP clients
+        if self._worker is None or self._worker.get_loop() is not (
+            asyncio.get_running_loop()
+        ):
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._batch_worker(self._queue))
+        return self._queue
+
+    async def _batch_worker(self, queue: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(items) < self.max_batch_size:
+                try:
+                    items.append(queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                vectors = await asyncio.to_thread(
+                    self.encode, [text for text, _ in items]
+                )
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for (_, future), vector in zip(items, vectors):
+                    if not future.done():
+                        future.set_result(vector)
+
+    async def _embed(self, texts: list[str]) -> list[list[float]]:
+        queue = self._get_queue()
+        loop = asyncio.get_running_loop()
+        futures = []
+        for text in texts:
+            future = loop.create_future()
+            queue.put_nowait((text, future))
+            futures.append(future)
+        return list(await asyncio.gather(*futures))
+
+    async def embed_passages(self, texts: list[str]) -> list[list[float]]:
+        return await self._embed([self.passage_prefix + text for text in texts])
+
+    async def embed_query(self, query: str) -> list[float]:
+        return (await self._embed([self.query_prefix + query]))[0]
+
+    async def embed_queries(self, queries: list[str]) -> list[list[float]]:
+        return await self._embed([self.query_prefix + query for query in queries])
+
+    async def warm_up(self) -> None:
+        vector = (await asyncio.to_thread(self.encode, ["warm-up"]))[0]
+        if self._dimension is None:
+            self._dimension = len(vector)
+
+    async def close(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+        self._worker = self._queue = None
+
+
+def hashed_embedding(text: str, dimension: int) -> list[float]:
+    """
+    Deterministic bag-of-words embedding using the hashing trick.
+
+    Each word adds +-1 to a bucket picked by its hash, and the result is
+    L2-normalized, so texts sharing words get a higher dot product.
+    """
+    vector = [0.0] * dimension
+    for word in re.findall(r"\w+", text.lower()):
+        digest = int.from_bytes(
+            hashlib.blake2b(word.encode(), digest_size=8).digest(), "big"
+        )
+        vector[digest % dimension] += 1.0 if digest >> 63 else -1.0
+    norm = sum(x * x for x in vector) ** 0.5
+    if norm == 0:
+        vector[0] = norm = 1.0
+    return [x / norm for x in vector]
+
+
+class FakeEmbedder(Embedder):
+    """
+    Deterministic offline embedder for tests and benchmarks.
+
+    Args:
+        dimension (int): The size of the embeddings.
+        max_batch_size (int): Reported batch size; all texts are embedded at once.
+    """
+
+    def __init__(self, dimension: int = EMBEDDING_DIMENSION, max_batch_size: int = 64):
+        self.model = "fake-hashing"
+        self._dimension = dimension
+        self._max_batch_size = max_batch_size
+
+    @property
+    def dimension(self) -> int:
+        return self._dimension
+
+    @property
+    def max_batch_size(self) -> int:
+        return self._max_batch_size
+
+    async def embed_passages(self, texts: list[str]) -> list[list[float]]:
+        return [hashed_embedding(text, self.dimension) for text in texts]
+
+    async def embed_query(self, query: str) -> list[float]:
+        return hashed_embedding(query, self.dimension)
+
+
+def create_embedder(backend: str = EMBEDDING_BACKEND) -> Embedder:
+    """
+    Build the embedding backend selected by configuration.
+
+    Args:
+        backend (str): "jina", "local", "fake", or the import path of an `Embedder`
+            subclass in the form "package.module:ClassName".
+
+    Returns:
+        Embedder: The embedding backend.
+    """
+    if backend == "jina":
+        return JinaEmbedder()
+    if backend == "local":
+        return LocalEmbedder()
+    if backend == "fake":
+        return FakeEmbedder()
+    module_name, _, class_name = backend.partition(":")
+    embedder_class = getattr(importlib.import_module(module_name), class_name)
+    return embedder_class()
@@ -0,0 +1,207 @@
+import abc
+import asyncio
+import importlib
+import os
+import time
+import uuid
+from collections import OrderedDict
+
+from src.models import JobState, JobStatus
+from src.registry import register_document
+from src.utils import UploadedDocument, create_logger
+from src.vectorstore import (
+    IngestProgress,
+    delete_document,
+    ingest_document,
+    qdrant_connection,
+)
+
+# "inprocess" or the import path of a `JobBackend` subclass ("package.module:Class")
+INGEST_JOB_BACKEND = os.environ.get("INGEST_JOB_BACKEND", "inprocess")
+INGEST_JOB_WORKERS = int(os.environ.get("INGEST_JOB_WORKERS", "2"))
+INGEST_JOB_QUEUE_SIZE = int(os.environ.get("INGEST_JOB_QUEUE_SIZE", "32"))
+INGEST_JOB_RETENTION = int(os.environ.get("INGEST_JOB_RETENTION", "1000"))
+
+logger = create_logger(logger_name="jobs", log_file="api.log", log_level="info")
+
+
+class JobQueueFull(Exception):
+    """Raised when a job can't be accepted because the queue is full."""
+
+
+class IngestJobRecord:
+    """The state of one ingestion job, as tracked by a job backend."""
+
+    def __init__(self, upload: UploadedDocument):
+        self.job_id = str(uuid.uuid4())
+        self.document_id = str(uuid.uuid4())
+        self.upload = upload
+        self.progress = IngestProgress()
+        self.state = JobState.Queued
+        self.error: str | None = None
+        self.queued_at = time.time()
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+
+    def status(self) -> JobStatus:
+        started, finished = self.started_at, self.finished_at
+        return JobStatus(
+            job_id=self.job_id,
+            document_id=self.document_id,
+            file_name=self.upload.name,
+            state=self.state,
+            pages_processed=self.progress.pages_processed,
+            chunks_processed=self.progress.chunks_processed,
+            error=self.error,
+            queued_at=self.queued_at,
+            started_at=started,
+            finished_at=finished,
+            queue_seconds=started - self.queued_at if started else None,
+            run_seconds=(finished or time.time()) - started if started else None,
+        )
+
+
+async def run_ingest_job(job: IngestJobRecord) -> None:
+    """Ingest the job's upload under its pre-assigned document id."""
+    client = await qdrant_connection.get_client()
+    document_metadata = await ingest_document(
+        pdf_file=job.upload,
+        client=client,
+        document_id=job.document_id,
+        progress=job.progress,
+    )
+    await register_document(job.upload, document_metadata)
+
+
+async def discard_ingest_job(job: IngestJobRecord) -> None:
+    """Delete whatever a failed job stored, so its document can't be searched."""
+    client = await qdrant_connection.get_client()
+    await delete_document(client, job.document_id)
+
+
+class JobBackend(abc.ABC):
+    """
+    Interface for ingestion job queues.
+
+    A backend takes ownership of the uploads it accepts and deletes them once the
+    job is finished.
+    """
+
+    @abc.abstractmethod
+    async def submit(self, upload: UploadedDocument) -> JobStatus:
+        """
+        Enqueue an upload for ingestion.
+
+        Raises:
+            JobQueueFull: If the backend can't accept more jobs right now.
+        """
+
+    @abc.abstractmethod
+    async def get_status(self, job_id: str) -> JobStatus | None:
+        """Return the status of a job, or None if it is unknown."""
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+class InProcessJobBackend(JobBackend):
+    """
+    Runs ingestion jobs on a bounded pool of asyncio worker tasks.
+
+    Args:
+        workers (int): The number of jobs processed concurrently.
+        queue_size (int): The number of jobs that can wait; further submissions are rejected.
+        retention (int): How many jobs are remembered for status queries.
+    """
+
+    def __init__(
+        self,
+        workers: int = INGEST_JOB_WORKERS,
+        queue_size: int = INGEST_JOB_QUEUE_SIZE,
+        retention: int = INGEST_JOB_RETENTION,
+    ):
+        self.workers = workers
+        self.retention = retention
+        self._queue: asyncio.Queue[IngestJobRecord] = asyncio.Queue(maxsize=queue_size)
+        self._jobs: OrderedDict[str, IngestJobRecord] = OrderedDict()
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._worker()) for _ in range(self.workers)
+            ]
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        while not self._queue.empty():
+            self._queue.get_nowait().upload.close()
+
+    async def submit(self, upload: UploadedDocument) -> JobStatus:
+        await self.start()
+        job = IngestJobRecord(upload)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise JobQueueFull(
+                f"The ingestion queue is full ({self._queue.maxsize} jobs)"
+            )
+
+        self._jobs[job.job_id] = job
+        while len(self._jobs) > self.retention:
+            self._jobs.popitem(last=False)
+        logger.info("Queued ingestion job %s for %s", job.job_id, upload.name)
+        return job.status()
+
+    async def get_status(self, job_id: str) -> JobStatus | None:
+        job = self._jobs.get(job_id)
+        return job.status() if job else None
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            job.state = JobState.Running
+            job.started_at = time.time()
+            try:
+                await run_ingest_job(job)
+                job.state = JobState.Succeeded
+                logger.info("Ingestion job %s succeeded", job.job_id)
+            except Exception as e:
+                job.state = JobState.Failed
+                job.error = str(e)
+                logger.exception("Ingestion job %s failed", job.job_id)
+                try:
+                    await discard_ingest_job(job)
+                except Exception:
+                    logger.exception("Failed to clean up job %s", job.job_id)
+            finally:
+                job.finished_at = time.time()
+                job.upload.close()
+                self._queue.task_done()
+
+
+def create_job_backend(backend: str = INGEST_JOB_BACKEND) -> JobBackend:
+    """
+    Build the job backend selected by configuration.
+
+    Args:
+        backend (str): "inprocess", or the import path of a `JobBackend` subclass
+            in the form "package.module:ClassName".
+
+    Returns:
+        JobBackend: The job backend.
+    """
+    if backend == "inprocess":
+        return InProcessJobBackend()
+    module_name, _, class_name = backend.partition(":")
+    backend_class = getattr(importlib.import_module(module_name), class_name)
+    return backend_class()
+
+
+job_backend = create_job_backend()
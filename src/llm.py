@@ -1,8 +1,21 @@
+import hashlib
 import json
 import os
+import time
+from collections.abc import AsyncGenerator, Hashable
+from functools import lru_cache
+from typing import TYPE_CHECKING
 
-from openai import OpenAI
-
+from src import metrics
+from src.admission import Slot, acquire, admit, llm_bulkhead, within_deadline
+from src.caching import (
+    CachedResponse,
+    SingleFlight,
+    response_cache,
+    response_cache_stats,
+    semantic_response_cache,
+)
+from src.emb import embed_query
 from src.models import QuestionsType
 from src.prompts import (
     QUESTIONS_SYSTEM_MESSAGE,
@@ -10,36 +23,256 @@ from src.prompts import (
     SUMMARY_SYSTEM_MESSAGE,
     SUMMARY_USER_MESSAGE,
 )
-from src.utils import create_logger, log_execution_time
+from src.ratelimit import RateLimiter
+from src.tokens import count_tokens, truncate_tokens
+from src.utils import create_logger
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, AsyncStream
+    from openai.types import CompletionUsage
 
 TEMPERATURE = 0.2
 MAX_COMPLETION_TOKENS = 1024
+# Token budgets for the retrieved context of each kind of generation
+SUMMARY_CONTEXT_TOKENS = int(os.environ.get("SUMMARY_CONTEXT_TOKENS", "1536"))
+QUESTIONS_CONTEXT_TOKENS = int(os.environ.get("QUESTIONS_CONTEXT_TOKENS", "1024"))
+# Share of a chunk's word sequences that must already be in the context for it
+# to be dropped as a near-duplicate
+CONTEXT_DUPLICATE_THRESHOLD = float(
+    os.environ.get("CONTEXT_DUPLICATE_THRESHOLD", "0.8")
+)
+# Client-side budgets for the chat API (0 means unlimited)
+CHAT_REQUESTS_PER_MINUTE = float(os.environ.get("CHAT_REQUESTS_PER_MINUTE", "0"))
+CHAT_TOKENS_PER_MINUTE = float(os.environ.get("CHAT_TOKENS_PER_MINUTE", "0"))
+CHAT_MAX_CONCURRENCY = int(os.environ.get("CHAT_MAX_CONCURRENCY", "16"))
+CHAT_MAX_RETRIES = int(os.environ.get("CHAT_MAX_RETRIES", "3"))
+CHAT_RETRY_BACKOFF = float(os.environ.get("CHAT_RETRY_BACKOFF", "1"))
+# Time to response above which concurrency is reduced; 0 disables it, since
+# generation time mostly depends on the length of the answer
+CHAT_LATENCY_TARGET = float(os.environ.get("CHAT_LATENCY_TARGET", "0"))
 
 logger = create_logger(logger_name="llm", log_file="api.log", log_level="info")
 
 model = os.environ.get("CHAT_MODEL")
-if not model:
-    logger.error("CHAT_MODEL environment variable is not set.")
-    raise ValueError("CHAT_MODEL environment variable is not set.")
 
-client = OpenAI()
+chat_rate_limiter = RateLimiter(
+    "openai-chat",
+    requests_per_minute=CHAT_REQUESTS_PER_MINUTE,
+    tokens_per_minute=CHAT_TOKENS_PER_MINUTE,
+    max_concurrency=CHAT_MAX_CONCURRENCY,
+    max_retries=CHAT_MAX_RETRIES,
+    retry_backoff=CHAT_RETRY_BACKOFF,
+    latency_target=CHAT_LATENCY_TARGET,
+)
+
+in_flight = SingleFlight()
+
+
+def get_model() -> str:
+    """Return the chat model, raising if `CHAT_MODEL` isn't set."""
+    if not model:
+        logger.error("CHAT_MODEL environment variable is not set.")
+        raise ValueError("CHAT_MODEL environment variable is not set.")
+    return model
+
+
+@lru_cache(maxsize=1)
+def get_client() -> "AsyncOpenAI":
+    """Return the shared chat client, importing openai and creating it on first use."""
+    get_model()
+    from openai import AsyncOpenAI
 
+    # Retries are done by the rate limiter, which also honours `Retry-After`
+    return AsyncOpenAI(max_retries=0)
 
-def prepare_context(relevant_chunks: list[str]) -> str:
+
+async def warm_up() -> None:
+    """Create the chat client and open a connection to the API with a free request."""
+    await get_client().models.list()
+
+
+def shingles(text: str, size: int = 3) -> set[tuple[str, ...]]:
+    """Return the set of `size`-word sequences in a text, used to compare texts."""
+    words = text.lower().split()
+    if len(words) <= size:
+        return {tuple(words)}
+    return {tuple(words[i : i + size]) for i in range(len(words) - size + 1)}
+
+
+def prepare_context(relevant_chunks: list[str], max_tokens: int) -> str:
     """
-    Prepare the input context for the summarization model.
+    Prepare the input context for the model, within a token budget.
+
+    Chunks are taken in order of relevance. A chunk is skipped if at least
+    `CONTEXT_DUPLICATE_THRESHOLD` of its word sequences already appear in a
+    chunk that was kept, or if it doesn't fit in what is left of the budget.
+    If not even the most relevant chunk fits, it is truncated.
+
     Args:
-        relevant_chunks (List[str]): A list of text chunks relevant to the topic.
+        relevant_chunks (list[str]): Text chunks relevant to the topic, most relevant first.
+        max_tokens (int): The token budget of the context.
+
     Returns:
-        str: The concatenated text of the relevant chunks.
+        str: The concatenated text of the selected chunks.
     """
-    # This can be improved for prompt engineering!
-    return "\n".join(relevant_chunks)
+    kept: list[str] = []
+    kept_shingles: list[set] = []
+    used = 0
+    total = 0
+    for chunk in relevant_chunks:
+        tokens = count_tokens(chunk)
+        total += tokens
+        chunk_shingles = shingles(chunk)
+        if any(
+            len(chunk_shingles & other)
+            >= CONTEXT_DUPLICATE_THRESHOLD * len(chunk_shingles)
+            for other in kept_shingles
+        ):
+            continue
+        if used + tokens > max_tokens:
+            continue
+        kept.append(chunk)
+        kept_shingles.append(chunk_shingles)
+        used += tokens
+
+    if not kept and relevant_chunks:
+        kept = [truncate_tokens(relevant_chunks[0], max_tokens)]
+        used = count_tokens(kept[0])
+    logger.info(
+        "Packed %d/%d chunks into %d context tokens (budget %d, %d tokens saved)",
+        len(kept),
+        len(relevant_chunks),
+        used,
+        max_tokens,
+        total - used,
+    )
+    return "\n".join(kept)
 
 
-@log_execution_time(logger=logger)
-def provide_questions(
+def questions_messages(
     topic: str, type: QuestionsType, relevant_chunks: list[str]
+) -> list[dict]:
+    context = prepare_context(relevant_chunks, QUESTIONS_CONTEXT_TOKENS)
+    logger.debug("topic:\t%s\n\ncontext:\n%s", topic, context)
+    return [
+        {"role": "system", "content": QUESTIONS_SYSTEM_MESSAGE},
+        {
+            "role": "user",
+            "content": QUESTIONS_USER_MESSAGE.format(
+                topic=topic, type=type, context=context
+            ),
+        },
+    ]
+
+
+def summary_messages(topic: str, relevant_chunks: list[str]) -> list[dict]:
+    context = prepare_context(relevant_chunks, SUMMARY_CONTEXT_TOKENS)
+    logger.debug("topic:\t%s\n\ncontext:\n%s", topic, context)
+    return [
+        {"role": "system", "content": SUMMARY_SYSTEM_MESSAGE},
+        {
+            "role": "user",
+            "content": SUMMARY_USER_MESSAGE.format(topic=topic, context=context),
+        },
+    ]
+
+
+def estimated_tokens(messages: list[dict]) -> int:
+    """The tokens a completion counts against the rate limit: the prompt plus the completion budget."""
+    return (
+        sum(count_tokens(message["content"]) for message in messages)
+        + MAX_COMPLETION_TOKENS
+    )
+
+
+def response_cache_key(messages: list[dict]) -> str:
+    """Hash everything that determines a completion: the model, the prompt and the sampling settings."""
+    payload = json.dumps([model, messages, TEMPERATURE, MAX_COMPLETION_TOKENS])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def record_usage(usage: "CompletionUsage | None") -> None:
+    if usage is not None:
+        metrics.llm_tokens.inc(usage.prompt_tokens, kind="prompt")
+        metrics.llm_tokens.inc(usage.completion_tokens, kind="completion")
+
+
+async def generate(
+    messages: list[dict], topic: str, namespace: Hashable | None = None
+) -> str:
+    """
+    Return the completion of a prompt, reusing a cached response if there is one.
+
+    Responses are cached by exact prompt for `LLM_CACHE_TTL` seconds. With
+    `LLM_SEMANTIC_CACHE_THRESHOLD` set and a `namespace` given (a document and
+    endpoint), a response generated for a similar enough topic in the same
+    namespace is reused as well, based on the topics' query embeddings.
+
+    Args:
+        messages (list[dict]): The chat messages to complete.
+        topic (str): The topic the prompt is about, compared by the semantic lookup.
+        namespace (Hashable | None): Where a response may be reused for similar topics.
+
+    Returns:
+        str: The generated (or cached) response.
+    """
+    key = response_cache_key(messages)
+    if response_cache is not None:
+        cached = response_cache.get(key)
+        if cached is not None:
+            response_cache_stats.record_hit("exact", cached)
+            return cached.text
+    # Concurrent requests with the same prompt share one generation
+    return await in_flight.do(
+        key, lambda: generate_uncached(messages, key, topic, namespace)
+    )
+
+
+async def generate_uncached(
+    messages: list[dict], key: str, topic: str, namespace: Hashable | None
+) -> str:
+    query_vector = None
+    if semantic_response_cache is not None and namespace is not None:
+        query_vector = await embed_query(topic)
+        cached = semantic_response_cache.get(namespace, query_vector)
+        if cached is not None:
+            logger.info("Reusing the response of a similar topic for '%s'", topic)
+            response_cache_stats.record_hit("semantic", cached)
+            return cached.text
+
+    started = time.perf_counter()
+    with metrics.track("llm_completion", model=get_model()):
+        completion = await admit(
+            llm_bulkhead,
+            chat_rate_limiter.call(
+                lambda: get_client().chat.completions.create(
+                    messages=messages,
+                    model=get_model(),
+                    temperature=TEMPERATURE,
+                    max_tokens=MAX_COMPLETION_TOKENS,
+                ),
+                tokens=estimated_tokens(messages),
+            ),
+        )
+        record_usage(completion.usage)
+    response = CachedResponse(
+        text=completion.choices[0].message.content,
+        generation_seconds=time.perf_counter() - started,
+    )
+    if response_cache is not None:
+        response_cache_stats.misses += 1
+        response_cache.put(key, response)
+    if query_vector is not None:
+        semantic_response_cache.put(namespace, key, query_vector, response)
+    return response.text
+
+
+@metrics.instrument("generate_questions", logger=logger)
+async def provide_questions(
+    topic: str,
+    type: QuestionsType,
+    relevant_chunks: list[str],
+    document_id: str | None = None,
 ) -> str:
     """
     Generate questions for a given topic based on relevant chunks of text.
@@ -48,65 +281,168 @@ def provide_questions(
         topic (str): The main topic to be asked about.
         type( Enum["MCQ", "fill-in-the-middle"]): The type of questions to generate
         relevant_chunks (list[str]): A list of text chunks relevant to the topic.
+        document_id (str | None): The document the chunks come from, which lets
+            questions about similar topics of the same document be reused.
 
     Returns:
         list[str]: A list of questions about the topic based on the provided context.
     """
-    context = prepare_context(relevant_chunks)
-    logger.debug(f"topic:\t{topic}\n\ncontext:\n{context}")
     try:
-        completion = client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": QUESTIONS_SYSTEM_MESSAGE},
-                {
-                    "role": "user",
-                    "content": QUESTIONS_USER_MESSAGE.format(
-                        topic=topic, type=type, context=context
-                    ),
-                },
-            ],
-            model=model,
-            temperature=TEMPERATURE,
-            max_tokens=MAX_COMPLETION_TOKENS,
+        return await generate(
+            questions_messages(topic, type, relevant_chunks),
+            topic=topic,
+            namespace=None if document_id is None else (document_id, "questions", type),
         )
-        response = completion.choices[0].message.content
-        return response
     except Exception as e:
-        logger.error(f"Error generating questions for topic '{topic}': {e}")
+        logger.error("Error generating questions for topic '%s': %s", topic, e)
         raise
 
 
-@log_execution_time(logger=logger)
-def summarize_topic(topic: str, relevant_chunks: list[str]) -> str:
+@metrics.instrument("generate_summary", logger=logger)
+async def summarize_topic(
+    topic: str, relevant_chunks: list[str], document_id: str | None = None
+) -> str:
     """
     Generate a summary for a given topic based on relevant chunks of text.
 
     Args:
         topic (str): The main topic to be summarized.
         relevant_chunks (list[str]): A list of text chunks relevant to the topic.
+        document_id (str | None): The document the chunks come from, which lets
+            summaries of similar topics of the same document be reused.
 
     Returns:
         str: A summary of the topic based on the provided context.
     """
-    context = prepare_context(relevant_chunks)
-    logger.debug(f"topic:\t{topic}\n\ncontext:\n{context}")
     try:
-        completion = client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": SUMMARY_SYSTEM_MESSAGE},
-                {
-                    "role": "user",
-                    "content": SUMMARY_USER_MESSAGE.format(
-                        topic=topic, context=context
-                    ),
-                },
-            ],
-            model=model,
-            temperature=TEMPERATURE,
-            max_tokens=MAX_COMPLETION_TOKENS,
+        return await generate(
+            summary_messages(topic, relevant_chunks),
+            topic=topic,
+            namespace=None if document_id is None else (document_id, "summary"),
         )
-        response = completion.choices[0].message.content
     except Exception as e:
-        logger.error(f"Error generating summary for topic '{topic}': {e}")
+        logger.error("Error generating summary for topic '%s': %s", topic, e)
+        raise
+
+
+class CompletionStream:
+    """
+    A chat completion being streamed, iterated for the text of each delta.
+
+    It holds a slot in `slot`, if any, until it is exhausted or closed. Closing
+    it early closes the upstream connection, which makes the provider stop
+    generating. `aclose` also releases a stream that was never iterated, e.g.
+    when the client went away before the response started.
+    """
+
+    def __init__(
+        self,
+        text: AsyncGenerator[str, None],
+        upstream: "AsyncStream | None" = None,
+        slot: Slot | None = None,
+    ):
+        self._text = text
+        self._upstream = upstream
+        self._slot = slot
+
+    def __aiter__(self) -> "CompletionStream":
+        return self
+
+    async def __anext__(self) -> str:
+        try:
+            return await self._text.__anext__()
+        except StopAsyncIteration:
+            await self.aclose()
+            raise
+
+    async def aclose(self) -> None:
+        try:
+            await self._text.aclose()
+            if self._upstream is not None:
+                upstream, self._upstream = self._upstream, None
+                await upstream.close()
+        finally:
+            if self._slot is not None:
+                self._slot.release()
+
+
+async def cached_text(text: str) -> AsyncGenerator[str, None]:
+    yield text
+
+
+async def stream_completion(messages: list[dict]) -> CompletionStream:
+    """
+    Open a streaming chat completion.
+
+    The LLM slot is taken and the stream opened (rate limited, retried and held
+    to the request's deadline) before this returns, so a request that is shed or
+    runs out of time fails here rather than after the response has started. A
+    cached response for the same prompt is sent as a single piece, and complete
+    streamed responses are added to the cache.
+    """
+    key = response_cache_key(messages)
+    if response_cache is not None:
+        cached = response_cache.get(key)
+        if cached is not None:
+            response_cache_stats.record_hit("exact", cached)
+            return CompletionStream(cached_text(cached.text))
+
+    started = time.perf_counter()
+    slot = await acquire(llm_bulkhead)
+    try:
+        upstream = await within_deadline(
+            chat_rate_limiter.call(
+                lambda: get_client().chat.completions.create(
+                    messages=messages,
+                    model=get_model(),
+                    temperature=TEMPERATURE,
+                    max_tokens=MAX_COMPLETION_TOKENS,
+                    stream=True,
+                    # The last chunk reports the token usage
+                    stream_options={"include_usage": True},
+                ),
+                tokens=estimated_tokens(messages),
+            ),
+            "llm call",
+        )
+    except BaseException:
+        slot.release()
         raise
-    return response
+
+    async def relay() -> AsyncGenerator[str, None]:
+        parts = []
+        async for chunk in upstream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                if not parts:
+                    metrics.stage_seconds.observe(
+                        time.perf_counter() - started, stage="llm_first_token"
+                    )
+                parts.append(chunk.choices[0].delta.content)
+                yield parts[-1]
+            record_usage(chunk.usage)
+        metrics.stage_seconds.observe(
+            time.perf_counter() - started, stage="llm_completion"
+        )
+        if response_cache is not None:
+            response_cache_stats.misses += 1
+            response_cache.put(
+                key,
+                CachedResponse(
+                    text="".join(parts),
+                    generation_seconds=time.perf_counter() - started,
+                ),
+            )
+
+    return CompletionStream(relay(), upstream, slot)
+
+
+async def stream_questions(
+    topic: str, type: QuestionsType, relevant_chunks: list[str]
+) -> CompletionStream:
+    """Streaming variant of `provide_questions`, yielding the questions piece by piece."""
+    return await stream_completion(questions_messages(topic, type, relevant_chunks))
+
+
+async def stream_summary(topic: str, relevant_chunks: list[str]) -> CompletionStream:
+    """Streaming variant of `summarize_topic`, yielding the summary piece by piece."""
+    return await stream_completion(summary_messages(topic, relevant_chunks))
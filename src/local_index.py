@@ -0,0 +1,165 @@
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+# In-process exact search for small documents; set LOCAL_INDEX_DIR to a
+# directory to enable it
+LOCAL_INDEX_DIR = os.environ.get("LOCAL_INDEX_DIR", "")
+# Documents with more chunks than this are always searched in Qdrant
+LOCAL_INDEX_MAX_CHUNKS = int(os.environ.get("LOCAL_INDEX_MAX_CHUNKS", "2000"))
+# How many documents are kept open in memory
+LOCAL_INDEX_DOCUMENTS = int(os.environ.get("LOCAL_INDEX_DOCUMENTS", "256"))
+# "float32" reproduces Qdrant's scores exactly; "float16" halves the files but
+# may reorder near ties
+LOCAL_INDEX_DTYPE = os.environ.get("LOCAL_INDEX_DTYPE", "float32")
+
+
+@dataclass
+class IndexedDocument:
+    """The chunk vectors of one document, as a (chunks x dimension) matrix, and their payloads."""
+
+    vectors: np.ndarray
+    payloads: list[dict]
+
+    def search(self, query: list[float], limit: int) -> list[dict]:
+        """
+        Return the payloads of the `limit` chunks with the highest dot product.
+
+        Ties are broken by insertion order, so the ranking is deterministic.
+        """
+        scores = self.vectors @ np.asarray(query, dtype=np.float32)
+        if limit < len(scores):
+            top = np.argpartition(-scores, limit - 1)[:limit]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.lexsort((top, -scores[top]))]
+        return [self.payloads[i] for i in top]
+
+
+class LocalIndex:
+    """
+    Per-document vector matrices stored as `.npy` files and searched in process.
+
+    Each document is written once, at ingestion, as a vector matrix (opened
+    memory-mapped, so only the pages that are touched get loaded) and a JSON
+    file of payloads. The most recently searched documents are kept open in an
+    LRU; documents with more than `max_chunks` chunks are not indexed.
+
+    Args:
+        directory (str): Where the index files are stored.
+        max_chunks (int): The largest document, in chunks, that is indexed.
+        max_documents (int): How many documents are kept open.
+        dtype (str): "float32" or "float16", the precision of the stored vectors.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_chunks: int = LOCAL_INDEX_MAX_CHUNKS,
+        max_documents: int = LOCAL_INDEX_DOCUMENTS,
+        dtype: str = LOCAL_INDEX_DTYPE,
+    ):
+        self.directory = directory
+        self.max_chunks = max_chunks
+        self.max_documents = max_documents
+        self.dtype = np.dtype(dtype)
+        self._documents: OrderedDict[str, IndexedDocument] = OrderedDict()
+        self._lock = threading.Lock()
+        # Documents known to be too large, so they aren't looked for again
+        self._unindexable: set[str] = set()
+
+    def _paths(self, document_id: str) -> tuple[str, str] | None:
+        # Document ids come from requests, so never let them form arbitrary paths
+        try:
+            document_id = str(uuid.UUID(document_id))
+        except ValueError:
+            return None
+        base = os.path.join(self.directory, document_id)
+        return f"{base}.npy", f"{base}.json"
+
+    def accepts(self, chunk_count: int) -> bool:
+        return chunk_count <= self.max_chunks
+
+    def add(
+        self, document_id: str, vectors: list[list[float]], payloads: list[dict]
+    ) -> bool:
+        """
+        Write a document's vectors and payloads, if it is small enough.
+
+        Files are written under temporary names and renamed, so concurrent
+        readers never see a partial document.
+
+        Returns:
+            bool: Whether the document was indexed.
+        """
+        paths = self._paths(document_id)
+        if paths is None or not vectors or not self.accepts(len(vectors)):
+            return False
+        vectors_path, payloads_path = paths
+        os.makedirs(self.directory, exist_ok=True)
+
+        suffix = f".{uuid.uuid4().hex}.tmp"
+        with open(payloads_path + suffix, "w") as f:
+            json.dump(payloads, f)
+        with open(vectors_path + suffix, "wb") as f:
+            np.save(f, np.asarray(vectors, dtype=self.dtype))
+        os.replace(payloads_path + suffix, payloads_path)
+        os.replace(vectors_path + suffix, vectors_path)
+        return True
+
+    def mark_unindexable(self, document_id: str) -> None:
+        self._unindexable.add(document_id)
+
+    def is_unindexable(self, document_id: str) -> bool:
+        return document_id in self._unindexable
+
+    def get_open(self, document_id: str) -> IndexedDocument | None:
+        """Return a document if it is already open, without touching the disk."""
+        with self._lock:
+            document = self._documents.get(document_id)
+            if document is not None:
+                self._documents.move_to_end(document_id)
+            return document
+
+    def get(self, document_id: str) -> IndexedDocument | None:
+        """Return an indexed document, opening its files if it isn't in memory yet."""
+        document = self.get_open(document_id)
+        if document is not None:
+            return document
+
+        paths = self._paths(document_id)
+        if paths is None or not os.path.exists(paths[0]):
+            return None
+        vectors_path, payloads_path = paths
+        try:
+            vectors = np.load(vectors_path, mmap_mode="r")
+            with open(payloads_path) as f:
+                payloads = json.load(f)
+        except (OSError, ValueError):
+            return None
+        document = IndexedDocument(vectors=vectors, payloads=payloads)
+
+        with self._lock:
+            self._documents[document_id] = document
+            while len(self._documents) > self.max_documents:
+                self._documents.popitem(last=False)
+        return document
+
+    def remove(self, document_id: str) -> None:
+        """Forget a document and delete its files."""
+        with self._lock:
+            self._documents.pop(document_id, None)
+        paths = self._paths(document_id)
+        for path in paths or ():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+local_index = LocalIndex(LOCAL_INDEX_DIR) if LOCAL_INDEX_DIR else None
@@ -1,20 +1,178 @@
+import asyncio
+import importlib
+import json
+import os
+import time
 import traceback
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
 
-from fastapi import Depends, FastAPI, File, HTTPException, UploadFile
-from qdrant_client import QdrantClient
+from fastapi import (
+    Depends,
+    FastAPI,
+    File,
+    HTTPException,
+    Request,
+    Response,
+    UploadFile,
+)
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from qdrant_client import AsyncQdrantClient
+from starlette.background import BackgroundTask
 
-from src import models
-from src.llm import provide_questions, summarize_topic
-from src.utils import create_logger, process_uploaded_file, validate_pdf_file
+from src import llm, metrics, models, pdf
+from src.admission import (
+    REQUEST_DEADLINE,
+    AdmissionError,
+    Slot,
+    acquire,
+    bulkheads,
+    llm_bulkhead,
+    request_deadline,
+)
+from src.caching import response_cache_stats, retrieval_cache
+from src.emb import cache as embedding_cache
+from src.emb import close_embedder, get_embedder
+from src.jobs import JobQueueFull, job_backend
+from src.llm import (
+    provide_questions,
+    stream_questions,
+    stream_summary,
+    summarize_topic,
+)
+from src.registry import find_duplicate, register_document
+from src.tokens import get_encoding
+from src.utils import (
+    UPLOAD_MAX_BYTES,
+    create_logger,
+    process_uploaded_file,
+    upload_too_large,
+    validate_pdf_file,
+)
 from src.vectorstore import (
     get_qdrant_client,
+    get_text_splitter,
     ingest_document,
+    qdrant_connection,
     retrieve_relevant_context,
+    retrieve_relevant_contexts,
 )
 
+# How many LLM calls a batch request runs at once
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "8"))
+# Import the lazily loaded dependencies and open the upstream connections on
+# startup, so that the first requests don't pay for them
+STARTUP_WARMUP = os.environ.get("STARTUP_WARMUP", "false").lower() == "true"
+
 logger = create_logger(logger_name="main", log_file="api.log", log_level="info")
 
-app = FastAPI()
+
+def preload_dependencies() -> None:
+    importlib.import_module("pymupdf")
+    get_text_splitter()
+    llm.get_client()
+
+
+async def warm_up() -> None:
+    """Load what the first requests would otherwise wait for, logging what failed."""
+    started = time.perf_counter()
+    await asyncio.to_thread(preload_dependencies)
+    results = await asyncio.gather(
+        qdrant_connection.health_check(),
+        get_embedder().warm_up(),
+        llm.warm_up(),
+        return_exceptions=True,
+    )
+    for name, result in zip(("qdrant", "embedder", "llm"), results):
+        if isinstance(result, Exception):
+            logger.warning("Failed to warm up the %s connection: %s", name, result)
+    logger.info("Warm-up took %.2f seconds", time.perf_counter() - started)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open the shared upstream clients on startup and close them on shutdown."""
+    # Fail on a missing setting now rather than on the first request
+    llm.get_model()
+    # A local embedding model is loaded to find out its dimension, which must
+    # not happen on the event loop once requests are served
+    await asyncio.to_thread(lambda: get_embedder().dimension)
+    # Loading the tokenizer may download its encoding file
+    await asyncio.to_thread(get_encoding)
+    await qdrant_connection.start()
+    await job_backend.start()
+    if STARTUP_WARMUP:
+        await warm_up()
+    yield
+    await job_backend.close()
+    # Waits for the PDF extraction workers to exit, so it runs in a thread
+    await asyncio.to_thread(pdf.shutdown_executor)
+    await qdrant_connection.close()
+    await close_embedder()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    """Reject uploads by their Content-Length before the body is read."""
+    content_length = request.headers.get("content-length")
+    if (
+        request.url.path == "/ingest"
+        and content_length is not None
+        and content_length.isdigit()
+        # Leave some room for the multipart framing around the file
+        and int(content_length) > UPLOAD_MAX_BYTES + 64 * 1024
+    ):
+        error = upload_too_large()
+        return JSONResponse(
+            status_code=error.status_code, content={"detail": error.detail}
+        )
+    return await call_next(request)
+
+
+@app.middleware("http")
+async def enforce_request_deadline(request: Request, call_next):
+    """Give generation requests `REQUEST_DEADLINE` seconds for their downstream calls."""
+    if not request.url.path.startswith("/generate"):
+        return await call_next(request)
+    with request_deadline(REQUEST_DEADLINE):
+        return await call_next(request)
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Time every request by route, and open the span its downstream calls are linked to."""
+    started = time.perf_counter()
+    status = 500
+    try:
+        with metrics.span(
+            f"{request.method} {request.url.path}",
+            **{"http.method": request.method, "http.target": request.url.path},
+        ):
+            response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # The route template, so that paths with ids don't each get their own series
+        route = request.scope.get("route")
+        metrics.http_request_seconds.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=str(status),
+        )
+
+
+@app.exception_handler(AdmissionError)
+async def reject_on_overload(request: Request, error: AdmissionError) -> JSONResponse:
+    """Turn shed and timed out requests into 429/503 responses the client may retry."""
+    return JSONResponse(
+        status_code=error.status_code,
+        content={"detail": str(error)},
+        headers={"Retry-After": str(error.retry_after)},
+    )
 
 
 @app.get("/")
@@ -28,37 +186,133 @@ async def root() -> dict:
     return {"message": "Hello World"}
 
 
+@app.get("/stats")
+async def get_stats() -> dict:
+    """
+    Endpoint reporting the effectiveness of the caches and the load on downstream services.
+
+    Returns:
+        dict: Cache hits, misses, evictions, hit ratio and generation time
+            saved, and per downstream service the calls in flight, queued, shed
+            and timed out.
+    """
+    stats = {
+        "response_cache": response_cache_stats.as_dict(),
+        "admission": {bulkhead.name: bulkhead.stats() for bulkhead in bulkheads},
+    }
+    if retrieval_cache is not None:
+        stats["retrieval_cache"] = {
+            "hits": retrieval_cache.hits,
+            "misses": retrieval_cache.misses,
+        }
+    if embedding_cache is not None:
+        stats["embedding_cache"] = embedding_cache.stats()
+    return stats
+
+
+@app.get("/metrics")
+async def get_metrics() -> PlainTextResponse:
+    """
+    Endpoint exposing the metrics in the Prometheus text format.
+
+    Returns:
+        PlainTextResponse: Per-stage latency histograms, LLM token counts, and the
+            cache, rate limit and admission counters also reported by `/stats`.
+    """
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 @app.post("/ingest")
 async def ingest_pdf(
-    file: UploadFile = File(...), client: QdrantClient = Depends(get_qdrant_client)
-) -> models.DocumentMetadata:
+    response: Response,
+    file: UploadFile = File(...),
+    background: bool = False,
+    force: bool = False,
+    client: AsyncQdrantClient = Depends(get_qdrant_client),
+) -> models.DocumentMetadata | models.IngestJob:
     """
     Endpoint to ingest a PDF file into the vector store.
 
+    Uploads whose content was already ingested return the existing document
+    without being processed again, unless `force` is set.
+
     Args:
         file (UploadFile): The PDF file to be ingested.
-        client (QdrantClient): An instance of the Qdrant client.
+        background (bool): Enqueue the ingestion as a job and return immediately.
+        force (bool): Ingest the file even if the same content was ingested before.
+        client (AsyncQdrantClient): An instance of the Qdrant client.
 
     Returns:
-        models.DocumentMetadata: Metadata of the ingested document.
+        models.DocumentMetadata | models.IngestJob: Metadata of the ingested (or
+            previously ingested) document, or the queued job (with status 202) in
+            background mode.
 
     Raises:
-        HTTPException: If there is an error processing the PDF.
+        HTTPException: If there is an error processing the PDF, or 503 if the
+            ingestion queue is full.
     """
     validate_pdf_file(file)
+    processed_pdf = None
     try:
-        processed_pdf = await process_uploaded_file(file=file)
-        document_metadata = ingest_document(pdf_file=processed_pdf, client=client)
+        with metrics.track("upload_read"):
+            processed_pdf = await process_uploaded_file(file=file)
+        if not force:
+            existing = await find_duplicate(processed_pdf, client)
+            if existing is not None:
+                logger.info("Returning previously ingested document: %s", existing)
+                return existing
+        if background:
+            job = await job_backend.submit(processed_pdf)
+            # The job backend now owns the upload and deletes it when done
+            processed_pdf = None
+            response.status_code = 202
+            return models.IngestJob(
+                job_id=job.job_id, document_id=job.document_id, state=job.state
+            )
+        document_metadata = await ingest_document(pdf_file=processed_pdf, client=client)
+        await register_document(processed_pdf, document_metadata)
+    except HTTPException:
+        raise
+    except JobQueueFull as e:
+        raise HTTPException(
+            status_code=503, detail=str(e), headers={"Retry-After": "5"}
+        )
     except Exception as e:
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
-    logger.info(f"Successfully ingested document: {document_metadata}")
+    finally:
+        if processed_pdf is not None:
+            processed_pdf.close()
+    logger.info("Successfully ingested document: %s", document_metadata)
     return document_metadata
 
 
+@app.get("/jobs/{job_id}")
+async def get_job_status(job_id: str) -> models.JobStatus:
+    """
+    Endpoint to report the progress of a background ingestion job.
+
+    Args:
+        job_id (str): The id returned by `/ingest?background=true`.
+
+    Returns:
+        models.JobStatus: The job's state, pages/chunks processed and timings.
+
+    Raises:
+        HTTPException: If the job is unknown.
+    """
+    status = await job_backend.get_status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return status
+
+
 @app.post("/generate/summary")
 async def generate_summary(
-    request: models.SummaryRequest, client: QdrantClient = Depends(get_qdrant_client)
+    request: models.SummaryRequest,
+    client: AsyncQdrantClient = Depends(get_qdrant_client),
 ) -> models.SummaryResponse:
     """
     Endpoint to generate a summary of a topic from a document.
@@ -72,12 +326,19 @@ async def generate_summary(
     Raises:
         HTTPException: If there is an error generating the summary.
     """
+    metrics.annotate(document_id=request.document_id, topic_count=1)
     try:
-        chunks = retrieve_relevant_context(
+        chunks = await retrieve_relevant_context(
             topic=request.topic, document_id=request.document_id, client=client
         )
-        summary = summarize_topic(topic=request.topic, relevant_chunks=chunks)
+        summary = await summarize_topic(
+            topic=request.topic,
+            relevant_chunks=chunks,
+            document_id=request.document_id,
+        )
         return models.SummaryResponse(topic=request.topic, summary=summary)
+    except AdmissionError:
+        raise
     except Exception as e:
         logger.error(traceback.format_exc())
         raise HTTPException(
@@ -85,9 +346,159 @@ async def generate_summary(
         )
 
 
+async def stream_summaries(
+    topics: list[str], contexts: list[list[str]], document_id: str, slot: Slot
+) -> AsyncIterator[str]:
+    """
+    Summarize topics concurrently and yield each result as an NDJSON line once it is done.
+
+    At most `BATCH_MAX_CONCURRENCY` summaries are generated at a time, each
+    with its own `REQUEST_DEADLINE` from when it starts, so a long batch doesn't
+    run its last topics against the time the first ones used. A failed topic
+    yields an item with an `error` instead of failing the whole batch. If the
+    client goes away, the remaining generations are cancelled.
+
+    `slot` is the LLM slot the batch was admitted with; it is handed back as the
+    summaries start, which take their own slots.
+    """
+    slot.release()
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+
+    async def summarize(topic: str, chunks: list[str]) -> models.BatchSummaryItem:
+        async with semaphore:
+            try:
+                with request_deadline(REQUEST_DEADLINE):
+                    summary = await summarize_topic(
+                        topic=topic, relevant_chunks=chunks, document_id=document_id
+                    )
+                return models.BatchSummaryItem(topic=topic, summary=summary)
+            except Exception as e:
+                logger.error(traceback.format_exc())
+                return models.BatchSummaryItem(topic=topic, error=str(e))
+
+    tasks = [
+        asyncio.create_task(summarize(topic, chunks))
+        for topic, chunks in zip(topics, contexts)
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            item = await next_done
+            yield item.model_dump_json(exclude_none=True) + "\n"
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+@app.post("/generate/summary/batch")
+async def generate_summaries(
+    request: models.BatchSummaryRequest,
+    client: AsyncQdrantClient = Depends(get_qdrant_client),
+) -> StreamingResponse:
+    """
+    Endpoint to generate summaries of many topics from one document.
+
+    The topics are embedded and searched in a single batch, then summarized
+    concurrently. Results are streamed back as newline-delimited JSON
+    (`models.BatchSummaryItem`), in the order they complete.
+
+    Args:
+        request (models.BatchSummaryRequest): The request containing the topics and document ID.
+
+    Returns:
+        StreamingResponse: One JSON object per topic and line.
+
+    Raises:
+        HTTPException: If the relevant context can't be retrieved.
+    """
+    metrics.annotate(document_id=request.document_id, topic_count=len(request.topics))
+    try:
+        contexts = await retrieve_relevant_contexts(
+            topics=request.topics, document_id=request.document_id, client=client
+        )
+    except AdmissionError:
+        raise
+    except Exception as e:
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"Error retrieving context: {e!s}")
+    # Admit the batch before the response starts, so that it can still be a 429/503
+    slot = await acquire(llm_bulkhead)
+    return StreamingResponse(
+        stream_summaries(request.topics, contexts, request.document_id, slot),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(slot.release),
+    )
+
+
+@app.post("/generate/study-pack")
+async def generate_study_pack(
+    request: models.StudyPackRequest,
+    client: AsyncQdrantClient = Depends(get_qdrant_client),
+) -> models.StudyPackResponse:
+    """
+    Endpoint to generate a summary and several types of questions about a topic at once.
+
+    The relevant context is retrieved once and shared by all generations, which
+    run concurrently.
+
+    Args:
+        request (models.StudyPackRequest): The request containing the topic, document ID,
+            whether to include a summary and the question types to generate.
+
+    Returns:
+        models.StudyPackResponse: The summary and the questions, by type.
+
+    Raises:
+        HTTPException: If there is an error retrieving the context or generating any part.
+    """
+    metrics.annotate(document_id=request.document_id, topic_count=1)
+    try:
+        chunks = await retrieve_relevant_context(
+            topic=request.topic, document_id=request.document_id, client=client
+        )
+        # A type requested twice is only generated once
+        questions_types = list(dict.fromkeys(request.questions_types))
+        generations = [
+            provide_questions(
+                topic=request.topic,
+                type=type,
+                relevant_chunks=chunks,
+                document_id=request.document_id,
+            )
+            for type in questions_types
+        ]
+        if request.include_summary:
+            generations.append(
+                summarize_topic(
+                    topic=request.topic,
+                    relevant_chunks=chunks,
+                    document_id=request.document_id,
+                )
+            )
+        tasks = [asyncio.create_task(generation) for generation in generations]
+        try:
+            results = await asyncio.gather(*tasks)
+        finally:
+            # Don't keep generating the other parts once one has failed
+            for task in tasks:
+                task.cancel()
+        return models.StudyPackResponse(
+            topic=request.topic,
+            summary=results[-1] if request.include_summary else None,
+            questions=dict(zip(questions_types, results)),
+        )
+    except AdmissionError:
+        raise
+    except Exception as e:
+        logger.error(traceback.format_exc())
+        raise HTTPException(
+            status_code=500, detail=f"Error generating study pack: {e!s}"
+        )
+
+
 @app.post("/generate/questions")
 async def generate_questions(
-    request: models.QuestionsRequest, client: QdrantClient = Depends(get_qdrant_client)
+    request: models.QuestionsRequest,
+    client: AsyncQdrantClient = Depends(get_qdrant_client),
 ) -> models.QuestionsResponse:
     """
     Endpoint to generate questions about a topic from a document.
@@ -101,20 +512,177 @@ async def generate_questions(
     Raises:
         HTTPException: If there is an error generating the questions.
     """
+    metrics.annotate(document_id=request.document_id, topic_count=1)
     try:
-        chunks = retrieve_relevant_context(
+        chunks = await retrieve_relevant_context(
             topic=request.topic, document_id=request.document_id, client=client
         )
-        questions = provide_questions(
-            topic=request.topic, type=request.questions_type, relevant_chunks=chunks
+        questions = await provide_questions(
+            topic=request.topic,
+            type=request.questions_type,
+            relevant_chunks=chunks,
+            document_id=request.document_id,
         )
         return models.QuestionsResponse(
             topic=request.topic,
             questions_type=request.questions_type,
             questions=questions,
         )
+    except AdmissionError:
+        raise
     except Exception as e:
         logger.error(traceback.format_exc())
         raise HTTPException(
             status_code=500, detail=f"Error generating questions: {str(e)}"
         )
+
+
+def sse_event(event: str, data: dict) -> str:
+    """Format one server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_events(
+    request: Request, tokens: AsyncIterator[str], started: float
+) -> AsyncIterator[str]:
+    """
+    Relay generated text as server-sent events.
+
+    Each piece of text is sent as a `token` event. The stream ends with a `done`
+    event reporting the time to first token and the total time (measured from
+    `started`, a `time.perf_counter()` reading taken when the request arrived),
+    or with an `error` event if generation fails. If the client disconnects,
+    `tokens` is closed, which cancels the upstream generation.
+    """
+    first_token_at = None
+    chunk_count = 0
+    try:
+        async for text in tokens:
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            chunk_count += 1
+            yield sse_event("token", {"text": text})
+            if await request.is_disconnected():
+                logger.info("Client disconnected, cancelling generation")
+                return
+        yield sse_event(
+            "done",
+            {
+                "ttft_seconds": (
+                    None if first_token_at is None else first_token_at - started
+                ),
+                "total_seconds": time.perf_counter() - started,
+                "chunks": chunk_count,
+            },
+        )
+    except Exception as e:
+        logger.error(traceback.format_exc())
+        yield sse_event("error", {"detail": str(e)})
+    finally:
+        # Also runs when the response task is cancelled, so the upstream request
+        # is never left generating for nobody
+        await asyncio.shield(tokens.aclose())
+        logger.info(
+            "Streamed %d chunks: time to first token %s, total %.3fs",
+            chunk_count,
+            "n/a" if first_token_at is None else f"{first_token_at - started:.3f}s",
+            time.perf_counter() - started,
+        )
+
+
+@app.post("/generate/summary/stream")
+async def stream_summary_endpoint(
+    request: models.SummaryRequest,
+    http_request: Request,
+    client: AsyncQdrantClient = Depends(get_qdrant_client),
+) -> StreamingResponse:
+    """
+    Endpoint to stream a summary of a topic from a document as server-sent events.
+
+    Args:
+        request (models.SummaryRequest): The request containing the topic and document ID.
+
+    Returns:
+        StreamingResponse: `token` events with the summary text, then a `done`
+            event with timings (or an `error` event).
+
+    Raises:
+        HTTPException: If the relevant context can't be retrieved or the
+            generation can't be started.
+    """
+    started = time.perf_counter()
+    metrics.annotate(document_id=request.document_id, topic_count=1)
+    try:
+        chunks = await retrieve_relevant_context(
+            topic=request.topic, document_id=request.document_id, client=client
+        )
+    except AdmissionError:
+        raise
+    except Exception as e:
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"Error retrieving context: {e!s}")
+    try:
+        # Opened before the response starts, so that overload is still a 429/503
+        tokens = await stream_summary(topic=request.topic, relevant_chunks=chunks)
+    except AdmissionError:
+        raise
+    except Exception as e:
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"Error generating summary: {e!s}")
+    return StreamingResponse(
+        stream_events(http_request, tokens, started),
+        media_type="text/event-stream",
+        # Releases the LLM slot even if the response never got to start
+        background=BackgroundTask(tokens.aclose),
+    )
+
+
+@app.post("/generate/questions/stream")
+async def stream_questions_endpoint(
+    request: models.QuestionsRequest,
+    http_request: Request,
+    client: AsyncQdrantClient = Depends(get_qdrant_client),
+) -> StreamingResponse:
+    """
+    Endpoint to stream questions about a topic from a document as server-sent events.
+
+    Args:
+        request (models.QuestionsRequest): The request containing the topic, document ID, and question type.
+
+    Returns:
+        StreamingResponse: `token` events with the questions text, then a `done`
+            event with timings (or an `error` event).
+
+    Raises:
+        HTTPException: If the relevant context can't be retrieved or the
+            generation can't be started.
+    """
+    started = time.perf_counter()
+    metrics.annotate(document_id=request.document_id, topic_count=1)
+    try:
+        chunks = await retrieve_relevant_context(
+            topic=request.topic, document_id=request.document_id, client=client
+        )
+    except AdmissionError:
+        raise
+    except Exception as e:
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"Error retrieving context: {e!s}")
+    try:
+        # Opened before the response starts, so that overload is still a 429/503
+        tokens = await stream_questions(
+            topic=request.topic, type=request.questions_type, relevant_chunks=chunks
+        )
+    except AdmissionError:
+        raise
+    except Exception as e:
+        logger.error(traceback.format_exc())
+        raise HTTPException(
+            status_code=500, detail=f"Error generating questions: {e!s}"
+        )
+    return StreamingResponse(
+        stream_events(http_request, tokens, started),
+        media_type="text/event-stream",
+        # Releases the LLM slot even if the response never got to start
+        background=BackgroundTask(tokens.aclose),
+    )
@@ -0,0 +1,337 @@
+import functools
+import inspect
+import math
+import os
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+from typing import TypeVar
+
+from src.utils import create_logger
+
+# Record OpenTelemetry spans for requests and their downstream calls (needs
+# `pip install opentelemetry-api` plus an SDK and exporter set up by the
+# deployment, e.g. with `opentelemetry-instrument`)
+TRACING_ENABLED = os.environ.get("TRACING_ENABLED", "false").lower() == "true"
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+logger = create_logger(logger_name="metrics", log_file="api.log", log_level="info")
+
+T = TypeVar("T")
+
+Labels = tuple[tuple[str, str], ...]
+# Reads a metric at scrape time: (labels, value) pairs
+Sampler = Callable[[], Iterable[tuple[dict[str, str], float]]]
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Registry:
+    """
+    The metrics of the process, rendered in the Prometheus text format.
+
+    Besides the counters and histograms updated as the app runs, callbacks can
+    be registered that read values kept elsewhere (cache and queue statistics)
+    when the metrics are scraped.
+    """
+
+    def __init__(self):
+        self._metrics: list = []
+        self._callbacks: list[tuple[str, str, str, Sampler]] = []
+
+    def add(self, metric) -> None:
+        self._metrics.append(metric)
+
+    def register_callback(self, name: str, help: str, kind: str, fn: Sampler) -> None:
+        """Report the samples returned by `fn()` as a `kind` ("counter" or "gauge") metric."""
+        self._callbacks.append((name, help, kind, fn))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        for name, help, kind, fn in self._callbacks:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in fn():
+                lines.append(
+                    f"{name}{format_labels(tuple(labels.items()))} {format_value(value)}"
+                )
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class Counter:
+    """
+    A monotonically increasing count, per combination of label values.
+
+    Args:
+        name (str): The metric name, ending in `_total` by convention.
+        help (str): What is counted.
+        labelnames (tuple[str, ...]): The names of the labels set by `inc`.
+        registry (Registry): Where the counter is reported.
+    """
+
+    kind = "counter"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        registry: Registry = registry,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[Labels, float] = {}
+        self._lock = threading.Lock()
+        registry.add(self)
+
+    def _key(self, labels: dict[str, str]) -> Labels:
+        return tuple((name, str(labels[name])) for name in self.labelnames)
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{format_labels(key)} {format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """
+    The distribution of observed values (latencies), per combination of label values.
+
+    Args:
+        name (str): The metric name, ending in the unit (`_seconds`) by convention.
+        help (str): What is observed.
+        labelnames (tuple[str, ...]): The names of the labels set by `observe`.
+        buckets (tuple[float, ...]): The upper bounds of the buckets, in increasing order.
+        registry (Registry): Where the histogram is reported.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+        registry: Registry = registry,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = (*buckets, math.inf)
+        # labels -> (count per bucket, sum, count)
+        self._values: dict[Labels, list] = {}
+        self._lock = threading.Lock()
+        registry.add(self)
+
+    def _key(self, labels: dict[str, str]) -> Labels:
+        return tuple((name, str(labels[name])) for name in self.labelnames)
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, **labels: str) -> int:
+        entry = self._values.get(self._key(labels))
+        return 0 if entry is None else entry[2]
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    labels = format_labels((*key, ("le", format_value(bound))))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                lines.append(
+                    f"{self.name}_sum{format_labels(key)} {format_value(total)}"
+                )
+                lines.append(f"{self.name}_count{format_labels(key)} {count}")
+        return lines
+
+
+stage_seconds = Histogram(
+    "rag_qa_stage_duration_seconds",
+    "Time spent in each stage of ingestion, retrieval and generation",
+    ("stage",),
+)
+stage_errors = Counter(
+    "rag_qa_stage_errors_total", "Stages that failed with an exception", ("stage",)
+)
+http_request_seconds = Histogram(
+    "rag_qa_http_request_duration_seconds",
+    "Time until the response starts, per route and status",
+    ("method", "route", "status"),
+)
+llm_tokens = Counter(
+    "rag_qa_llm_tokens_total",
+    "Tokens used by chat completions, by kind (prompt or completion)",
+    ("kind",),
+)
+
+
+@lru_cache(maxsize=1)
+def get_tracer():
+    """Return the OpenTelemetry tracer, or None if tracing is disabled or unavailable."""
+    if not TRACING_ENABLED:
+        return None
+    try:
+        from opentelemetry import trace
+
+        return trace.get_tracer("rag-qa")
+    except ImportError as e:
+        logger.warning("Tracing is disabled, OpenTelemetry is unavailable: %s", e)
+        return None
+
+
+def span(name: str, **attributes):
+    """
+    Context manager recording an OpenTelemetry span, if tracing is enabled.
+
+    Spans opened while another one is active become its children, also in the
+    tasks started meanwhile, so every downstream call is linked to its request.
+    """
+    tracer = get_tracer()
+    if tracer is None:
+        return nullcontext()
+    return tracer.start_as_current_span(name, attributes=attributes)
+
+
+def annotate(**attributes) -> None:
+    """Add attributes (e.g. token counts) to the current span, if tracing is enabled."""
+    if get_tracer() is not None:
+        from opentelemetry import trace
+
+        trace.get_current_span().set_attributes(attributes)
+
+
+@contextmanager
+def track(stage: str, **attributes) -> Iterator[None]:
+    """Time a block as `stage` in the stage histogram and record it as a span."""
+    started = time.perf_counter()
+    with span(stage, **attributes):
+        try:
+            yield
+        except Exception:
+            stage_errors.inc(stage=stage)
+            raise
+        finally:
+            stage_seconds.observe(time.perf_counter() - started, stage=stage)
+
+
+def instrument(stage: str, logger=None) -> Callable[[Callable], Callable]:
+    """
+    Decorator timing every call of a function, sync or async, as `stage`.
+
+    Args:
+        stage (str): The stage the calls are reported as.
+        logger (logging.Logger | None): Also log how long each call took.
+    """
+
+    def log(func: Callable, started: float) -> None:
+        if logger is not None:
+            logger.info(
+                "Executing %s took %.4f seconds",
+                func.__name__,
+                time.perf_counter() - started,
+            )
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                with track(stage):
+                    result = await func(*args, **kwargs)
+                log(func, started)
+                return result
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            with track(stage):
+                result = func(*args, **kwargs)
+            log(func, started)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+class TimedIterator:
+    """
+    Wraps an iterator, timing how long producing each item takes as `stage`.
+
+    `seconds` adds up the time spent in the wrapped iterator, so a consumer
+    pulling items through it can tell its own time apart.
+    """
+
+    def __init__(self, items: Iterable[T], stage: str):
+        self._items = iter(items)
+        self.stage = stage
+        self.seconds = 0.0
+
+    def __iter__(self) -> "TimedIterator":
+        return self
+
+    def __next__(self) -> T:
+        started = time.perf_counter()
+        try:
+            item = next(self._items)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.seconds += elapsed
+        # Only items are observed, not running out of them
+        stage_seconds.observe(elapsed, stage=self.stage)
+        return item
+
+
+def render() -> str:
+    return registry.render()
@@ -0,0 +1,164 @@
+"""
+Move documents stored one collection per document into the shared collection.
+
+Every collection whose name is a document id (a UUID) is copied into
+`QDRANT_COLLECTION` with its points tagged by `document_id`. Point ids are kept,
+so the migration can safely be re-run. Afterwards, set
+`QDRANT_STORAGE_MODE=shared`; document ids stay the same.
+
+    python -m src.migrate [--delete-source] [--batch-size 256]
+"""
+
+import argparse
+import asyncio
+import uuid
+
+from qdrant_client import AsyncQdrantClient, models
+
+from src.utils import create_logger
+from src.vectorstore import (
+    QDRANT_COLLECTION,
+    QDRANT_URL,
+    collection_vector_size,
+    ensure_shared_collection,
+    fit_vector,
+)
+
+logger = create_logger(logger_name="migrate", log_file="api.log", log_level="info")
+
+
+def is_document_collection(name: str) -> bool:
+    try:
+        uuid.UUID(name)
+    except ValueError:
+        return False
+    return name != QDRANT_COLLECTION
+
+
+async def migrate_collection(
+    client: AsyncQdrantClient, document_id: str, batch_size: int = 256
+) -> int:
+    """
+    Copy the points of one per-document collection into the shared collection.
+
+    Vectors are truncated if the shared collection stores smaller ones.
+
+    Args:
+        client (AsyncQdrantClient): An instance of the Qdrant client.
+        document_id (str): The id of the document, which is also its collection name.
+        batch_size (int): The number of points read and written per request.
+
+    Returns:
+        int: The number of points copied.
+    """
+    vector_size = await collection_vector_size(client, QDRANT_COLLECTION)
+    copied = 0
+    offset = None
+    while True:
+        points, offset = await client.scroll(
+            collection_name=document_id,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        if points:
+            await client.upsert(
+                collection_name=QDRANT_COLLECTION,
+                points=[
+                    models.PointStruct(
+                        id=point.id,
+                        vector=fit_vector(point.vector, vector_size),
+                        payload={**point.payload, "document_id": document_id},
+                    )
+                    for point in points
+                ],
+            )
+            copied += len(points)
+        if offset is None:
+            return copied
+
+
+async def migrate(
+    client: AsyncQdrantClient, delete_source: bool = False, batch_size: int = 256
+) -> dict[str, int]:
+    """
+    Migrate every per-document collection into the shared collection.
+
+    A source collection is only deleted once the shared collection holds as many
+    points for its document as the source does.
+
+    Args:
+        client (AsyncQdrantClient): An instance of the Qdrant client.
+        delete_source (bool): Delete each per-document collection after copying it.
+        batch_size (int): The number of points read and written per request.
+
+    Returns:
+        dict[str, int]: The number of points copied, by document id.
+    """
+    await ensure_shared_collection(client)
+    collections = (await client.get_collections()).collections
+    migrated = {}
+    for collection in collections:
+        document_id = collection.name
+        if not is_document_collection(document_id):
+            continue
+
+        copied = await migrate_collection(client, document_id, batch_size)
+        migrated[document_id] = copied
+        logger.info("Copied %d points of document %s", copied, document_id)
+
+        if delete_source:
+            source_count = (await client.count(document_id, exact=True)).count
+            target_count = (
+                await client.count(
+                    QDRANT_COLLECTION,
+                    count_filter=models.Filter(
+                        must=[
+                            models.FieldCondition(
+                                key="document_id",
+                                match=models.MatchValue(value=document_id),
+                            )
+                        ]
+                    ),
+                    exact=True,
+                )
+            ).count
+            if target_count < source_count:
+                logger.error(
+                    "Keeping collection %s: only %d of %d points were found in %s",
+                    document_id,
+                    target_count,
+                    source_count,
+                    QDRANT_COLLECTION,
+                )
+                continue
+            await client.delete_collection(document_id)
+            logger.info("Deleted collection %s", document_id)
+    return migrated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--delete-source", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=256)
+    args = parser.parse_args()
+
+    async def run():
+        client = AsyncQdrantClient(url=QDRANT_URL)
+        try:
+            migrated = await migrate(client, args.delete_source, args.batch_size)
+        finally:
+            await client.close()
+        logger.info(
+            "Migrated %d documents (%d points) into %s",
+            len(migrated),
+            sum(migrated.values()),
+            QDRANT_COLLECTION,
+        )
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,9 @@
+import os
 from enum import Enum
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+BATCH_MAX_TOPICS = int(os.environ.get("BATCH_MAX_TOPICS", "64"))
 
 
 class QuestionsType(str, Enum):
@@ -39,3 +42,60 @@ class SummaryRequest(BaseModel):
 class SummaryResponse(BaseModel):
     topic: str
     summary: str
+
+
+class BatchSummaryRequest(BaseModel):
+    topics: list[str] = Field(min_length=1, max_length=BATCH_MAX_TOPICS)
+    document_id: str
+
+
+class BatchSummaryItem(BaseModel):
+    topic: str
+    summary: str | None = None
+    error: str | None = None
+
+
+class StudyPackRequest(BaseModel):
+    topic: str
+    document_id: str
+    include_summary: bool = True
+    questions_types: list[QuestionsType] = Field(
+        default_factory=lambda: [type.value for type in QuestionsType]
+    )
+
+    class Config:
+        use_enum_values = True
+
+
+class StudyPackResponse(BaseModel):
+    topic: str
+    summary: str | None = None
+    questions: dict[QuestionsType, str] = {}
+
+
+class JobState(str, Enum):
+    Queued = "queued"
+    Running = "running"
+    Succeeded = "succeeded"
+    Failed = "failed"
+
+
+class IngestJob(BaseModel):
+    job_id: str
+    document_id: str
+    state: JobState
+
+
+class JobStatus(BaseModel):
+    job_id: str
+    document_id: str
+    file_name: str
+    state: JobState
+    pages_processed: int = 0
+    chunks_processed: int = 0
+    error: str | None = None
+    queued_at: float
+    started_at: float | None = None
+    finished_at: float | None = None
+    queue_seconds: float | None = None
+    run_seconds: float | None = None
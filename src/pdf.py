@@ -0,0 +1,155 @@
+import io
+import multiprocessing
+import os
+import tempfile
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pymupdf
+
+# Documents with at least this many pages are extracted by a process pool
+PDF_PARALLEL_PAGE_THRESHOLD = int(os.environ.get("PDF_PARALLEL_PAGE_THRESHOLD", "200"))
+PDF_EXTRACTION_WORKERS = int(
+    os.environ.get("PDF_EXTRACTION_WORKERS", str(os.cpu_count() or 1))
+)
+PDF_EXTRACTION_SHARD_PAGES = int(os.environ.get("PDF_EXTRACTION_SHARD_PAGES", "50"))
+
+PdfSource = io.BytesIO | str
+
+_executor: ProcessPoolExecutor | None = None
+
+
+def open_pdf(source: PdfSource) -> "pymupdf.Document":
+    """Open a PDF document from a byte stream or a file path."""
+    # Imported on first use to keep it out of the app's startup time
+    import pymupdf
+
+    if isinstance(source, str):
+        return pymupdf.Document(source, filetype="pdf")
+    return pymupdf.Document(stream=source, filetype="pdf")
+
+
+def extract_page_range(path: str, start: int, stop: int) -> list[str]:
+    """
+    Extract the text of pages `start` to `stop` (exclusive).
+
+    This runs inside the worker processes, so every call opens the document itself.
+    """
+    import pymupdf
+
+    with pymupdf.Document(path, filetype="pdf") as doc:
+        return [doc[i].get_text() for i in range(start, stop)]
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # "spawn" avoids forking a process that is running threads
+        _executor = ProcessPoolExecutor(
+            max_workers=PDF_EXTRACTION_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+def shutdown_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+
+def iter_pages_parallel(path: str, page_count: int) -> Iterator[str]:
+    """
+    Extract pages with a process pool, yielding them in page order.
+
+    The page range is sharded into `PDF_EXTRACTION_SHARD_PAGES` pages per task and
+    only twice as many shards as workers are in flight at once, so a slow consumer
+    doesn't cause the whole document to pile up in memory.
+
+    Args:
+        path (str): Path of the PDF document, opened by every worker.
+        page_count (int): The number of pages in the document.
+
+    Yields:
+        str: The text of each page, in page order.
+    """
+    executor = get_executor()
+    shards = iter(range(0, page_count, PDF_EXTRACTION_SHARD_PAGES))
+    in_flight: deque[Future] = deque()
+
+    def submit_next() -> None:
+        start = next(shards, None)
+        if start is not None:
+            stop = min(start + PDF_EXTRACTION_SHARD_PAGES, page_count)
+            in_flight.append(executor.submit(extract_page_range, path, start, stop))
+
+    for _ in range(2 * PDF_EXTRACTION_WORKERS):
+        submit_next()
+    try:
+        while in_flight:
+            pages = in_flight.popleft().result()
+            submit_next()
+            yield from pages
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+
+def iter_pages(source: PdfSource) -> Iterator[str]:
+    """
+    Lazily extract the text of a PDF document page by page.
+
+    Documents with fewer than `PDF_PARALLEL_PAGE_THRESHOLD` pages are extracted
+    serially; larger ones are sharded across a process pool. In-memory documents
+    are spilled to a temporary file first so the workers can open them without
+    each receiving a pickled copy of the bytes.
+
+    Args:
+        source (io.BytesIO | str): The PDF document as a byte stream or a file path.
+
+    Yields:
+        str: The text of each page, in page order.
+    """
+    doc = open_pdf(source)
+    try:
+        page_count = doc.page_count
+        if page_count < PDF_PARALLEL_PAGE_THRESHOLD or PDF_EXTRACTION_WORKERS < 2:
+            for page in doc:
+                yield page.get_text()
+            return
+    finally:
+        doc.close()
+
+    if isinstance(source, str):
+        yield from iter_pages_parallel(source, page_count)
+        return
+
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as spilled:
+        source.seek(0)
+        spilled.write(source.getbuffer())
+        spilled.flush()
+        yield from iter_pages_parallel(spilled.name, page_count)
+
+
+def extract_text(source: PdfSource) -> tuple[str, list[int]]:
+    """
+    Extract the full text of a PDF document along with per-page offsets.
+
+    Args:
+        source (io.BytesIO | str): The PDF document as a byte stream or a file path.
+
+    Returns:
+        tuple[str, list[int]]: The document text and the offset at which each page starts.
+    """
+    pages = []
+    offsets = []
+    position = 0
+    for page_text in iter_pages(source):
+        offsets.append(position)
+        pages.append(page_text)
+        position += len(page_text)
+    return "".join(pages), offsets
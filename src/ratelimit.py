@@ -0,0 +1,377 @@
+import asyncio
+import email.utils
+import fcntl
+import functools
+import json
+import os
+import random
+import sys
+import threading
+import time
+import weakref
+from collections.abc import Awaitable, Callable
+from typing import TypeVar
+
+import httpx
+
+from src import metrics
+from src.utils import create_logger
+
+# Directory for rate limit state shared by all worker processes on a host; when
+# empty, every process limits itself independently
+RATE_LIMIT_STATE_DIR = os.environ.get("RATE_LIMIT_STATE_DIR", "")
+# Upper bound of a single backoff delay, in seconds
+RATE_LIMIT_MAX_BACKOFF = float(os.environ.get("RATE_LIMIT_MAX_BACKOFF", "30"))
+
+logger = create_logger(logger_name="ratelimit", log_file="api.log", log_level="info")
+
+T = TypeVar("T")
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at `rate_per_minute`, holding at most a minute's worth.
+
+    `reserve` takes tokens immediately, going into debt if there aren't enough,
+    and returns how long the caller must wait for the debt to be paid off. This
+    keeps callers in arrival order without a queue.
+
+    With a `path`, the bucket lives in a small JSON file locked with `flock`, so
+    all processes using the same file share one budget.
+
+    Args:
+        rate_per_minute (float): Tokens added per minute; 0 disables the bucket.
+        path (str | None): File holding the shared state, or None for a process-local bucket.
+    """
+
+    def __init__(self, rate_per_minute: float, path: str | None = None):
+        self.rate = rate_per_minute / 60
+        self.capacity = rate_per_minute
+        self.path = path
+        self._state = {"tokens": self.capacity, "updated_at": time.time()}
+        self._lock = threading.Lock()
+
+    def _take(self, state: dict, amount: float, now: float) -> float:
+        tokens = min(
+            self.capacity, state["tokens"] + (now - state["updated_at"]) * self.rate
+        )
+        # A request larger than the bucket could never be served otherwise
+        tokens -= min(amount, self.capacity)
+        state["tokens"], state["updated_at"] = tokens, now
+        return max(0.0, -tokens / self.rate)
+
+    def reserve(self, amount: float) -> float:
+        """Take `amount` tokens and return the seconds to wait before using them."""
+        if self.rate <= 0:
+            return 0.0
+        if self.path is None:
+            with self._lock:
+                return self._take(self._state, amount, time.time())
+        with SharedState(self.path) as state:
+            state.setdefault("tokens", self.capacity)
+            state.setdefault("updated_at", time.time())
+            return self._take(state, amount, time.time())
+
+
+class SharedState:
+    """Read-modify-write access to a JSON file, locked against other processes."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __enter__(self) -> dict:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._file = open(self.path, "a+")
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        self._file.seek(0)
+        try:
+            self.state = json.loads(self._file.read() or "{}")
+        except ValueError:
+            self.state = {}
+        return self.state
+
+    def __exit__(self, exc_type, *exc):
+        try:
+            if exc_type is None:
+                self._file.seek(0)
+                self._file.truncate()
+                json.dump(self.state, self._file)
+                self._file.flush()
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+
+
+class AdaptiveConcurrency:
+    """
+    Concurrency limit adjusted with AIMD (additive increase, multiplicative decrease).
+
+    Every successful call that is faster than `latency_target` raises the limit
+    by `1 / limit`, so about one slot per round of calls. A rate limited call,
+    or one slower than the target, halves it (at most once per `cooldown`
+    seconds, so one burst of failures counts once).
+
+    Args:
+        max_limit (int): The starting and highest limit.
+        min_limit (int): The lowest limit.
+        latency_target (float): Seconds above which a call counts as congestion; 0 disables it.
+        cooldown (float): Minimum seconds between two decreases.
+    """
+
+    def __init__(
+        self,
+        max_limit: int,
+        min_limit: int = 1,
+        latency_target: float = 0.0,
+        cooldown: float = 1.0,
+    ):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.latency_target = latency_target
+        self.cooldown = cooldown
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition: asyncio.Condition | None = None
+        self._condition_loop: asyncio.AbstractEventLoop | None = None
+
+    def _get_condition(self) -> asyncio.Condition:
+        loop = asyncio.get_running_loop()
+        if self._condition is None or self._condition_loop is not loop:
+            self._condition = asyncio.Condition()
+            self._condition_loop = loop
+        return self._condition
+
+    async def __aenter__(self):
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def __aexit__(self, *exc):
+        condition = self._get_condition()
+        async with condition:
+            self.in_flight -= 1
+            condition.notify_all()
+
+    def record_success(self, latency: float) -> None:
+        if self.latency_target and latency > self.latency_target:
+            self.decrease()
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def decrease(self) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit / 2)
+        logger.info("Reduced the concurrency limit to %d", self.limit)
+
+
+def status_code(error: Exception) -> int | None:
+    """The HTTP status of a failed call (httpx and OpenAI errors carry the response)."""
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def retry_after_seconds(error: Exception) -> float | None:
+    """Parse the `Retry-After` header of a failed call, in seconds or as an HTTP date."""
+    response = getattr(error, "response", None)
+    value = getattr(response, "headers", {}).get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(
+            0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+        )
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Rate limits, timeouts, server errors and failed connections are retried;
+    other errors, including bugs in the caller, aren't.
+    """
+    status = status_code(error)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    if isinstance(error, httpx.TransportError):
+        return True
+    # Only look for OpenAI's errors once the client is in use, as importing it is slow
+    openai = sys.modules.get("openai")
+    return openai is not None and isinstance(
+        error, (openai.APIConnectionError, openai.APITimeoutError)
+    )
+
+
+# The live rate limiter of each upstream, reported in the metrics
+rate_limiters: "weakref.WeakValueDictionary[str, RateLimiter]" = (
+    weakref.WeakValueDictionary()
+)
+
+
+def rate_limiter_samples(read: Callable[["RateLimiter"], float]) -> metrics.Sampler:
+    return lambda: [
+        ({"upstream": name}, read(limiter)) for name, limiter in rate_limiters.items()
+    ]
+
+
+metrics.registry.register_callback(
+    "rag_qa_upstream_rate_limited_total",
+    "Upstream calls rejected with 429",
+    "counter",
+    rate_limiter_samples(lambda limiter: limiter.rate_limited),
+)
+metrics.registry.register_callback(
+    "rag_qa_upstream_retries_total",
+    "Upstream calls retried after a failure",
+    "counter",
+    rate_limiter_samples(lambda limiter: limiter.retries),
+)
+metrics.registry.register_callback(
+    "rag_qa_upstream_concurrency_limit",
+    "Current adaptive concurrency limit of the upstream",
+    "gauge",
+    rate_limiter_samples(lambda limiter: int(limiter.concurrency.limit)),
+)
+
+
+class RateLimiter:
+    """
+    Client-side throttling and retries for one upstream API.
+
+    Before each call, one request is taken from the requests-per-minute bucket
+    and the call's estimated tokens from the tokens-per-minute bucket, and a
+    slot from the adaptive concurrency limit. Failed calls are retried with
+    full-jitter exponential backoff. A `Retry-After` delay instead pauses every
+    caller (in every process, with shared state) until it has passed, and a 429
+    also halves the concurrency limit.
+
+    Args:
+        name (str): The upstream's name, used for the shared state files.
+        requests_per_minute (float): The request budget; 0 means unlimited.
+        tokens_per_minute (float): The token budget; 0 means unlimited.
+        max_concurrency (int): The highest number of calls in flight.
+        max_retries (int): How many times a failed call is retried.
+        retry_backoff (float): Base backoff delay in seconds, doubled after every failure.
+        latency_target (float): Calls slower than this reduce the concurrency limit; 0 disables it.
+        state_dir (str): Directory for state shared across processes, or "" for none.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: float = 0,
+        tokens_per_minute: float = 0,
+        max_concurrency: int = 8,
+        max_retries: int = 3,
+        retry_backoff: float = 0.5,
+        latency_target: float = 0.0,
+        state_dir: str = RATE_LIMIT_STATE_DIR,
+    ):
+        self.name = name
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.concurrency = AdaptiveConcurrency(
+            max_concurrency, latency_target=latency_target
+        )
+
+        def state_path(kind: str) -> str | None:
+            return os.path.join(state_dir, f"{name}.{kind}.json") if state_dir else None
+
+        self._pause_path = state_path("pause")
+        self.requests = TokenBucket(requests_per_minute, path=state_path("requests"))
+        self.tokens = TokenBucket(tokens_per_minute, path=state_path("tokens"))
+        self._paused_until = 0.0
+        self.rate_limited = 0
+        self.retries = 0
+        rate_limiters[name] = self
+
+    def _shared(self) -> bool:
+        return self._pause_path is not None
+
+    def _pause(self, seconds: float) -> None:
+        until = time.time() + seconds
+        self._paused_until = max(self._paused_until, until)
+        if self._shared():
+            with SharedState(self._pause_path) as state:
+                state["paused_until"] = max(state.get("paused_until", 0.0), until)
+
+    def _pause_remaining(self) -> float:
+        until = self._paused_until
+        if self._shared():
+            with SharedState(self._pause_path) as state:
+                until = max(until, state.get("paused_until", 0.0))
+        return max(0.0, until - time.time())
+
+    async def _run_blocking(self, fn: Callable[[], T]) -> T:
+        # File locks may block on other processes, so keep them off the event loop
+        return await asyncio.to_thread(fn) if self._shared() else fn()
+
+    async def acquire(self, tokens: float) -> None:
+        """Wait until a call estimated at `tokens` tokens fits in the budgets."""
+        pause = await self._run_blocking(self._pause_remaining)
+        if pause > 0:
+            await asyncio.sleep(pause)
+        wait = max(
+            await self._run_blocking(lambda: self.requests.reserve(1)),
+            await self._run_blocking(lambda: self.tokens.reserve(tokens)),
+        )
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(
+            0, min(RATE_LIMIT_MAX_BACKOFF, self.retry_backoff * 2**attempt)
+        )
+
+    async def call(self, fn: Callable[[], Awaitable[T]], tokens: float = 0) -> T:
+        """
+        Run `fn()` within the limits, retrying it on retryable failures.
+
+        Args:
+            fn (Callable[[], Awaitable[T]]): Starts the upstream call.
+            tokens (float): The estimated tokens of the call.
+
+        Returns:
+            T: The result of the first successful call.
+        """
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(tokens)
+            async with self.concurrency:
+                started = time.perf_counter()
+                try:
+                    result = await fn()
+                except Exception as e:
+                    error = e
+                else:
+                    self.concurrency.record_success(time.perf_counter() - started)
+                    return result
+
+            retry_after = retry_after_seconds(error)
+            if status_code(error) == 429:
+                self.rate_limited += 1
+                self.concurrency.decrease()
+            if retry_after:
+                # Every caller waits, since they would all be rejected anyway
+                await self._run_blocking(functools.partial(self._pause, retry_after))
+            if attempt == self.max_retries or not is_retryable(error):
+                raise error
+            self.retries += 1
+            delay = retry_after if retry_after is not None else self.backoff(attempt)
+            logger.warning(
+                "%s call failed (attempt %d/%d): %s; retrying in %.2fs",
+                self.name,
+                attempt + 1,
+                self.max_retries + 1,
+                error,
+                delay,
+            )
+            if retry_after is None:
+                await asyncio.sleep(delay)
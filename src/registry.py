@@ -0,0 +1,188 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+from qdrant_client import AsyncQdrantClient
+
+from src.models import DocumentMetadata
+from src.pdf import extract_text
+from src.utils import UploadedDocument, create_logger
+from src.vectorstore import document_exists
+
+# Content-hash registry of ingested documents; set DOCUMENT_REGISTRY_PATH to an
+# empty string to disable deduplication
+DOCUMENT_REGISTRY_PATH = os.environ.get(
+    "DOCUMENT_REGISTRY_PATH", ".cache/documents.sqlite3"
+)
+# Also match documents whose normalized text is identical (e.g. the same slides
+# re-exported). This costs an extra text extraction per upload.
+DEDUP_TEXT_FINGERPRINT = (
+    os.environ.get("DEDUP_TEXT_FINGERPRINT", "false").lower() == "true"
+)
+
+logger = create_logger(logger_name="registry", log_file="api.log", log_level="info")
+
+
+class DocumentRegistry:
+    """
+    Maps content fingerprints of uploaded documents to the documents ingested from them.
+
+    A document can be registered under several fingerprints (the hash of the
+    uploaded bytes and, optionally, of its normalized text); any of them matching
+    identifies a duplicate.
+
+    Args:
+        path (str): Path of the SQLite database, or ":memory:" for a process-local registry.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # Opened lazily so importing the module never touches the filesystem
+        if self._conn is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                "fingerprint TEXT PRIMARY KEY, document_id TEXT NOT NULL, "
+                "file_name TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS documents_document_id ON documents(document_id)"
+            )
+        return self._conn
+
+    def get(self, fingerprints: list[str]) -> DocumentMetadata | None:
+        """
+        Look up the document registered under any of the given fingerprints.
+
+        Args:
+            fingerprints (list[str]): Fingerprints built with `fingerprint_upload`.
+
+        Returns:
+            DocumentMetadata | None: The first match, in the order of `fingerprints`.
+        """
+        with self._lock:
+            conn = self._connection()
+            for fingerprint in fingerprints:
+                row = conn.execute(
+                    "SELECT document_id, file_name FROM documents WHERE fingerprint = ?",
+                    (fingerprint,),
+                ).fetchone()
+                if row is not None:
+                    return DocumentMetadata(id=row[0], file_name=row[1])
+        return None
+
+    def put(self, fingerprints: list[str], metadata: DocumentMetadata) -> None:
+        """
+        Register a document under each of the given fingerprints.
+
+        Args:
+            fingerprints (list[str]): Fingerprints of the document's upload.
+            metadata (DocumentMetadata): The ingested document.
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                "INSERT OR REPLACE INTO documents "
+                "(fingerprint, document_id, file_name, created_at) VALUES (?, ?, ?, ?)",
+                [(f, metadata.id, metadata.file_name, now) for f in fingerprints],
+            )
+            conn.commit()
+
+    def remove(self, document_id: str) -> None:
+        """Forget every fingerprint registered for a document."""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM documents WHERE document_id = ?", (document_id,))
+            conn.commit()
+
+
+document_registry = (
+    DocumentRegistry(DOCUMENT_REGISTRY_PATH) if DOCUMENT_REGISTRY_PATH else None
+)
+
+
+def normalize_text(text: str) -> str:
+    """Normalize extracted text so layout-only differences don't change its hash."""
+    return " ".join(unicodedata.normalize("NFKC", text).lower().split())
+
+
+def text_fingerprint(path: str) -> str:
+    text, _ = extract_text(path)
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+async def fingerprint_upload(upload: UploadedDocument) -> list[str]:
+    """
+    Return the fingerprints identifying an upload, most specific first.
+
+    The byte hash is computed while the upload is spooled; the text hash is only
+    computed when `DEDUP_TEXT_FINGERPRINT` is enabled and is kept on the upload.
+
+    Args:
+        upload (UploadedDocument): The spooled upload.
+
+    Returns:
+        list[str]: The fingerprints, prefixed with their kind.
+    """
+    fingerprints = [f"sha256:{upload.sha256}"]
+    if DEDUP_TEXT_FINGERPRINT:
+        if upload.text_sha256 is None:
+            upload.text_sha256 = await asyncio.to_thread(text_fingerprint, upload.path)
+        fingerprints.append(f"text:{upload.text_sha256}")
+    return fingerprints
+
+
+async def find_duplicate(
+    upload: UploadedDocument, client: AsyncQdrantClient
+) -> DocumentMetadata | None:
+    """
+    Find an already ingested document with the same content as an upload.
+
+    Registry entries whose document is no longer stored in Qdrant are dropped.
+
+    Args:
+        upload (UploadedDocument): The spooled upload.
+        client (AsyncQdrantClient): An instance of the Qdrant client.
+
+    Returns:
+        DocumentMetadata | None: The existing document, or None if the upload is new.
+    """
+    if document_registry is None:
+        return None
+    fingerprints = await fingerprint_upload(upload)
+    existing = await asyncio.to_thread(document_registry.get, fingerprints)
+    if existing is None:
+        return None
+    if not await document_exists(client, existing.id):
+        logger.info("Dropping stale registry entries for document %s", existing.id)
+        await asyncio.to_thread(document_registry.remove, existing.id)
+        return None
+    return existing
+
+
+async def register_document(
+    upload: UploadedDocument, metadata: DocumentMetadata
+) -> None:
+    """
+    Record an ingested document under its upload's fingerprints.
+
+    Args:
+        upload (UploadedDocument): The spooled upload the document was ingested from.
+        metadata (DocumentMetadata): The ingested document.
+    """
+    if document_registry is None:
+        return
+    fingerprints = await fingerprint_upload(upload)
+    await asyncio.to_thread(document_registry.put, fingerprints, metadata)
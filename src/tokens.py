@@ -0,0 +1,61 @@
+import math
+import os
+from functools import lru_cache
+
+from src.utils import create_logger
+
+# tiktoken encoding used to count prompt tokens; if it can't be loaded, tokens
+# are estimated from the text length
+TOKENIZER_ENCODING = os.environ.get("TOKENIZER_ENCODING", "o200k_base")
+# Where tiktoken keeps the encoding file it downloads on first use, so that it is
+# only downloaded once (the Docker image has it already); defaults to the
+# project's .cache directory wherever the app is started from
+TIKTOKEN_CACHE_DIR = os.environ.get(
+    "TIKTOKEN_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), ".cache", "tiktoken"),
+)
+# Rough average for English text, used by the estimate
+CHARS_PER_TOKEN = 4
+
+logger = create_logger(logger_name="tokens", log_file="api.log", log_level="info")
+
+
+def load_encoding():
+    """Load the tiktoken encoding, downloading it into `TIKTOKEN_CACHE_DIR` if needed."""
+    import tiktoken
+
+    # tiktoken only reads its cache directory from the environment
+    os.environ.setdefault("TIKTOKEN_CACHE_DIR", TIKTOKEN_CACHE_DIR)
+    return tiktoken.get_encoding(TOKENIZER_ENCODING)
+
+
+@lru_cache(maxsize=1)
+def get_encoding():
+    """
+    Return the tiktoken encoding, or None if it isn't available.
+
+    The first call may download the encoding file, so the app loads it at startup.
+    """
+    try:
+        return load_encoding()
+    except Exception as e:
+        # Not installed, or the encoding file isn't cached and can't be downloaded
+        logger.warning("Estimating token counts, tiktoken is unavailable: %s", e)
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Count the tokens of a text with the local tokenizer, or estimate them."""
+    encoding = get_encoding()
+    if encoding is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Cut a text down to at most `max_tokens` tokens."""
+    encoding = get_encoding()
+    if encoding is None:
+        return text[: max_tokens * CHARS_PER_TOKEN]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
@@ -1,63 +1,213 @@
-import io
+import asyncio
+import atexit
+import copy
+import hashlib
+import json
 import logging
-import time
+import logging.handlers
+import os
+import queue
+import tempfile
+import threading
+from dataclasses import dataclass
+from typing import BinaryIO
 
 from fastapi import HTTPException
 from starlette.datastructures import UploadFile
 
+# Overrides the level passed to `create_logger` for every logger, e.g. "debug"
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "")
+# Write one JSON object per line instead of plain text
+LOG_JSON = os.environ.get("LOG_JSON", "false").lower() == "true"
+LOG_FORMAT = "[%(asctime)s | %(name)s | %(levelname)s | %(message)s]"
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as JSON lines with the time, logger, level, message and traceback."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "logger": record.name,
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that leaves the formatting to the listener.
+
+    Only the message is interpolated in the logging thread, since its arguments
+    may change afterwards; the timestamp, layout and any traceback are formatted
+    by the listener's thread, along with the disk writes.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            # Tracebacks keep frames alive, so render them now
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+# log file -> the queue handler feeding its listener
+_queue_handlers: dict[str, LogQueueHandler] = {}
+_queue_handlers_lock = threading.Lock()
+
+
+def get_queue_handler(log_file: str) -> LogQueueHandler:
+    """
+    Return the queue handler of a log file, starting its listener on first use.
+
+    The listener writes to the file (everything) and to the console (info and
+    above) from a background thread, so logging never blocks on I/O. It is
+    stopped at exit, after the queued records are written.
+    """
+    path = os.path.abspath(log_file)
+    with _queue_handlers_lock:
+        handler = _queue_handlers.get(path)
+        if handler is not None:
+            return handler
+
+        formatter = JsonFormatter() if LOG_JSON else logging.Formatter(LOG_FORMAT)
+        file_handler = logging.FileHandler(path)
+        file_handler.setLevel(logging.DEBUG)
+        file_handler.setFormatter(formatter)
+        console_handler = logging.StreamHandler()
+        console_handler.setLevel(logging.INFO)
+        console_handler.setFormatter(formatter)
+
+        log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(
+            log_queue, file_handler, console_handler, respect_handler_level=True
+        )
+        listener.start()
+        atexit.register(listener.stop)
+
+        handler = _queue_handlers[path] = LogQueueHandler(log_queue)
+        return handler
+
 
 def create_logger(logger_name, log_file, log_level):
-    LOG_FORMAT = "[%(asctime)s | %(name)s | %(levelname)s | %(message)s]"
-    log_level = getattr(logging, log_level.upper())
+    """
+    Return the named logger, writing to `log_file` and the console through a queue.
 
+    Calling it again for the same logger doesn't add another handler. Records
+    below `log_level` (or `LOG_LEVEL`, if set) are dropped before their message
+    is formatted, so pass arguments rather than f-strings on hot paths.
+    """
     logger = logging.getLogger(logger_name)
-    logger.setLevel(logging.DEBUG)
+    logger.setLevel(getattr(logging, (LOG_LEVEL or log_level).upper()))
 
-    file_handler = logging.FileHandler(log_file)
-    file_handler.setLevel(logging.DEBUG)
-    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
-    logger.addHandler(file_handler)
-
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-    console_handler.setFormatter(logging.Formatter(LOG_FORMAT))
-    logger.addHandler(console_handler)
+    handler = get_queue_handler(log_file)
+    if handler not in logger.handlers:
+        logger.addHandler(handler)
 
     return logger
 
 
-def log_execution_time(logger):
-    """Decorator factory to log the execution time of a function using a specified logger."""
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", str(256 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+UPLOAD_TMP_DIR = os.environ.get("UPLOAD_TMP_DIR") or None
+
 
-    def decorator(func):
-        def wrapper(*args, **kwargs):
-            start_time = time.time()
-            result = func(*args, **kwargs)
-            end_time = time.time()
-            execution_time = end_time - start_time
-            logger.info(f"Executing {func.__name__} took {execution_time:.4f} seconds")
-            return result
+@dataclass
+class UploadedDocument:
+    """An uploaded file spooled to a temporary file on disk."""
 
-        return wrapper
+    path: str
+    name: str
+    size: int
+    sha256: str
+    text_sha256: str | None = None
 
-    return decorator
+    def close(self) -> None:
+        """Delete the temporary file."""
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
 
 
-async def process_uploaded_file(file: UploadFile) -> io.BytesIO:
+def upload_too_large() -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"File too large. The maximum upload size is {UPLOAD_MAX_BYTES} bytes",
+    )
+
+
+def spool_to_disk(
+    source: BinaryIO, max_bytes: int = UPLOAD_MAX_BYTES
+) -> tuple[str, int, str]:
     """
-    Process an uploaded file by reading its content and converting it into a BytesIO object.
+    Copy a file object to a temporary file in chunks, enforcing a size cap.
+
+    The content is hashed on the way through, so fingerprinting the upload
+    doesn't need a second pass over it.
 
     Args:
-        file (UploadFile): The uploaded file object.
+        source (BinaryIO): The file object to copy.
+        max_bytes (int): The maximum number of bytes accepted.
 
     Returns:
-        io.BytesIO: A BytesIO object containing the file content.
+        tuple[str, int, str]: The path of the temporary file, its size in bytes and
+            the SHA-256 hex digest of its content.
+
+    Raises:
+        HTTPException: If the file is larger than `max_bytes`.
+    """
+    size = 0
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(
+        suffix=".pdf", dir=UPLOAD_TMP_DIR, delete=False
+    ) as spooled:
+        try:
+            while chunk := source.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise upload_too_large()
+                spooled.write(chunk)
+                digest.update(chunk)
+        except BaseException:
+            spooled.close()
+            os.unlink(spooled.name)
+            raise
+    return spooled.name, size, digest.hexdigest()
+
+
+async def process_uploaded_file(file: UploadFile) -> UploadedDocument:
     """
-    file_content = await file.read()
-    pdf_file = io.BytesIO(file_content)
-    pdf_file.name = file.filename
+    Process an uploaded file by streaming it in chunks to a temporary file on disk.
+
+    The upload is never held in memory as a whole, so pymupdf can open it from the
+    file path instead of an in-memory stream. The caller owns the returned document
+    and must `close()` it to delete the temporary file.
 
-    return pdf_file
+    Args:
+        file (UploadFile): The uploaded file object.
+
+    Returns:
+        UploadedDocument: The spooled file, its original name, size and content hash.
+
+    Raises:
+        HTTPException: If the file is larger than `UPLOAD_MAX_BYTES`.
+    """
+    if file.size is not None and file.size > UPLOAD_MAX_BYTES:
+        raise upload_too_large()
+
+    await file.seek(0)
+    path, size, sha256 = await asyncio.to_thread(
+        spool_to_disk, file.file, UPLOAD_MAX_BYTES
+    )
+    return UploadedDocument(path=path, name=file.filename, size=size, sha256=sha256)
 
 
 def validate_pdf_file(file: UploadFile) -> None:
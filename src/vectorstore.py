@@ -1,118 +1,992 @@
+import asyncio
 import io
+import itertools
 import os
+import time
 import uuid
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import TYPE_CHECKING
 
-import pymupdf
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from qdrant_client import QdrantClient, models
+import httpx
+from qdrant_client import AsyncQdrantClient, models
+from qdrant_client.http.exceptions import ResponseHandlingException
 from qdrant_client.models import Distance, VectorParams
 
-from src.emb import EMBEDDING_DIMENSION, embed_query, embed_texts
+from src import metrics
+from src.admission import admit, qdrant_bulkhead
+from src.caching import SingleFlight, retrieval_cache
+from src.emb import embed_queries, embed_query, embed_texts, get_embedder
+from src.local_index import local_index
 from src.models import DocumentMetadata
-from src.utils import create_logger, log_execution_time
+from src.pdf import PdfSource, iter_pages
+from src.utils import UploadedDocument, create_logger
+
+if TYPE_CHECKING:
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 logger = create_logger(logger_name="vectorstore", log_file="api.log", log_level="info")
 
+QDRANT_URL = os.environ.get("QDRANT_URL", "http://localhost:6333")
+QDRANT_PREFER_GRPC = os.environ.get("QDRANT_PREFER_GRPC", "false").lower() == "true"
+QDRANT_POOL_SIZE = int(os.environ.get("QDRANT_POOL_SIZE", "32"))
+QDRANT_HEALTH_CHECK_INTERVAL = float(
+    os.environ.get("QDRANT_HEALTH_CHECK_INTERVAL", "30")
+)
+
+# Storage layout: "collection-per-document" creates a Qdrant collection per upload,
+# "shared" stores every document in QDRANT_COLLECTION, filtered by `document_id`
+QDRANT_STORAGE_MODE = os.environ.get("QDRANT_STORAGE_MODE", "collection-per-document")
+QDRANT_COLLECTION = os.environ.get("QDRANT_COLLECTION", "documents")
+QDRANT_SHARD_NUMBER = int(os.environ.get("QDRANT_SHARD_NUMBER", "1"))
+# How vectors are stored and searched, one of STORAGE_PROFILES
+QDRANT_STORAGE_PROFILE = os.environ.get("QDRANT_STORAGE_PROFILE", "default")
+
+# Streaming ingestion: chunks per embedding batch, points per upsert and the
+# number of batches buffered between pipeline stages
+INGEST_CHUNK_BATCH_SIZE = int(os.environ.get("INGEST_CHUNK_BATCH_SIZE", "64"))
+INGEST_UPSERT_BATCH_SIZE = int(os.environ.get("INGEST_UPSERT_BATCH_SIZE", "256"))
+INGEST_QUEUE_DEPTH = int(os.environ.get("INGEST_QUEUE_DEPTH", "4"))
+
+
+class QdrantConnection:
+    """
+    Application-wide Qdrant client with health checking and reconnect-on-failure.
+
+    A single `AsyncQdrantClient` is shared by all requests so they reuse pooled
+    keep-alive connections (or one multiplexed gRPC channel with `prefer_grpc`).
+    A background task pings Qdrant every `health_check_interval` seconds and
+    replaces the client if the ping fails.
+
+    Args:
+        url (str): The Qdrant URL.
+        prefer_grpc (bool): Whether to talk to Qdrant over gRPC instead of REST.
+        pool_size (int): The maximum number of pooled REST connections.
+        health_check_interval (float): Seconds between health checks, 0 disables them.
+    """
+
+    def __init__(
+        self,
+        url: str = QDRANT_URL,
+        prefer_grpc: bool = QDRANT_PREFER_GRPC,
+        pool_size: int = QDRANT_POOL_SIZE,
+        health_check_interval: float = QDRANT_HEALTH_CHECK_INTERVAL,
+    ):
+        self.url = url
+        self.prefer_grpc = prefer_grpc
+        self.pool_size = pool_size
+        self.health_check_interval = health_check_interval
+        self.healthy = True
+
+        self._client: AsyncQdrantClient | None = None
+        self._health_task: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+
+    def _create_client(self) -> AsyncQdrantClient:
+        # qdrant-client disables keep-alive for localhost unless limits are given
+        limits = httpx.Limits(
+            max_connections=self.pool_size, max_keepalive_connections=self.pool_size
+        )
+        return AsyncQdrantClient(
+            url=self.url, prefer_grpc=self.prefer_grpc, limits=limits
+        )
+
+    def mark_unhealthy(self) -> None:
+        """Force a reconnect on the next `get_client` call, e.g. after a transport error."""
+        self.healthy = False
+
+    async def get_client(self) -> AsyncQdrantClient:
+        if self._client is None or not self.healthy:
+            async with self._lock:
+                if self._client is None:
+                    self._client = self._create_client()
+                elif not self.healthy:
+                    await self._reconnect()
+        return self._client
+
+    async def _reconnect(self) -> None:
+        old_client, self._client = self._client, self._create_client()
+        self.healthy = True
+        if old_client is not None:
+            try:
+                await old_client.close()
+            except Exception as e:
+                logger.warning("Failed to close stale Qdrant client: %s", e)
+        logger.info("Reconnected to Qdrant")
+
+    async def health_check(self) -> bool:
+        """
+        Ping Qdrant and reconnect if it doesn't answer.
+
+        Returns:
+            bool: Whether the ping succeeded.
+        """
+        client = await self.get_client()
+        try:
+            await client.get_collections()
+            return True
+        except Exception as e:
+            logger.warning("Qdrant health check failed: %s", e)
+            async with self._lock:
+                if self._client is client:
+                    await self._reconnect()
+            return False
+
+    async def _health_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            await self.health_check()
+
+    async def start(self) -> None:
+        await self.get_client()
+        if self.health_check_interval > 0 and self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def close(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
 
-def get_qdrant_client() -> QdrantClient:
-    QDRANT_URL = os.environ.get("QDRANT_URL", "http://localhost:6333")
-    client = QdrantClient(url=QDRANT_URL)
+
+qdrant_connection = QdrantConnection()
+
+
+@dataclass(frozen=True)
+class StorageProfile:
+    """
+    How a collection stores and searches its vectors.
+
+    Attributes:
+        dimension (int | None): Store only the first `dimension` components of each
+            embedding (Matryoshka truncation), or the full embedding if None.
+        quantization (str | None): "scalar" (int8) or "binary" quantized vectors,
+            kept in RAM and searched first.
+        on_disk (bool): Keep the original vectors on disk instead of in RAM.
+        hnsw_m (int | None): Edges per node in the HNSW graph.
+        hnsw_ef_construct (int | None): Candidates considered while building the graph.
+        search_ef (int | None): Candidates considered while searching the graph.
+        oversampling (float | None): With quantization, fetch `oversampling` times
+            as many candidates and rescore them with the original vectors.
+    """
+
+    dimension: int | None = None
+    quantization: str | None = None
+    on_disk: bool = False
+    hnsw_m: int | None = None
+    hnsw_ef_construct: int | None = None
+    search_ef: int | None = None
+    oversampling: float | None = None
+
+    def vector_size(self, embedding_dimension: int) -> int:
+        return min(self.dimension or embedding_dimension, embedding_dimension)
+
+    def quantization_config(self) -> models.QuantizationConfig | None:
+        if self.quantization == "scalar":
+            return models.ScalarQuantization(
+                scalar=models.ScalarQuantizationConfig(
+                    type=models.ScalarType.INT8, quantile=0.99, always_ram=True
+                )
+            )
+        if self.quantization == "binary":
+            return models.BinaryQuantization(
+                binary=models.BinaryQuantizationConfig(always_ram=True)
+            )
+        return None
+
+    def hnsw_config(self, shared: bool) -> models.HnswConfigDiff | None:
+        if shared:
+            # Multitenancy: no global graph, one graph per `document_id` instead
+            return models.HnswConfigDiff(
+                payload_m=self.hnsw_m or 16, m=0, ef_construct=self.hnsw_ef_construct
+            )
+        if self.hnsw_m is None and self.hnsw_ef_construct is None:
+            return None
+        return models.HnswConfigDiff(m=self.hnsw_m, ef_construct=self.hnsw_ef_construct)
+
+    def collection_config(self, embedding_dimension: int, shared: bool) -> dict:
+        """Return the `create_collection` arguments for this profile."""
+        config = {
+            "vectors_config": VectorParams(
+                size=self.vector_size(embedding_dimension),
+                distance=Distance.DOT,
+                on_disk=self.on_disk or None,
+            )
+        }
+        if (hnsw_config := self.hnsw_config(shared)) is not None:
+            config["hnsw_config"] = hnsw_config
+        if (quantization_config := self.quantization_config()) is not None:
+            config["quantization_config"] = quantization_config
+        return config
+
+    def search_params(self) -> models.SearchParams | None:
+        """Return the `query_points` search parameters, None for Qdrant's defaults."""
+        quantization = None
+        if self.quantization is not None:
+            quantization = models.QuantizationSearchParams(
+                rescore=True, oversampling=self.oversampling
+            )
+        if self.search_ef is None and quantization is None:
+            return None
+        return models.SearchParams(hnsw_ef=self.search_ef, quantization=quantization)
+
+
+STORAGE_PROFILES = {
+    # Full-size float32 vectors and the HNSW graph in RAM
+    "default": StorageProfile(),
+    # Half-size vectors, int8 copies in RAM and the originals on disk for rescoring
+    "compact": StorageProfile(
+        dimension=512,
+        quantization="scalar",
+        on_disk=True,
+        search_ef=128,
+        oversampling=2.0,
+    ),
+    # Quarter-size vectors, otherwise like "compact"
+    "small": StorageProfile(
+        dimension=256,
+        quantization="scalar",
+        on_disk=True,
+        search_ef=128,
+        oversampling=3.0,
+    ),
+    # Full-size vectors with 1-bit copies in RAM; needs heavier oversampling
+    "binary": StorageProfile(
+        quantization="binary",
+        on_disk=True,
+        hnsw_m=32,
+        hnsw_ef_construct=200,
+        search_ef=256,
+        oversampling=4.0,
+    ),
+}
+
+
+def get_storage_profile() -> StorageProfile:
     try:
-        yield client
-    finally:
-        client.close()
+        return STORAGE_PROFILES[QDRANT_STORAGE_PROFILE]
+    except KeyError:
+        raise ValueError(f"Unknown storage profile: {QDRANT_STORAGE_PROFILE}")
 
 
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=512,
-    chunk_overlap=20,
-    length_function=len,
-    is_separator_regex=False,
-)
+def fit_vector(vector: list[float], size: int) -> list[float]:
+    """
+    Truncate an embedding to `size` components and L2-normalize it again.
+
+    Matryoshka embeddings keep most of their quality when truncated, as long as
+    they are renormalized for dot-product search.
+    """
+    if len(vector) <= size:
+        return vector
+    truncated = vector[:size]
+    norm = sum(x * x for x in truncated) ** 0.5 or 1.0
+    return [x / norm for x in truncated]
+
+
+# Vector size of every collection seen by this process. A collection keeps the
+# profile it was created with, so queries must match its size rather than the
+# current profile's.
+_vector_sizes: dict[str, int] = {}
+
+
+async def collection_vector_size(
+    client: AsyncQdrantClient, collection_name: str
+) -> int:
+    """Return the size of a collection's vectors, asking Qdrant the first time."""
+    if collection_name not in _vector_sizes:
+        info = await client.get_collection(collection_name)
+        _vector_sizes[collection_name] = info.config.params.vectors.size
+    return _vector_sizes[collection_name]
+
+
+async def get_qdrant_client() -> AsyncQdrantClient:
+    """FastAPI dependency returning the shared Qdrant client."""
+    return await qdrant_connection.get_client()
+
+
+CHUNK_SIZE = 512
+CHUNK_OVERLAP = 20
+
+
+@lru_cache(maxsize=1)
+def get_text_splitter() -> "RecursiveCharacterTextSplitter":
+    """Return the text splitter, importing langchain and creating it on first use."""
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        length_function=len,
+        is_separator_regex=False,
+        add_start_index=True,
+    )
+
+
+# How much page text to buffer before running the splitter on it
+SPLIT_WINDOW = 16 * CHUNK_SIZE
 
 
 def split_text(text):
-    chunks = text_splitter.create_documents([text])
+    chunks = get_text_splitter().create_documents([text])
     chunks_texts = [chunk.page_content for chunk in chunks]
 
     return chunks_texts
 
 
-def load_and_split_document(document_file: io.BytesIO) -> list[str]:
+def iter_chunk_spans(pages: Iterable[str]) -> Iterator[tuple[int, str]]:
+    """
+    Split streamed page text into chunks without holding the whole document.
+
+    Page text is buffered until it reaches `SPLIT_WINDOW` characters and then
+    split. The last chunk of every window may continue on the next page, so the
+    raw text from its start onwards is carried over into the next window.
+
+    Args:
+        pages (Iterable[str]): The text of each page, in page order.
+
+    Yields:
+        tuple[int, str]: The offset of each chunk in the document text and the
+            chunk, in document order.
+    """
+    buffer: list[str] = []
+    buffered = 0
+    # Offset of the start of the buffer in the whole document text
+    buffer_start = 0
+    for page_text in pages:
+        buffer.append(page_text)
+        buffered += len(page_text)
+        if buffered < SPLIT_WINDOW:
+            continue
+
+        text = "".join(buffer)
+        chunks = get_text_splitter().create_documents([text])
+        for chunk in chunks[:-1]:
+            yield buffer_start + chunk.metadata["start_index"], chunk.page_content
+        tail_start = chunks[-1].metadata["start_index"] if chunks else len(text)
+        buffer_start += tail_start
+        buffer, buffered = [text[tail_start:]], len(text) - tail_start
+
+    if buffer:
+        for chunk in get_text_splitter().create_documents(["".join(buffer)]):
+            yield buffer_start + chunk.metadata["start_index"], chunk.page_content
+
+
+def iter_chunks(pages: Iterable[str]) -> Iterator[str]:
+    """Like `iter_chunk_spans`, but only yields the text of the chunks."""
+    for _, chunk in iter_chunk_spans(pages):
+        yield chunk
+
+
+def load_and_split_document(document_file: PdfSource) -> list[str]:
     """
     Load a PDF document from a byte stream and split it into text chunks.
 
     Args:
-        document_file (io.BytesIO): The PDF document as a byte stream.
+        document_file (io.BytesIO | str): The PDF document as a byte stream or a file path.
 
     Returns:
         list[str]: A list of text chunks.
     """
-    doc = pymupdf.Document(stream=document_file, filetype="pdf")
-    document_text = ""
-    for page in doc:
-        document_text += page.get_text()
-    chunks = split_text(document_text)
+    chunks = list(iter_chunks(iter_pages(document_file)))
 
-    logger.debug(f"Lengths after chunking: {len(chunks)}")
+    logger.debug("Lengths after chunking: %d", len(chunks))
 
     return chunks
 
 
-def ingest_document(pdf_file: io.BytesIO, client: QdrantClient) -> DocumentMetadata:
+async def run_pipeline(*stages) -> None:
+    """
+    Run pipeline stages concurrently, cancelling the rest as soon as one fails.
+
+    Without this, a failing stage would leave its neighbours blocked forever on
+    a full or empty queue.
+    """
+    tasks = [asyncio.create_task(stage) for stage in stages]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            task.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def uses_shared_collection() -> bool:
+    return QDRANT_STORAGE_MODE == "shared"
+
+
+def collection_name_for(document_id: str) -> str:
+    """Return the name of the Qdrant collection holding a document's chunks."""
+    return QDRANT_COLLECTION if uses_shared_collection() else document_id
+
+
+def document_filter(document_id: str) -> models.Filter | None:
+    """Return the filter restricting a search to one document, if one is needed."""
+    if not uses_shared_collection():
+        return None
+    return models.Filter(
+        must=[
+            models.FieldCondition(
+                key="document_id", match=models.MatchValue(value=document_id)
+            )
+        ]
+    )
+
+
+def point_id(document_id: str, chunk_index: int) -> str:
+    """Return the id of a chunk's point, the same every time the chunk is ingested."""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{document_id}/{chunk_index}"))
+
+
+async def delete_document(client: AsyncQdrantClient, document_id: str) -> None:
+    """Delete a document's chunks: its collection, or its points in the shared collection."""
+    if local_index is not None:
+        await asyncio.to_thread(local_index.remove, document_id)
+    if not uses_shared_collection():
+        await client.delete_collection(document_id)
+        _vector_sizes.pop(document_id, None)
+        return
+    if await client.collection_exists(QDRANT_COLLECTION):
+        await client.delete(
+            collection_name=QDRANT_COLLECTION,
+            points_selector=models.FilterSelector(filter=document_filter(document_id)),
+        )
+
+
+async def document_exists(client: AsyncQdrantClient, document_id: str) -> bool:
+    """Check whether a document still has chunks stored in Qdrant."""
+    if not uses_shared_collection():
+        return await client.collection_exists(document_id)
+    if not await client.collection_exists(QDRANT_COLLECTION):
+        return False
+    result = await client.count(
+        collection_name=QDRANT_COLLECTION,
+        count_filter=document_filter(document_id),
+        exact=False,
+    )
+    return result.count > 0
+
+
+_shared_collection_ready = False
+# Ingest jobs running at once must not both create the shared collection
+_shared_collection_lock = asyncio.Lock()
+
+
+async def ensure_shared_collection(client: AsyncQdrantClient) -> None:
+    """
+    Create the shared collection and its `document_id` tenant index if missing.
+
+    The collection is configured for multitenancy: the global HNSW graph is
+    disabled (`m=0`) and a graph is built per `document_id` instead (`payload_m`),
+    so filtered searches stay fast without one index per document. Vectors are
+    stored according to the storage profile.
+    """
+    global _shared_collection_ready
+    if _shared_collection_ready:
+        return
+    async with _shared_collection_lock:
+        if _shared_collection_ready:
+            return
+        if not await client.collection_exists(QDRANT_COLLECTION):
+            await create_shared_collection(client)
+        _shared_collection_ready = True
+
+
+async def create_shared_collection(client: AsyncQdrantClient) -> None:
+    config = get_storage_profile().collection_config(
+        get_embedder().dimension, shared=True
+    )
+    try:
+        await client.create_collection(
+            collection_name=QDRANT_COLLECTION,
+            shard_number=QDRANT_SHARD_NUMBER,
+            **config,
+        )
+    except Exception:
+        # Another replica may have created it since it was checked
+        if not await client.collection_exists(QDRANT_COLLECTION):
+            raise
+        logger.info("Shared collection %s was created meanwhile", QDRANT_COLLECTION)
+        return
+    _vector_sizes[QDRANT_COLLECTION] = config["vectors_config"].size
+    await client.create_payload_index(
+        collection_name=QDRANT_COLLECTION,
+        field_name="document_id",
+        field_schema=models.KeywordIndexParams(
+            type=models.KeywordIndexType.KEYWORD, is_tenant=True
+        ),
+    )
+    logger.info("Created shared collection %s", QDRANT_COLLECTION)
+
+
+@dataclass
+class IngestProgress:
+    """Counters updated by `ingest_document` while the pipeline runs."""
+
+    pages_processed: int = 0
+    chunks_processed: int = 0
+
+
+async def ingest_document(
+    pdf_file: io.BytesIO | UploadedDocument,
+    client: AsyncQdrantClient,
+    document_id: str | None = None,
+    progress: IngestProgress | None = None,
+) -> DocumentMetadata:
     """
     Ingest a PDF document into Qdrant by creating a collection, splitting the document,
-    embedding the text chunks, and upserting them into the collection.
+    embedding the text chunks, and upserting them into the collection. In the
+    "shared" storage mode the chunks go into the shared collection instead, tagged
+    with the document id. The collection is configured by the storage profile and
+    embeddings are truncated to its vector size.
+
+    If ingestion fails, the chunks already stored are deleted before the error is
+    re-raised. Point ids are derived from the document id and chunk index, so
+    ingesting the same document id again overwrites rather than duplicates.
+
+    The stages are overlapped: pages stream into the splitter, chunks stream into
+    embedding batches, and embedded batches are upserted in bounded groups while
+    later pages are still being extracted. Bounded queues between the stages keep
+    peak memory proportional to `INGEST_QUEUE_DEPTH` rather than document size.
 
     Args:
-        pdf_file (io.BytesIO): The PDF document as a byte stream.
+        pdf_file (io.BytesIO | UploadedDocument): The PDF document as a byte stream
+            or an upload spooled to disk, which is opened from its path.
+        client (AsyncQdrantClient): An instance of the Qdrant client.
+        document_id (str | None): The id to store the document under, generated if omitted.
+        progress (IngestProgress | None): Counters to update as pages and chunks are processed.
 
     Returns:
         DocumentMetadata: Metadata of the ingested document.
     """
-    collection_id = str(uuid.uuid4())
+    document_id = document_id or str(uuid.uuid4())
+    collection_name = collection_name_for(document_id)
+    progress = progress or IngestProgress()
+
+    if uses_shared_collection():
+        await ensure_shared_collection(client)
+    else:
+        config = get_storage_profile().collection_config(
+            get_embedder().dimension, shared=False
+        )
+        await client.create_collection(collection_name=collection_name, **config)
+        _vector_sizes[collection_name] = config["vectors_config"].size
+    vector_size = await collection_vector_size(client, collection_name)
 
-    client.create_collection(
-        collection_name=collection_id,
-        vectors_config=VectorParams(size=EMBEDDING_DIMENSION, distance=Distance.DOT),
+    chunk_batches: asyncio.Queue[list[tuple[int, str]] | None] = asyncio.Queue(
+        maxsize=INGEST_QUEUE_DEPTH
+    )
+    embedded_batches: asyncio.Queue[tuple[list[tuple[int, str]], list] | None] = (
+        asyncio.Queue(maxsize=INGEST_QUEUE_DEPTH)
     )
 
-    chunks = load_and_split_document(document_file=pdf_file)
-    vectors = embed_texts(texts=chunks)
+    def counted_pages(pages: Iterable[str]) -> Iterator[str]:
+        for page in pages:
+            progress.pages_processed += 1
+            yield page
+
+    async def extract_and_split():
+        source = pdf_file.path if isinstance(pdf_file, UploadedDocument) else pdf_file
+        pages = metrics.TimedIterator(
+            counted_pages(iter_pages(source)), "pdf_extraction"
+        )
+        chunks = iter_chunk_spans(pages)
+
+        def next_batch() -> list[tuple[int, str]]:
+            started, extracting = time.perf_counter(), pages.seconds
+            batch = list(itertools.islice(chunks, INGEST_CHUNK_BATCH_SIZE))
+            # Pulling chunks also extracts the pages they come from
+            metrics.stage_seconds.observe(
+                time.perf_counter() - started - (pages.seconds - extracting),
+                stage="splitting",
+            )
+            return batch
+
+        # PDF parsing is CPU-bound, so run it in a worker thread to keep the loop free
+        while batch := await asyncio.to_thread(next_batch):
+            await chunk_batches.put(batch)
+        await chunk_batches.put(None)
 
+    async def embed():
+        while (batch := await chunk_batches.get()) is not None:
+            vectors = await embed_texts(texts=[text for _, text in batch])
+            vectors = [fit_vector(vector, vector_size) for vector in vectors]
+            await embedded_batches.put((batch, vectors))
+        await embedded_batches.put(None)
+
+    # Small documents are also written to the in-process index
+    indexed: tuple[list, list] | None = ([], []) if local_index is not None else None
+
+    async def upsert():
+        nonlocal indexed
+        payloads, vectors = [], []
+        chunk_index = 0
+        while (item := await embedded_batches.get()) is not None:
+            batch_payloads = []
+            for start, text in item[0]:
+                # The position in the document lets retrieval stitch
+                # neighbouring chunks back together
+                batch_payloads.append(
+                    {
+                        "text": text,
+                        "document_id": document_id,
+                        "chunk_index": chunk_index,
+                        "start": start,
+                    }
+                )
+                chunk_index += 1
+            payloads.extend(batch_payloads)
+            vectors.extend(item[1])
+            if indexed is not None:
+                indexed[0].extend(batch_payloads)
+                indexed[1].extend(item[1])
+                if not local_index.accepts(len(indexed[0])):
+                    indexed = None
+            while len(payloads) >= INGEST_UPSERT_BATCH_SIZE:
+                await upsert_points(
+                    client,
+                    collection_name,
+                    payloads[:INGEST_UPSERT_BATCH_SIZE],
+                    vectors[:INGEST_UPSERT_BATCH_SIZE],
+                )
+                progress.chunks_processed += INGEST_UPSERT_BATCH_SIZE
+                payloads = payloads[INGEST_UPSERT_BATCH_SIZE:]
+                vectors = vectors[INGEST_UPSERT_BATCH_SIZE:]
+        if payloads:
+            await upsert_points(client, collection_name, payloads, vectors)
+            progress.chunks_processed += len(payloads)
+
+    try:
+        await run_pipeline(extract_and_split(), embed(), upsert())
+    except BaseException:
+        # Don't leave a partial document behind to be searched
+        try:
+            await asyncio.shield(delete_document(client, document_id))
+        except Exception:
+            logger.exception("Failed to clean up document %s", document_id)
+        raise
+    if indexed is not None:
+        index_payloads, index_vectors = indexed
+        await asyncio.to_thread(
+            local_index.add, document_id, index_vectors, index_payloads
+        )
+
+    logger.info(
+        "Generated %d chunks and upserted into vectordb", progress.chunks_processed
+    )
+    return DocumentMetadata(id=document_id, file_name=pdf_file.name)
+
+
+@metrics.instrument("upsert")
+async def upsert_points(
+    client: AsyncQdrantClient,
+    collection_name: str,
+    payloads: list[dict],
+    vectors: list[list[float]],
+) -> None:
     try:
-        client.upsert(
-            collection_name=collection_id,
+        await client.upsert(
+            collection_name=collection_name,
             points=models.Batch(
-                ids=[str(uuid.uuid4()) for _ in range(len(chunks))],
-                payloads=[{"text": chunk} for chunk in chunks],
+                ids=[
+                    point_id(payload["document_id"], payload["chunk_index"])
+                    for payload in payloads
+                ],
+                payloads=payloads,
                 vectors=vectors,
             ),
         )
-        logger.info(f"Generated {len(chunks)} chunks and upserted into vectordb")
-        return DocumentMetadata(id=collection_id, file_name=pdf_file.name)
     except Exception as e:
         # Need proper error handling and logging here
-        logger.exception(f"failed to upsert: {e}")
+        if isinstance(e, ResponseHandlingException):
+            qdrant_connection.mark_unhealthy()
+        logger.exception("failed to upsert")
         raise
 
 
-@log_execution_time(logger=logger)
-def retrieve_relevant_context(
-    topic: str, document_id: str, client: QdrantClient
+_warming: set[str] = set()
+_background_tasks: set[asyncio.Task] = set()
+
+
+async def warm_local_index(client: AsyncQdrantClient, document_id: str) -> None:
+    """Copy a document's vectors from Qdrant into the local index, if it is small enough."""
+    collection_name = collection_name_for(document_id)
+    query_filter = document_filter(document_id)
+    count = (
+        await client.count(collection_name, count_filter=query_filter, exact=True)
+    ).count
+    if not local_index.accepts(count):
+        local_index.mark_unindexable(document_id)
+        return
+
+    vectors, payloads = [], []
+    offset = None
+    while True:
+        points, offset = await client.scroll(
+            collection_name=collection_name,
+            scroll_filter=query_filter,
+            limit=256,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        for point in points:
+            vectors.append(point.vector)
+            payloads.append(point.payload)
+        if offset is None:
+            break
+    await asyncio.to_thread(local_index.add, document_id, vectors, payloads)
+
+
+def schedule_local_index_warmup(client: AsyncQdrantClient, document_id: str) -> None:
+    if document_id in _warming:
+        return
+    _warming.add(document_id)
+
+    async def warm():
+        try:
+            await warm_local_index(client, document_id)
+        except Exception as e:
+            logger.warning("Failed to index document %s locally: %s", document_id, e)
+        finally:
+            _warming.discard(document_id)
+
+    task = asyncio.create_task(warm())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+@metrics.instrument("local_index_search")
+async def search_local_index(
+    client: AsyncQdrantClient, document_id: str, query: list[float], limit: int = 10
+) -> list[dict] | None:
+    """
+    Search a document in the local index.
+
+    Returns None if the document isn't indexed locally, in which case it is
+    fetched from Qdrant in the background (unless it is too large) so later
+    searches can use it.
+    """
+    if local_index.is_unindexable(document_id):
+        return None
+    document = local_index.get_open(document_id)
+    if document is None:
+        document = await asyncio.to_thread(local_index.get, document_id)
+    if document is None:
+        schedule_local_index_warmup(client, document_id)
+        return None
+    return document.search(fit_vector(query, document.vectors.shape[1]), limit)
+
+
+in_flight = SingleFlight()
+
+
+def merge_chunks(payloads: list[dict]) -> list[str]:
+    """
+    Stitch retrieved chunks that are neighbours in the document back into contiguous spans.
+
+    Consecutive chunks overlap by up to `CHUNK_OVERLAP` characters, so sending
+    them separately repeats text. Using the `chunk_index` and `start` offset
+    stored at ingestion, runs of consecutive chunks are joined with the overlap
+    removed. Each span takes the rank of its best chunk. Chunks ingested before
+    offsets were stored are returned as they are.
+
+    Args:
+        payloads (list[dict]): The payloads of the retrieved chunks, most relevant first.
+
+    Returns:
+        list[str]: The text of the spans, most relevant first.
+    """
+    positioned = sorted(
+        (payload["chunk_index"], rank)
+        for rank, payload in enumerate(payloads)
+        if "chunk_index" in payload and "start" in payload
+    )
+    # Rank of the best chunk in each span, and the span's text
+    spans: list[tuple[int, str]] = []
+    previous_index, text, end, best_rank = None, "", 0, 0
+    for chunk_index, rank in positioned:
+        payload = payloads[rank]
+        start, chunk = payload["start"], payload["text"]
+        if previous_index is not None and chunk_index == previous_index + 1:
+            if start < end:
+                text += chunk[end - start :]
+            else:
+                # Only whitespace was dropped between neighbouring chunks
+                text += " " + chunk
+            best_rank = min(best_rank, rank)
+        else:
+            if previous_index is not None:
+                spans.append((best_rank, text))
+            text, best_rank, end = chunk, rank, 0
+        previous_index, end = chunk_index, max(end, start + len(chunk))
+    if previous_index is not None:
+        spans.append((best_rank, text))
+
+    merged = {rank for _, rank in positioned}
+    spans += [
+        (rank, payload["text"])
+        for rank, payload in enumerate(payloads)
+        if rank not in merged
+    ]
+    return [text for _, text in sorted(spans)]
+
+
+def get_cached_context(document_id: str, topic: str) -> list[str] | None:
+    if retrieval_cache is None:
+        return None
+    chunks = retrieval_cache.get((document_id, topic))
+    # Callers get their own list, so they can't modify the cached one
+    return None if chunks is None else list(chunks)
+
+
+def cache_context(document_id: str, topic: str, chunks: list[str]) -> list[str]:
+    if retrieval_cache is not None:
+        retrieval_cache.put((document_id, topic), tuple(chunks))
+    return chunks
+
+
+@metrics.instrument("retrieval", logger=logger)
+async def retrieve_relevant_context(
+    topic: str, document_id: str, client: AsyncQdrantClient
+) -> list[str]:
+    """
+    Return the text of the 10 chunks of a document most similar to a topic.
+
+    Small documents are searched exactly in the local index, if it is enabled.
+    Otherwise, with a quantized storage profile, Qdrant searches the quantized
+    vectors, oversamples candidates and rescores them with the original vectors.
+    Results are reused for `RETRIEVAL_CACHE_TTL` seconds, so several requests
+    about the same topic only search once.
+    """
+    cached = get_cached_context(document_id, topic)
+    if cached is not None:
+        logger.info("Reusing cached relevant chunks.")
+        return cached
+    # Concurrent requests for the same topic share one search
+    chunks = await in_flight.do(
+        (document_id, topic),
+        lambda: search_relevant_context(topic, document_id, client),
+    )
+    return list(chunks)
+
+
+async def search_relevant_context(
+    topic: str, document_id: str, client: AsyncQdrantClient
 ) -> list[str]:
     try:
-        query_embeddings = embed_query(query=topic)
-        search_result = client.query_points(
-            collection_name=document_id,
-            query=query_embeddings,
-            with_payload=True,
-            limit=10,
-        ).points
-        logger.debug(f"{search_result=}")
-        retrieved_chunks = [point.payload["text"] for point in search_result]
-        logger.info(f"Retrieved {len(retrieved_chunks)} relevant chunks.")
-        return retrieved_chunks
+        collection_name = collection_name_for(document_id)
+        query_embeddings = await embed_query(query=topic)
+        if local_index is not None:
+            payloads = await search_local_index(client, document_id, query_embeddings)
+            if payloads is not None:
+                logger.info("Retrieved %d chunks from the local index.", len(payloads))
+                return cache_context(document_id, topic, merge_chunks(payloads))
+        query_embeddings = fit_vector(
+            query_embeddings, await collection_vector_size(client, collection_name)
+        )
+        search_kwargs = {}
+        if (search_params := get_storage_profile().search_params()) is not None:
+            search_kwargs["search_params"] = search_params
+        with metrics.track("vector_search"):
+            search_result = await admit(
+                qdrant_bulkhead,
+                client.query_points(
+                    collection_name=collection_name,
+                    query=query_embeddings,
+                    query_filter=document_filter(document_id),
+                    with_payload=True,
+                    limit=10,
+                    **search_kwargs,
+                ),
+            )
+        logger.debug("search_result=%s", search_result)
+        retrieved_chunks = merge_chunks(
+            [point.payload for point in search_result.points]
+        )
+        logger.info("Retrieved %d relevant chunks.", len(retrieved_chunks))
+        return cache_context(document_id, topic, retrieved_chunks)
+    except Exception as e:
+        if isinstance(e, ResponseHandlingException):
+            qdrant_connection.mark_unhealthy()
+        logger.exception("failed to retrieve relevant context")
+        raise
+
+
+@metrics.instrument("retrieval", logger=logger)
+async def retrieve_relevant_contexts(
+    topics: list[str], document_id: str, client: AsyncQdrantClient
+) -> list[list[str]]:
+    """
+    Batched `retrieve_relevant_context`: the chunks most similar to each of several topics.
+
+    Topics with cached results are not searched again. The others are embedded
+    in one call and searched in one Qdrant batch request (or in the local index,
+    for small documents).
+
+    Args:
+        topics (list[str]): The topics to search for.
+        document_id (str): The document to search in.
+        client (AsyncQdrantClient): An instance of the Qdrant client.
+
+    Returns:
+        list[list[str]]: The text of the 10 most similar chunks, per topic.
+    """
+    contexts = {topic: get_cached_context(document_id, topic) for topic in topics}
+    missing = [topic for topic, chunks in contexts.items() if chunks is None]
+    if missing:
+        found = await search_relevant_contexts(missing, document_id, client)
+        for topic, chunks in zip(missing, found):
+            contexts[topic] = cache_context(document_id, topic, chunks)
+    return [list(contexts[topic]) for topic in topics]
+
+
+async def search_relevant_contexts(
+    topics: list[str], document_id: str, client: AsyncQdrantClient
+) -> list[list[str]]:
+    try:
+        collection_name = collection_name_for(document_id)
+        query_embeddings = await embed_queries(queries=topics)
+        if local_index is not None and query_embeddings:
+            found = []
+            for query in query_embeddings:
+                payloads = await search_local_index(client, document_id, query)
+                if payloads is None:
+                    break
+                found.append(merge_chunks(payloads))
+            else:
+                return found
+
+        vector_size = await collection_vector_size(client, collection_name)
+        search_params = get_storage_profile().search_params()
+        with metrics.track("vector_search"):
+            responses = await admit(
+                qdrant_bulkhead,
+                client.query_batch_points(
+                    collection_name=collection_name,
+                    requests=[
+                        models.QueryRequest(
+                            query=fit_vector(query, vector_size),
+                            filter=document_filter(document_id),
+                            params=search_params,
+                            with_payload=True,
+                            limit=10,
+                        )
+                        for query in query_embeddings
+                    ],
+                ),
+            )
+        logger.info("Retrieved relevant chunks for %d topics.", len(topics))
+        return [
+            merge_chunks([point.payload for point in response.points])
+            for response in responses
+        ]
     except Exception as e:
-        logger.exception(f"failed to retrieve relecant context: {e}")
+        if isinstance(e, ResponseHandlingException):
+            qdrant_connection.mark_unhealthy()
+        logger.exception("failed to retrieve relevant contexts")
         raise
@@ -0,0 +1,21 @@
+import os
+
+import pytest
+
+# The chat client is created lazily, so these only need to be set, not valid
+os.environ.setdefault("CHAT_MODEL", "test-model")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    from src.caching import response_cache, retrieval_cache
+
+    for cache in (retrieval_cache, response_cache):
+        if cache is not None:
+            cache.clear()
@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from src.admission import (
+    Bulkhead,
+    DeadlineExceeded,
+    Overloaded,
+    admit,
+    request_deadline,
+    time_left,
+    within_deadline,
+)
+
+
+@pytest.mark.anyio
+async def test_bulkhead_queues_then_sheds():
+    bulkhead = Bulkhead("test", max_concurrency=1, max_queue=1)
+    release = asyncio.Event()
+    order = []
+
+    async def call(name):
+        async with bulkhead:
+            order.append(name)
+            await release.wait()
+
+    first = asyncio.create_task(call("first"))
+    second = asyncio.create_task(call("second"))
+    await asyncio.sleep(0)
+    assert (bulkhead.in_flight, bulkhead.queued) == (1, 1)
+
+    with pytest.raises(Overloaded):
+        await call("third")
+    assert bulkhead.shed == 1
+
+    release.set()
+    await asyncio.gather(first, second)
+    assert order == ["first", "second"]
+    assert (bulkhead.in_flight, bulkhead.queued) == (0, 0)
+
+
+@pytest.mark.anyio
+async def test_waiting_caller_gives_up_at_the_deadline():
+    bulkhead = Bulkhead("test", max_concurrency=1, max_queue=8)
+    release = asyncio.Event()
+
+    async def hold():
+        async with bulkhead:
+            await release.wait()
+
+    holder = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    with request_deadline(0.01), pytest.raises(DeadlineExceeded):
+        async with bulkhead:
+            pass
+    assert (bulkhead.timed_out, bulkhead.queued) == (1, 0)
+
+    release.set()
+    await holder
+    assert bulkhead.in_flight == 0
+
+
+@pytest.mark.anyio
+async def test_within_deadline():
+    assert time_left() is None
+    assert await within_deadline(asyncio.sleep(0, result="done")) == "done"
+    with request_deadline(0.01):
+        assert 0 < time_left() <= 0.01
+        with pytest.raises(DeadlineExceeded):
+            await within_deadline(asyncio.sleep(1))
+
+
+@pytest.mark.anyio
+async def test_admit_closes_rejected_calls():
+    bulkhead = Bulkhead("test", max_concurrency=0, max_queue=0)
+    call = asyncio.sleep(0)
+    with pytest.raises(Overloaded):
+        await admit(bulkhead, call)
+    assert call.cr_frame is None
@@ -0,0 +1,150 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+from src.admission import DeadlineExceeded, request_deadline, within_deadline
+from src.caching import SemanticCache, SingleFlight, TTLCache
+
+
+def test_entries_expire_after_ttl():
+    cache = TTLCache(ttl=10)
+    with patch("src.caching.time.monotonic", return_value=100.0):
+        cache.put("key", "value")
+        assert cache.get("key") == "value"
+    with patch("src.caching.time.monotonic", return_value=110.0):
+        assert cache.get("key") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = TTLCache(ttl=10, max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_semantic_cache_returns_most_similar_entry_in_namespace():
+    cache = SemanticCache(ttl=10, threshold=0.9)
+    cache.put(("doc", "summary"), "cnn", [1.0, 0.0, 0.0], "about CNNs")
+    cache.put(("doc", "summary"), "rnn", [0.0, 1.0, 0.0], "about RNNs")
+
+    assert cache.get(("doc", "summary"), [0.95, 0.1, 0.0]) == "about CNNs"
+    assert cache.get(("doc", "summary"), [0.7, 0.7, 0.0]) is None
+    assert cache.get(("other", "summary"), [1.0, 0.0, 0.0]) is None
+
+
+def test_semantic_cache_evicts_oldest_and_expired_entries():
+    cache = SemanticCache(ttl=10, threshold=0.9, max_entries=1)
+    with patch("src.caching.time.monotonic", return_value=100.0):
+        cache.put("doc", "a", [1.0, 0.0], "a")
+        cache.put("doc", "b", [0.0, 1.0], "b")
+        assert cache.get("doc", [1.0, 0.0]) is None
+        assert cache.get("doc", [0.0, 1.0]) == "b"
+    with patch("src.caching.time.monotonic", return_value=110.0):
+        assert cache.get("doc", [0.0, 1.0]) is None
+    assert len(cache) == 0
+
+
+@pytest.mark.anyio
+async def test_single_flight_shares_one_call():
+    flight = SingleFlight()
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return ["result"]
+
+    results = await asyncio.gather(*(flight.do("key", work) for _ in range(5)))
+
+    assert results == [["result"]] * 5
+    assert calls == 1
+    assert flight.shared == 4
+    assert len(flight) == 0
+    assert await flight.do("key", work) == ["result"]
+    assert calls == 2
+
+
+@pytest.mark.anyio
+async def test_single_flight_propagates_errors_to_all_callers():
+    flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    results = await asyncio.gather(
+        *(flight.do("key", work) for _ in range(3)), return_exceptions=True
+    )
+
+    assert [str(result) for result in results] == ["upstream failed"] * 3
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+@pytest.mark.anyio
+async def test_single_flight_callers_keep_their_own_deadlines():
+    flight = SingleFlight()
+
+    async def work():
+        await within_deadline(asyncio.sleep(0.3), "llm call")
+        return "done"
+
+    async def call(deadline: float):
+        with request_deadline(deadline):
+            return await flight.do("key", work)
+
+    leader = asyncio.create_task(call(0.1))
+    await asyncio.sleep(0)
+    follower = asyncio.create_task(call(30))
+
+    with pytest.raises(DeadlineExceeded):
+        await leader
+    assert await follower == "done"
+
+
+@pytest.mark.anyio
+async def test_single_flight_cancelling_one_caller_keeps_the_call():
+    flight = SingleFlight()
+    started = asyncio.Event()
+    finish = asyncio.Event()
+
+    async def work():
+        started.set()
+        await finish.wait()
+        return "done"
+
+    first = asyncio.create_task(flight.do("key", work))
+    second = asyncio.create_task(flight.do("key", work))
+    await started.wait()
+    first.cancel()
+    await asyncio.sleep(0)
+    finish.set()
+
+    assert await second == "done"
+    assert first.cancelled()
+
+
+@pytest.mark.anyio
+async def test_single_flight_cancels_the_call_without_callers():
+    flight = SingleFlight()
+    cancelled = asyncio.Event()
+
+    async def work():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    caller = asyncio.create_task(flight.do("key", work))
+    await asyncio.sleep(0)
+    caller.cancel()
+    await asyncio.wait_for(cancelled.wait(), timeout=1)
+    assert len(flight) == 0
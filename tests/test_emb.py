@@ -0,0 +1,70 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from src import emb
+from src.emb_cache import EmbeddingCache
+from src.embedders import FakeEmbedder
+
+
+@pytest.fixture(autouse=True)
+def mock_logger(monkeypatch):
+    monkeypatch.setattr("src.emb.logger", MagicMock())
+
+
+@pytest.fixture(autouse=True)
+def embedding_cache(monkeypatch):
+    cache = EmbeddingCache(path=":memory:")
+    monkeypatch.setattr("src.emb.cache", cache)
+    return cache
+
+
+@pytest.fixture
+def embedder(monkeypatch):
+    embedder = FakeEmbedder(dimension=8)
+    embedder.embed_passages = AsyncMock(side_effect=embedder.embed_passages)
+    embedder.embed_query = AsyncMock(side_effect=embedder.embed_query)
+    embedder.embed_queries = AsyncMock(side_effect=embedder.embed_queries)
+    monkeypatch.setattr("src.emb._embedder", embedder)
+    return embedder
+
+
+class TestEmbeddingCacheIntegration:
+    @pytest.mark.anyio
+    async def test_embed_texts_only_sends_misses(self, embedder, embedding_cache):
+        await emb.embed_texts(["text 1", "text 2"])
+        embeddings = await emb.embed_texts(["text 2", "text 3", "text 3"])
+
+        expected = await FakeEmbedder(dimension=8).embed_passages(["text 2", "text 3"])
+        for embedding, want in zip(embeddings, [expected[0], expected[1], expected[1]]):
+            assert embedding == pytest.approx(want)
+        assert embedder.embed_passages.call_args_list[-1].args == (["text 3"],)
+        assert embedding_cache.stats()["hits"] == 1
+
+    @pytest.mark.anyio
+    async def test_embed_texts_empty(self, embedder):
+        assert await emb.embed_texts([]) == []
+        embedder.embed_passages.assert_not_called()
+
+    @pytest.mark.anyio
+    async def test_embed_query_uses_cache(self, embedder):
+        first = await emb.embed_query("convolution")
+        assert await emb.embed_query("convolution") == first
+        embedder.embed_query.assert_called_once()
+
+    @pytest.mark.anyio
+    async def test_cache_is_keyed_by_backend(self, monkeypatch, embedder):
+        await emb.embed_texts(["text 1"])
+        other = FakeEmbedder(dimension=4)
+        monkeypatch.setattr("src.emb._embedder", other)
+
+        embeddings = await emb.embed_texts(["text 1"])
+        assert len(embeddings[0]) == 4
+
+    @pytest.mark.anyio
+    async def test_embed_queries_sends_misses_together(self, embedder):
+        single = await emb.embed_query("pooling")
+        embeddings = await emb.embed_queries(["pooling", "dropout", "attention"])
+
+        assert embeddings[0] == pytest.approx(single)
+        embedder.embed_queries.assert_awaited_once_with(["dropout", "attention"])
@@ -0,0 +1,59 @@
+import pytest
+
+from src.emb_cache import EmbeddingCache
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "cache" / "embeddings.sqlite3")
+
+
+class TestEmbeddingCache:
+    def test_key_depends_on_all_parameters(self):
+        key = EmbeddingCache.make_key("text", "model", "retrieval.passage", 1024, True)
+        assert key != EmbeddingCache.make_key(
+            "text", "model", "retrieval.query", 1024, True
+        )
+        assert key != EmbeddingCache.make_key(
+            "text", "model", "retrieval.passage", 512, True
+        )
+        assert key != EmbeddingCache.make_key(
+            "text", "model", "retrieval.passage", 1024, False
+        )
+
+    def test_round_trip_and_counters(self, cache_path):
+        cache = EmbeddingCache(path=cache_path)
+        cache.put_many({"a": [0.5, 0.25]})
+
+        assert cache.get_many(["a", "b"]) == {"a": [0.5, 0.25]}
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    def test_persists_across_instances(self, cache_path):
+        EmbeddingCache(path=cache_path).put_many({"a": [1.0]})
+        assert EmbeddingCache(path=cache_path).get_many(["a"]) == {"a": [1.0]}
+
+    def test_evicts_least_recently_used(self, cache_path):
+        cache = EmbeddingCache(path=cache_path, max_entries=2, memory_entries=0)
+        cache.put_many({"a": [1.0]})
+        cache.put_many({"b": [2.0]})
+        cache.put_many({"c": [3.0]})
+
+        assert cache.get_many(["a", "b", "c"]) == {"b": [2.0], "c": [3.0]}
+        assert cache.stats()["evictions"] == 1
+
+    def test_overwriting_a_key_does_not_evict(self, cache_path):
+        cache = EmbeddingCache(path=cache_path, max_entries=2, memory_entries=0)
+        cache.put_many({"a": [1.0], "b": [2.0]})
+        cache.put_many({"a": [3.0]})
+
+        assert cache.get_many(["a", "b"]) == {"a": [3.0], "b": [2.0]}
+        assert cache.stats()["evictions"] == 0
+
+    def test_counts_existing_rows_on_open(self, cache_path):
+        EmbeddingCache(path=cache_path).put_many({"a": [1.0], "b": [2.0]})
+        cache = EmbeddingCache(path=cache_path, max_entries=2, memory_entries=0)
+        cache.put_many({"c": [3.0]})
+
+        assert cache.get_many(["a", "b", "c"]) == {"b": [2.0], "c": [3.0]}
+        assert cache.stats()["evictions"] == 1
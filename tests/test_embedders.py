@@ -0,0 +1,157 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import httpx
+import pytest
+
+from src.embedders import (
+    FakeEmbedder,
+    JinaEmbedder,
+    LocalEmbedder,
+    create_embedder,
+    hashed_embedding,
+)
+
+
+@pytest.fixture(autouse=True)
+def mock_logger(monkeypatch):
+    monkeypatch.setattr("src.embedders.logger", MagicMock())
+
+
+class TestJinaEmbedder:
+    @pytest.fixture
+    def embedder(self, monkeypatch):
+        embedder = JinaEmbedder(batch_size=4, max_concurrency=8, max_retries=2)
+
+        async def fake_request_embeddings(
+            input, task="retrieval.passage", late_chunking=False
+        ):
+            return [[float(text.split()[-1])] for text in input]
+
+        embedder.request_embeddings = AsyncMock(side_effect=fake_request_embeddings)
+        monkeypatch.setattr("src.embedders.asyncio.sleep", AsyncMock())
+        return embedder
+
+    @pytest.mark.anyio
+    async def test_embed_passages_preserves_order(self, embedder):
+        texts = [f"text {i}" for i in range(50)]
+        embeddings = await embedder.embed_passages(texts)
+        assert embeddings == [[float(i)] for i in range(50)]
+        assert embedder.request_embeddings.call_count == 13
+
+    @pytest.mark.anyio
+    async def test_embed_passages_empty(self, embedder):
+        assert await embedder.embed_passages([]) == []
+        embedder.request_embeddings.assert_not_called()
+
+    @pytest.mark.anyio
+    async def test_embed_queries_uses_one_request(self, embedder):
+        embeddings = await embedder.embed_queries([f"topic {i}" for i in range(20)])
+        assert embeddings == [[float(i)] for i in range(20)]
+        embedder.request_embeddings.assert_awaited_once()
+        assert embedder.request_embeddings.await_args.kwargs["task"] == (
+            "retrieval.query"
+        )
+
+    @pytest.mark.anyio
+    async def test_batched_queries_match_single_queries(self, embedder):
+        async def fake_request_embeddings(
+            input, task="retrieval.passage", late_chunking=False
+        ):
+            texts = [input] if isinstance(input, str) else input
+            values = [float(text.split()[-1]) for text in texts]
+            # Late chunking makes each embedding depend on the whole request
+            context = sum(values) if late_chunking else 0.0
+            return [[value + context] for value in values]
+
+        embedder.request_embeddings.side_effect = fake_request_embeddings
+        batched = await embedder.embed_queries(["topic 1", "topic 2"])
+        single = [await embedder.embed_query(q) for q in ["topic 1", "topic 2"]]
+        assert batched == single
+
+    @pytest.mark.anyio
+    async def test_embed_batch_retries(self, embedder):
+        embedder.request_embeddings.side_effect = [httpx.ConnectError("boom"), [[1.0]]]
+        assert await embedder.embed_batch(["text 1"]) == [[1.0]]
+        assert embedder.request_embeddings.call_count == 2
+
+    @pytest.mark.anyio
+    async def test_embed_batch_gives_up(self, embedder):
+        embedder.request_embeddings.side_effect = httpx.ConnectError("boom")
+        with pytest.raises(httpx.ConnectError, match="boom"):
+            await embedder.embed_batch(["text 1"])
+        assert embedder.request_embeddings.call_count == 3
+
+
+class TestLocalEmbedder:
+    @pytest.fixture
+    def embedder(self, monkeypatch):
+        embedder = LocalEmbedder(
+            model_path="models/test", max_batch_size=4, max_wait_ms=50
+        )
+        encode = MagicMock(side_effect=lambda texts: [[float(len(t))] for t in texts])
+        monkeypatch.setattr(embedder, "encode", encode)
+        return embedder
+
+    @pytest.mark.anyio
+    async def test_coalesces_concurrent_requests(self, embedder):
+        results = await asyncio.gather(
+            embedder.embed_query("a"),
+            embedder.embed_query("bb"),
+            embedder.embed_passages(["ccc", "dddd", "eeeee"]),
+        )
+        await embedder.close()
+
+        assert results == [[1.0], [2.0], [[3.0], [4.0], [5.0]]]
+        assert [len(call.args[0]) for call in embedder.encode.call_args_list] == [
+            4,
+            1,
+        ]
+
+    @pytest.mark.anyio
+    async def test_propagates_errors(self, embedder):
+        embedder.encode.side_effect = RuntimeError("model failed")
+        with pytest.raises(RuntimeError, match="model failed"):
+            await embedder.embed_passages(["a", "b"])
+        await embedder.close()
+
+    @pytest.mark.anyio
+    async def test_warm_up_finds_the_dimension(self, embedder):
+        await embedder.warm_up()
+        embedder.encode.reset_mock()
+
+        assert embedder.dimension == 1
+        embedder.encode.assert_not_called()
+
+    def test_configured_dimension_needs_no_model(self):
+        embedder = LocalEmbedder(model_path="models/missing", dimension=384)
+        assert embedder.dimension == 384
+
+    def test_rejects_unknown_runtime(self):
+        with pytest.raises(ValueError):
+            LocalEmbedder(runtime="tensorflow")
+
+
+class TestFakeEmbedder:
+    @pytest.mark.anyio
+    async def test_is_deterministic_and_normalized(self):
+        embedder = FakeEmbedder(dimension=64)
+        first, second = await embedder.embed_passages(["adam optimizer", "rmsprop"])
+        assert first == hashed_embedding("adam optimizer", 64)
+        assert sum(x * x for x in second) == pytest.approx(1.0)
+
+    @pytest.mark.anyio
+    async def test_shared_words_score_higher(self):
+        embedder = FakeEmbedder(dimension=256)
+        query = await embedder.embed_query("adam optimizer learning rate")
+        related, unrelated = await embedder.embed_passages(
+            ["the adam optimizer adapts the learning rate", "a recipe for bread"]
+        )
+        dot = lambda a, b: sum(x * y for x, y in zip(a, b))
+        assert dot(query, related) > dot(query, unrelated)
+
+
+def test_create_embedder():
+    assert isinstance(create_embedder("fake"), FakeEmbedder)
+    assert isinstance(create_embedder("jina"), JinaEmbedder)
+    assert isinstance(create_embedder("src.embedders:FakeEmbedder"), FakeEmbedder)
@@ -0,0 +1,113 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from qdrant_client import AsyncQdrantClient, models
+
+from src.jobs import InProcessJobBackend, JobQueueFull
+from src.models import DocumentMetadata, JobState
+from src.vectorstore import document_exists
+
+
+@pytest.fixture
+def mock_upload():
+    upload = MagicMock()
+    upload.name = "test.pdf"
+    return upload
+
+
+@pytest.fixture
+def mock_run_ingest_job(monkeypatch):
+    async def fake_run_ingest_job(job):
+        job.progress.pages_processed = 3
+        job.progress.chunks_processed = 12
+
+    mock_func = AsyncMock(side_effect=fake_run_ingest_job)
+    monkeypatch.setattr("src.jobs.run_ingest_job", mock_func)
+    return mock_func
+
+
+@pytest.fixture(autouse=True)
+def mock_logger(monkeypatch):
+    monkeypatch.setattr("src.jobs.logger", MagicMock())
+
+
+@pytest.fixture(autouse=True)
+async def qdrant(monkeypatch):
+    client = AsyncQdrantClient(location=":memory:")
+    monkeypatch.setattr(
+        "src.jobs.qdrant_connection.get_client", AsyncMock(return_value=client)
+    )
+    yield client
+    await client.close()
+
+
+class TestInProcessJobBackend:
+    @pytest.mark.anyio
+    async def test_job_runs_to_completion(self, mock_upload, mock_run_ingest_job):
+        backend = InProcessJobBackend(workers=1, queue_size=4)
+        queued = await backend.submit(mock_upload)
+        assert queued.state == JobState.Queued
+
+        await backend._queue.join()
+        status = await backend.get_status(queued.job_id)
+        await backend.close()
+
+        assert status.state == JobState.Succeeded
+        assert status.document_id == queued.document_id
+        assert (status.pages_processed, status.chunks_processed) == (3, 12)
+        assert status.run_seconds is not None
+        mock_upload.close.assert_called_once()
+
+    @pytest.mark.anyio
+    async def test_job_failure_is_reported(self, mock_upload, mock_run_ingest_job):
+        mock_run_ingest_job.side_effect = Exception("Qdrant is down")
+        backend = InProcessJobBackend(workers=1, queue_size=4)
+        queued = await backend.submit(mock_upload)
+
+        await backend._queue.join()
+        status = await backend.get_status(queued.job_id)
+        await backend.close()
+
+        assert status.state == JobState.Failed
+        assert status.error == "Qdrant is down"
+        mock_upload.close.assert_called_once()
+
+    @pytest.mark.anyio
+    async def test_full_queue_applies_backpressure(self, mock_upload):
+        backend = InProcessJobBackend(workers=0, queue_size=1)
+        await backend.submit(mock_upload)
+        with pytest.raises(JobQueueFull):
+            await backend.submit(mock_upload)
+        await backend.close()
+
+    @pytest.mark.anyio
+    async def test_failed_job_leaves_nothing_searchable(
+        self, monkeypatch, mock_upload, qdrant
+    ):
+        async def fake_ingest_document(pdf_file, client, document_id, progress):
+            await client.create_collection(
+                collection_name=document_id,
+                vectors_config=models.VectorParams(
+                    size=2, distance=models.Distance.DOT
+                ),
+            )
+            await client.upsert(
+                collection_name=document_id,
+                points=[models.PointStruct(id=1, vector=[1.0, 0.0], payload={})],
+            )
+            return DocumentMetadata(id=document_id, file_name=pdf_file.name)
+
+        monkeypatch.setattr("src.jobs.ingest_document", fake_ingest_document)
+        monkeypatch.setattr(
+            "src.jobs.register_document",
+            AsyncMock(side_effect=Exception("registry is down")),
+        )
+        backend = InProcessJobBackend(workers=1, queue_size=4)
+        queued = await backend.submit(mock_upload)
+
+        await backend._queue.join()
+        status = await backend.get_status(queued.job_id)
+        await backend.close()
+
+        assert status.state == JobState.Failed
+        assert not await document_exists(qdrant, queued.document_id)
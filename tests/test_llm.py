@@ -0,0 +1,198 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from openai.types import CompletionUsage
+
+from src import llm, metrics
+from src.caching import ResponseCacheStats, SemanticCache
+from src.llm import (
+    prepare_context,
+    provide_questions,
+    stream_completion,
+    stream_summary,
+    summarize_topic,
+)
+
+
+class FakeStream:
+    """Stands in for the `AsyncStream` returned by a streaming completion."""
+
+    def __init__(self, contents: list[str | None]):
+        self.contents = contents
+        self.close = AsyncMock()
+
+    async def __aiter__(self):
+        for content in self.contents:
+            chunk = MagicMock()
+            chunk.choices[0].delta.content = content
+            chunk.usage = None
+            yield chunk
+
+
+@pytest.fixture
+def mock_create():
+    with patch.object(
+        llm.get_client().chat.completions, "create", new_callable=AsyncMock
+    ) as mock:
+        yield mock
+
+
+@pytest.mark.anyio
+async def test_stream_completion_yields_content(mock_create):
+    stream = FakeStream(["Convolution", None, " slides", " filters."])
+    mock_create.return_value = stream
+
+    texts = [text async for text in await stream_summary("convolution", ["chunk"])]
+
+    assert texts == ["Convolution", " slides", " filters."]
+    assert mock_create.call_args.kwargs["stream"] is True
+    stream.close.assert_awaited_once()
+
+
+@pytest.mark.anyio
+async def test_stream_completion_closed_early_closes_upstream(mock_create):
+    stream = FakeStream(["one", " two", " three"])
+    mock_create.return_value = stream
+
+    tokens = await stream_completion([{"role": "user", "content": "count"}])
+    assert await tokens.__anext__() == "one"
+    await tokens.aclose()
+
+    stream.close.assert_awaited_once()
+
+
+@pytest.mark.anyio
+async def test_stream_completion_holds_llm_slot_until_closed(mock_create):
+    mock_create.return_value = FakeStream(["one", " two"])
+    in_flight = llm.llm_bulkhead.in_flight
+
+    tokens = await stream_completion([{"role": "user", "content": "count"}])
+    assert llm.llm_bulkhead.in_flight == in_flight + 1
+    assert await tokens.__anext__() == "one"
+    await tokens.aclose()
+    await tokens.aclose()
+
+    assert llm.llm_bulkhead.in_flight == in_flight
+
+
+@pytest.mark.anyio
+async def test_stream_completion_never_iterated_releases_llm_slot(mock_create):
+    stream = FakeStream(["one"])
+    mock_create.return_value = stream
+    in_flight = llm.llm_bulkhead.in_flight
+
+    tokens = await stream_completion([{"role": "user", "content": "count"}])
+    await tokens.aclose()
+
+    assert llm.llm_bulkhead.in_flight == in_flight
+    stream.close.assert_awaited_once()
+
+
+def test_prepare_context_drops_near_duplicates():
+    chunk = "convolution slides a small filter over the input image " * 3
+    context = prepare_context([chunk, chunk + "again", "pooling"], max_tokens=1000)
+    assert context == f"{chunk}\npooling"
+
+
+def test_prepare_context_packs_most_relevant_chunks_in_budget():
+    chunks = ["a " * 100, "b " * 300, "c " * 100]
+    with patch("src.llm.count_tokens", side_effect=lambda text: len(text.split())):
+        context = prepare_context(chunks, max_tokens=250)
+    assert context == f"{chunks[0]}\n{chunks[2]}"
+
+
+def test_prepare_context_truncates_when_nothing_fits():
+    with patch("src.tokens.get_encoding", return_value=None):
+        context = prepare_context(["x" * 1000], max_tokens=10)
+    assert context == "x" * 40
+
+
+def completion(text: str, usage: CompletionUsage | None = None) -> MagicMock:
+    response = MagicMock()
+    response.choices[0].message.content = text
+    response.usage = usage
+    return response
+
+
+@pytest.mark.anyio
+async def test_generation_records_token_usage(mock_create):
+    mock_create.return_value = completion(
+        "A summary.",
+        CompletionUsage(prompt_tokens=120, completion_tokens=30, total_tokens=150),
+    )
+    prompt_tokens = metrics.llm_tokens.value(kind="prompt")
+    completions = metrics.stage_seconds.count(stage="llm_completion")
+
+    await summarize_topic("convolution", ["chunk"])
+
+    assert metrics.llm_tokens.value(kind="prompt") == prompt_tokens + 120
+    assert metrics.stage_seconds.count(stage="llm_completion") == completions + 1
+
+
+@pytest.mark.anyio
+async def test_identical_prompts_are_answered_from_cache(mock_create):
+    mock_create.return_value = completion("A summary.")
+    stats = ResponseCacheStats()
+
+    with patch("src.llm.response_cache_stats", stats):
+        first = await summarize_topic("convolution", ["chunk"])
+        second = await summarize_topic("convolution", ["chunk"])
+        other = await summarize_topic("convolution", ["another chunk"])
+
+    assert first == second == other == "A summary."
+    assert mock_create.await_count == 2
+    assert (stats.exact_hits, stats.misses) == (1, 2)
+    assert stats.hit_ratio == pytest.approx(1 / 3)
+
+
+@pytest.mark.anyio
+async def test_similar_topics_of_a_document_share_responses(mock_create):
+    mock_create.return_value = completion("About CNNs.")
+    embeddings = {"CNNs": [1.0, 0.0], "convolutional neural networks": [0.99, 0.1]}
+    embeddings["pooling"] = [0.0, 1.0]
+    stats = ResponseCacheStats()
+
+    with (
+        patch("src.llm.semantic_response_cache", SemanticCache(60, threshold=0.95)),
+        patch("src.llm.embed_query", AsyncMock(side_effect=embeddings.get)),
+        patch("src.llm.response_cache_stats", stats),
+    ):
+        await summarize_topic("CNNs", ["a"], document_id="doc")
+        reused = await summarize_topic(
+            "convolutional neural networks", ["b"], document_id="doc"
+        )
+        await summarize_topic("pooling", ["c"], document_id="doc")
+        await provide_questions("CNNs", "MCQ", ["a"], document_id="doc")
+
+    assert reused == "About CNNs."
+    assert mock_create.await_count == 3
+    assert stats.semantic_hits == 1
+
+
+@pytest.mark.anyio
+async def test_complete_streams_are_cached(mock_create):
+    mock_create.return_value = FakeStream(["Con", "volution."])
+
+    first = [text async for text in await stream_summary("convolution", ["chunk"])]
+    second = [text async for text in await stream_summary("convolution", ["chunk"])]
+
+    assert first == ["Con", "volution."]
+    assert second == ["Convolution."]
+    mock_create.assert_awaited_once()
+
+
+@pytest.mark.anyio
+async def test_concurrent_identical_generations_are_coalesced(mock_create):
+    async def slow_completion(**kwargs):
+        await asyncio.sleep(0.01)
+        return completion("A summary.")
+
+    mock_create.side_effect = slow_completion
+
+    summaries = await asyncio.gather(
+        *(summarize_topic("convolution", ["chunk"]) for _ in range(10))
+    )
+
+    assert summaries == ["A summary."] * 10
+    mock_create.assert_awaited_once()
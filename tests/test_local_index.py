@@ -0,0 +1,125 @@
+import asyncio
+import uuid
+
+import numpy as np
+import pytest
+from qdrant_client import AsyncQdrantClient, models
+
+from src import vectorstore
+from src.local_index import IndexedDocument, LocalIndex
+from src.vectorstore import search_local_index
+
+
+@pytest.fixture
+def vectors():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(300, 32)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.fixture
+def queries():
+    return np.random.default_rng(1).normal(size=(20, 32)).astype(np.float32)
+
+
+@pytest.fixture
+async def qdrant(vectors):
+    client = AsyncQdrantClient(location=":memory:")
+    document_id = str(uuid.uuid4())
+    await client.create_collection(
+        collection_name=document_id,
+        vectors_config=models.VectorParams(size=32, distance=models.Distance.DOT),
+    )
+    await client.upsert(
+        collection_name=document_id,
+        points=models.Batch(
+            ids=list(range(len(vectors))),
+            payloads=[{"text": str(i)} for i in range(len(vectors))],
+            vectors=vectors.tolist(),
+        ),
+    )
+    yield client, document_id
+    await client.close()
+
+
+@pytest.fixture
+def index(monkeypatch, tmp_path):
+    index = LocalIndex(str(tmp_path), max_chunks=1000, max_documents=2)
+    monkeypatch.setattr("src.vectorstore.local_index", index)
+    return index
+
+
+class TestIndexedDocument:
+    @pytest.mark.anyio
+    async def test_matches_qdrant_top_10(self, qdrant, vectors, queries):
+        client, document_id = qdrant
+        document = IndexedDocument(
+            vectors=vectors, payloads=[{"text": str(i)} for i in range(len(vectors))]
+        )
+        for query in queries.tolist():
+            expected = (
+                await client.query_points(document_id, query=query, limit=10)
+            ).points
+            found = document.search(query, limit=10)
+            assert [p["text"] for p in found] == [str(p.id) for p in expected]
+
+    def test_limit_larger_than_document(self):
+        document = IndexedDocument(
+            vectors=np.array([[0.0, 1.0], [1.0, 0.0]], dtype=np.float32),
+            payloads=[{"text": "a"}, {"text": "b"}],
+        )
+        assert document.search([1.0, 0.0], limit=10) == [{"text": "b"}, {"text": "a"}]
+
+
+class TestLocalIndex:
+    def test_round_trip_and_lru(self, index, vectors):
+        ids = [str(uuid.uuid4()) for _ in range(3)]
+        for document_id in ids:
+            assert index.add(document_id, vectors[:5].tolist(), [{"text": "x"}] * 5)
+
+        document = index.get(ids[0])
+        assert isinstance(document.vectors, np.memmap)
+        np.testing.assert_array_equal(document.vectors, vectors[:5])
+        index.get(ids[1])
+        index.get(ids[2])
+        assert index.get_open(ids[0]) is None
+        assert index.get_open(ids[2]) is not None
+
+    def test_remove_deletes_the_document(self, index, vectors):
+        document_id = str(uuid.uuid4())
+        index.add(document_id, vectors[:5].tolist(), [{"text": "x"}] * 5)
+        index.get(document_id)
+
+        index.remove(document_id)
+        index.remove(document_id)
+        assert index.get(document_id) is None
+
+    def test_rejects_large_documents_and_bad_ids(self, index, vectors):
+        assert not index.add(str(uuid.uuid4()), vectors.tolist() * 4, [{}] * 1200)
+        assert not index.add("../escape", vectors[:1].tolist(), [{}])
+        assert index.get("../escape") is None
+
+
+class TestSearchLocalIndex:
+    @pytest.mark.anyio
+    async def test_warms_up_from_qdrant(self, index, qdrant, queries):
+        client, document_id = qdrant
+        query = queries[0].tolist()
+
+        assert await search_local_index(client, document_id, query) is None
+        await asyncio.gather(*vectorstore._background_tasks)
+
+        found = await search_local_index(client, document_id, query)
+        expected = (
+            await client.query_points(document_id, query=query, limit=10)
+        ).points
+        assert [p["text"] for p in found] == [str(p.id) for p in expected]
+
+    @pytest.mark.anyio
+    async def test_skips_large_documents(self, index, qdrant, queries):
+        client, document_id = qdrant
+        index.max_chunks = 10
+
+        assert await search_local_index(client, document_id, queries[0]) is None
+        await asyncio.gather(*vectorstore._background_tasks)
+        assert index.is_unindexable(document_id)
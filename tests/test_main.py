@@ -1,11 +1,27 @@
-from unittest.mock import MagicMock, patch
+import asyncio
+import json
+import os
+import subprocess
+import sys
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 from fastapi.testclient import TestClient
-from qdrant_client import QdrantClient
+from qdrant_client import AsyncQdrantClient
 
 from src import models
-from src.main import app
+from src.admission import (
+    REQUEST_DEADLINE,
+    Bulkhead,
+    DeadlineExceeded,
+    Overloaded,
+    time_left,
+    within_deadline,
+)
+from src.emb_cache import EmbeddingCache
+from src.jobs import JobQueueFull
+from src.main import app, sse_event, stream_events
+from src.vectorstore import get_qdrant_client, qdrant_connection
 
 from . import PDF_FILE_PATH, CHUNKED_PDF_FILE_PATH, DOCUMENT_ID
 
@@ -14,12 +30,24 @@ client = TestClient(app)
 
 @pytest.fixture
 def mock_qdrant_client():
-    return MagicMock(spec=QdrantClient)
+    return MagicMock(spec=AsyncQdrantClient)
+
+
+@pytest.fixture(autouse=True)
+def memory_qdrant_client():
+    # Neither requests nor the lifespan may reach a real Qdrant server
+    qdrant = AsyncQdrantClient(location=":memory:")
+    app.dependency_overrides[get_qdrant_client] = lambda: qdrant
+    with patch.object(qdrant_connection, "_create_client", return_value=qdrant):
+        yield qdrant
+    app.dependency_overrides.pop(get_qdrant_client)
 
 
 @pytest.fixture
 def mock_process_uploaded_file():
     with patch("src.main.process_uploaded_file") as mock:
+        # The upload is closed synchronously
+        mock.return_value = MagicMock()
         yield mock
 
 
@@ -47,6 +75,30 @@ def mock_summarize_topic():
         yield mock
 
 
+@pytest.fixture
+def mock_retrieve_relevant_contexts():
+    with patch("src.main.retrieve_relevant_contexts") as mock:
+        yield mock
+
+
+@pytest.fixture
+def mock_job_backend():
+    with patch("src.main.job_backend") as mock:
+        yield mock
+
+
+@pytest.fixture(autouse=True)
+def mock_find_duplicate():
+    with patch("src.main.find_duplicate", return_value=None) as mock:
+        yield mock
+
+
+@pytest.fixture(autouse=True)
+def mock_register_document():
+    with patch("src.main.register_document") as mock:
+        yield mock
+
+
 def test_root():
     response = client.get("/")
     assert response.status_code == 200
@@ -59,7 +111,7 @@ def test_ingest_pdf_success(
     mock_validate_pdf_file,
     mock_ingest_document,
 ):
-    mock_process_uploaded_file.return_value = "processed_pdf"
+    mock_process_uploaded_file.return_value = MagicMock()
     mock_ingest_document.return_value = models.DocumentMetadata(
         id="123", file_name="test.pdf"
     )
@@ -71,13 +123,53 @@ def test_ingest_pdf_success(
     assert response.json() == {"id": "123", "file_name": "test.pdf"}
 
 
+def test_ingest_pdf_returns_duplicate(
+    mock_process_uploaded_file,
+    mock_validate_pdf_file,
+    mock_ingest_document,
+    mock_find_duplicate,
+):
+    mock_find_duplicate.return_value = models.DocumentMetadata(
+        id="existing", file_name="lecture.pdf"
+    )
+
+    with open(PDF_FILE_PATH, "rb") as f:
+        response = client.post("/ingest", files={"file": f})
+
+    assert response.status_code == 200
+    assert response.json() == {"id": "existing", "file_name": "lecture.pdf"}
+    mock_ingest_document.assert_not_called()
+    mock_process_uploaded_file.return_value.close.assert_called_once()
+
+
+def test_ingest_pdf_force_skips_deduplication(
+    mock_process_uploaded_file,
+    mock_validate_pdf_file,
+    mock_ingest_document,
+    mock_find_duplicate,
+    mock_register_document,
+):
+    metadata = models.DocumentMetadata(id="new", file_name="lecture.pdf")
+    mock_ingest_document.return_value = metadata
+
+    with open(PDF_FILE_PATH, "rb") as f:
+        response = client.post("/ingest?force=true", files={"file": f})
+
+    assert response.status_code == 200
+    assert response.json()["id"] == "new"
+    mock_find_duplicate.assert_not_called()
+    mock_register_document.assert_called_once_with(
+        mock_process_uploaded_file.return_value, metadata
+    )
+
+
 def test_ingest_pdf_failure(
     mock_qdrant_client,
     mock_process_uploaded_file,
     mock_validate_pdf_file,
     mock_ingest_document,
 ):
-    mock_process_uploaded_file.return_value = "processed_pdf"
+    mock_process_uploaded_file.return_value = MagicMock()
     mock_ingest_document.side_effect = Exception("Failed to ingest document")
 
     with open("test.pdf", "wb") as f:
@@ -122,3 +214,448 @@ def test_generate_summary_failure(
 
     assert response.status_code == 500
     assert "Error generating summary:" in response.json()["detail"]
+
+
+def test_ingest_pdf_rejects_oversized_upload(monkeypatch, mock_ingest_document):
+    monkeypatch.setattr("src.main.UPLOAD_MAX_BYTES", 0)
+    response = client.post(
+        "/ingest", files={"file": ("big.pdf", b"x" * 128 * 1024, "application/pdf")}
+    )
+
+    assert response.status_code == 413
+    mock_ingest_document.assert_not_called()
+
+
+def test_ingest_pdf_background(
+    mock_process_uploaded_file, mock_ingest_document, mock_job_backend
+):
+    mock_job_backend.submit = AsyncMock(
+        return_value=models.JobStatus(
+            job_id="job-1",
+            document_id="doc-1",
+            file_name="test.pdf",
+            state=models.JobState.Queued,
+            queued_at=0.0,
+        )
+    )
+
+    with open(PDF_FILE_PATH, "rb") as f:
+        response = client.post("/ingest?background=true", files={"file": f})
+
+    assert response.status_code == 202
+    assert response.json() == {
+        "job_id": "job-1",
+        "document_id": "doc-1",
+        "state": "queued",
+    }
+    mock_ingest_document.assert_not_called()
+    mock_process_uploaded_file.return_value.close.assert_not_called()
+
+
+def test_ingest_pdf_background_queue_full(mock_process_uploaded_file, mock_job_backend):
+    mock_job_backend.submit = AsyncMock(side_effect=JobQueueFull("queue is full"))
+
+    with open(PDF_FILE_PATH, "rb") as f:
+        response = client.post("/ingest?background=true", files={"file": f})
+
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
+    mock_process_uploaded_file.return_value.close.assert_called_once()
+
+
+def test_get_job_status_not_found(mock_job_backend):
+    mock_job_backend.get_status = AsyncMock(return_value=None)
+    response = client.get("/jobs/unknown")
+    assert response.status_code == 404
+
+
+def test_generate_summaries_streams_each_topic(
+    mock_retrieve_relevant_contexts, mock_summarize_topic
+):
+    mock_retrieve_relevant_contexts.return_value = [["chunk a"], ["chunk b"], []]
+
+    async def fake_summarize_topic(topic, relevant_chunks, document_id):
+        if not relevant_chunks:
+            raise RuntimeError("no context")
+        return f"summary of {topic}"
+
+    mock_summarize_topic.side_effect = fake_summarize_topic
+
+    response = client.post(
+        "/generate/summary/batch",
+        json={"topics": ["a", "b", "c"], "document_id": DOCUMENT_ID},
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    items = sorted(
+        (json.loads(line) for line in response.text.splitlines()),
+        key=lambda item: item["topic"],
+    )
+    assert items == [
+        {"topic": "a", "summary": "summary of a"},
+        {"topic": "b", "summary": "summary of b"},
+        {"topic": "c", "error": "no context"},
+    ]
+    mock_retrieve_relevant_contexts.assert_awaited_once()
+
+
+def test_generate_summaries_gives_each_topic_its_own_deadline(
+    mock_retrieve_relevant_contexts, mock_summarize_topic
+):
+    mock_retrieve_relevant_contexts.return_value = [["chunk"]] * 3
+
+    async def fake_summarize_topic(topic, relevant_chunks, document_id):
+        await within_deadline(asyncio.sleep(0.2), "llm call")
+        return f"summary of {topic}"
+
+    mock_summarize_topic.side_effect = fake_summarize_topic
+
+    # One topic at a time, so the batch takes twice the deadline
+    with (
+        patch("src.main.REQUEST_DEADLINE", 0.3),
+        patch("src.main.BATCH_MAX_CONCURRENCY", 1),
+    ):
+        response = client.post(
+            "/generate/summary/batch",
+            json={"topics": ["a", "b", "c"], "document_id": DOCUMENT_ID},
+        )
+
+    items = [json.loads(line) for line in response.text.splitlines()]
+    assert all("error" not in item for item in items)
+    assert len(items) == 3
+
+
+def test_generate_summaries_retrieval_failure(mock_retrieve_relevant_contexts):
+    mock_retrieve_relevant_contexts.side_effect = Exception("qdrant is down")
+    response = client.post(
+        "/generate/summary/batch", json={"topics": ["a"], "document_id": DOCUMENT_ID}
+    )
+    assert response.status_code == 500
+
+
+def test_generate_summaries_requires_topics():
+    response = client.post(
+        "/generate/summary/batch", json={"topics": [], "document_id": DOCUMENT_ID}
+    )
+    assert response.status_code == 422
+
+
+def parse_sse(text: str) -> list[tuple[str, dict]]:
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_stream_summary_sends_tokens_and_timings(mock_retrieve_relevant_context):
+    mock_retrieve_relevant_context.return_value = ["chunk"]
+
+    async def fake_stream_summary(topic, relevant_chunks):
+        yield "Convolution"
+        yield " slides filters."
+
+    with patch("src.main.stream_summary", side_effect=fake_stream_summary):
+        response = client.post(
+            "/generate/summary/stream",
+            json={"topic": "convolution", "document_id": DOCUMENT_ID},
+        )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = parse_sse(response.text)
+    assert events[:2] == [
+        ("token", {"text": "Convolution"}),
+        ("token", {"text": " slides filters."}),
+    ]
+    event, done = events[2]
+    assert event == "done"
+    assert done["chunks"] == 2
+    assert 0 <= done["ttft_seconds"] <= done["total_seconds"]
+
+
+def test_stream_questions_reports_generation_error(mock_retrieve_relevant_context):
+    mock_retrieve_relevant_context.return_value = ["chunk"]
+
+    async def fake_stream_questions(topic, type, relevant_chunks):
+        yield "- What"
+        raise RuntimeError("upstream failed")
+
+    with patch("src.main.stream_questions", side_effect=fake_stream_questions):
+        response = client.post(
+            "/generate/questions/stream",
+            json={
+                "topic": "convolution",
+                "document_id": DOCUMENT_ID,
+                "questions_type": "MCQ",
+            },
+        )
+
+    assert parse_sse(response.text) == [
+        ("token", {"text": "- What"}),
+        ("error", {"detail": "upstream failed"}),
+    ]
+
+
+def test_stream_summary_retrieval_failure(mock_retrieve_relevant_context):
+    mock_retrieve_relevant_context.side_effect = Exception("qdrant is down")
+    response = client.post(
+        "/generate/summary/stream",
+        json={"topic": "convolution", "document_id": DOCUMENT_ID},
+    )
+    assert response.status_code == 500
+
+
+@pytest.mark.anyio
+async def test_stream_events_client_disconnect_cancels_generation():
+    closed = False
+
+    async def tokens():
+        nonlocal closed
+        try:
+            for word in ["one", " two", " three"]:
+                yield word
+        finally:
+            closed = True
+
+    request = MagicMock()
+    request.is_disconnected = AsyncMock(return_value=True)
+
+    events = [event async for event in stream_events(request, tokens(), 0.0)]
+
+    assert events == [sse_event("token", {"text": "one"})]
+    assert closed
+
+
+def test_generate_study_pack_retrieves_once(
+    mock_retrieve_relevant_context, mock_summarize_topic
+):
+    mock_retrieve_relevant_context.return_value = ["chunk"]
+    mock_summarize_topic.return_value = "summary"
+
+    async def fake_provide_questions(topic, type, relevant_chunks, document_id):
+        return f"{type} questions from {relevant_chunks}"
+
+    with patch("src.main.provide_questions", side_effect=fake_provide_questions):
+        response = client.post(
+            "/generate/study-pack",
+            json={"topic": "convolution", "document_id": DOCUMENT_ID},
+        )
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "topic": "convolution",
+        "summary": "summary",
+        "questions": {
+            "MCQ": "MCQ questions from ['chunk']",
+            "fill-in-the-blank": "fill-in-the-blank questions from ['chunk']",
+        },
+    }
+    mock_retrieve_relevant_context.assert_awaited_once()
+
+
+def test_generate_study_pack_without_summary(
+    mock_retrieve_relevant_context, mock_summarize_topic
+):
+    mock_retrieve_relevant_context.return_value = ["chunk"]
+
+    with patch("src.main.provide_questions", return_value="questions") as mock:
+        response = client.post(
+            "/generate/study-pack",
+            json={
+                "topic": "convolution",
+                "document_id": DOCUMENT_ID,
+                "include_summary": False,
+                "questions_types": ["MCQ", "MCQ"],
+            },
+        )
+
+    assert response.json() == {
+        "topic": "convolution",
+        "summary": None,
+        "questions": {"MCQ": "questions"},
+    }
+    mock.assert_awaited_once()
+    mock_summarize_topic.assert_not_called()
+
+
+def test_generate_study_pack_failure(
+    mock_retrieve_relevant_context, mock_summarize_topic
+):
+    mock_retrieve_relevant_context.return_value = ["chunk"]
+    mock_summarize_topic.side_effect = Exception("LLM error")
+
+    with patch("src.main.provide_questions", return_value="questions"):
+        response = client.post(
+            "/generate/study-pack",
+            json={"topic": "convolution", "document_id": DOCUMENT_ID},
+        )
+
+    assert response.status_code == 500
+    assert response.json() == {"detail": "Error generating study pack: LLM error"}
+
+
+def test_get_stats():
+    response = client.get("/stats")
+    assert response.status_code == 200
+    assert set(response.json()["response_cache"]) == {
+        "exact_hits",
+        "semantic_hits",
+        "misses",
+        "hit_ratio",
+        "latency_saved_seconds",
+    }
+
+
+def test_embedding_cache_is_reported(tmp_path):
+    cache = EmbeddingCache(path=str(tmp_path / "embeddings.sqlite3"))
+    cache.put_many({"a": [1.0, 0.0]})
+    cache.get_many(["a", "b"])
+
+    with patch("src.main.embedding_cache", cache), patch("src.emb.cache", cache):
+        stats = client.get("/stats").json()["embedding_cache"]
+        body = client.get("/metrics").text
+
+    assert stats["hits"] == 1 and stats["misses"] == 1
+    assert 'rag_qa_embedding_cache_lookups_total{result="hit"} 1.0' in body
+    assert "rag_qa_embedding_cache_evictions_total 0.0" in body
+
+
+def test_overloaded_requests_are_rejected_with_retry_after(
+    mock_retrieve_relevant_context,
+):
+    mock_retrieve_relevant_context.side_effect = Overloaded("Too many requests")
+    response = client.post(
+        "/generate/summary", json={"topic": "convolution", "document_id": DOCUMENT_ID}
+    )
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
+
+
+STREAMING_REQUESTS = [
+    ("/generate/summary/stream", {"topic": "convolution"}),
+    ("/generate/questions/stream", {"topic": "convolution", "questions_type": "MCQ"}),
+    ("/generate/summary/batch", {"topics": ["convolution"]}),
+]
+
+
+@pytest.mark.parametrize(("path", "body"), STREAMING_REQUESTS)
+def test_streaming_requests_are_admitted_before_responding(
+    path, body, mock_retrieve_relevant_context, mock_retrieve_relevant_contexts
+):
+    mock_retrieve_relevant_context.return_value = ["chunk"]
+    mock_retrieve_relevant_contexts.return_value = [["chunk"]]
+    json_body = {**body, "document_id": DOCUMENT_ID}
+
+    # No slot and no room to wait for one
+    full = Bulkhead("llm", max_concurrency=0, max_queue=0)
+    with patch("src.llm.llm_bulkhead", full), patch("src.main.llm_bulkhead", full):
+        response = client.post(path, json=json_body)
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
+
+    # Waiting for a slot that never frees up
+    busy = Bulkhead("llm", max_concurrency=0, max_queue=1)
+    with (
+        patch("src.llm.llm_bulkhead", busy),
+        patch("src.main.llm_bulkhead", busy),
+        patch("src.main.REQUEST_DEADLINE", 0.05),
+    ):
+        response = client.post(path, json=json_body)
+    assert response.status_code == 503
+    assert busy.queued == 0
+
+
+def test_generation_requests_have_a_deadline(
+    mock_retrieve_relevant_context, mock_summarize_topic
+):
+    deadlines = []
+
+    async def fake_retrieve(**kwargs):
+        deadlines.append(time_left())
+        raise DeadlineExceeded("Request deadline exceeded")
+
+    mock_retrieve_relevant_context.side_effect = fake_retrieve
+    response = client.post(
+        "/generate/summary", json={"topic": "convolution", "document_id": DOCUMENT_ID}
+    )
+    assert response.status_code == 503
+    assert 0 < deadlines[0] <= REQUEST_DEADLINE
+
+
+def test_generation_spans_carry_the_request_attributes(
+    mock_retrieve_relevant_context, mock_summarize_topic
+):
+    sdk = pytest.importorskip("opentelemetry.sdk.trace")
+    export = pytest.importorskip("opentelemetry.sdk.trace.export")
+    in_memory = pytest.importorskip(
+        "opentelemetry.sdk.trace.export.in_memory_span_exporter"
+    )
+    exporter = in_memory.InMemorySpanExporter()
+    provider = sdk.TracerProvider()
+    provider.add_span_processor(export.SimpleSpanProcessor(exporter))
+    mock_retrieve_relevant_context.return_value = ["chunk"]
+    mock_summarize_topic.return_value = "Summary"
+
+    with patch("src.metrics.get_tracer", return_value=provider.get_tracer("test")):
+        client.post(
+            "/generate/summary",
+            json={"topic": "convolution", "document_id": DOCUMENT_ID},
+        )
+
+    (request_span,) = exporter.get_finished_spans()
+    assert request_span.attributes["document_id"] == DOCUMENT_ID
+    assert request_span.attributes["topic_count"] == 1
+
+
+def test_get_metrics(mock_retrieve_relevant_context, mock_summarize_topic):
+    mock_retrieve_relevant_context.return_value = ["chunk"]
+    mock_summarize_topic.return_value = "Summary"
+    client.post(
+        "/generate/summary", json={"topic": "convolution", "document_id": DOCUMENT_ID}
+    )
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert (
+        'rag_qa_http_request_duration_seconds_count{method="POST",'
+        'route="/generate/summary",status="200"}' in body
+    )
+    assert 'rag_qa_admission_queued{service="llm"}' in body
+    assert 'rag_qa_response_cache_hits_total{kind="exact"}' in body
+    assert 'rag_qa_upstream_rate_limited_total{upstream="openai-chat"}' in body
+
+
+def test_shutdown_stops_the_pdf_workers():
+    with patch("src.main.pdf.shutdown_executor") as shutdown_executor, TestClient(app):
+        shutdown_executor.assert_not_called()
+    shutdown_executor.assert_called_once()
+
+
+def test_startup_loads_the_tokenizer():
+    with patch("src.main.get_encoding") as get_encoding, TestClient(app):
+        get_encoding.assert_called_once()
+
+
+def test_import_is_lazy_and_needs_no_chat_settings():
+    env = {
+        k: v for k, v in os.environ.items() if k not in ("CHAT_MODEL", "OPENAI_API_KEY")
+    }
+    heavy = ["openai", "pymupdf", "langchain_text_splitters"]
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            f"import sys, src.main; print([m for m in {heavy} if m in sys.modules])",
+        ],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "[]"
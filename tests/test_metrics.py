@@ -0,0 +1,92 @@
+import pytest
+
+from src import metrics
+from src.metrics import Counter, Histogram, Registry, TimedIterator, instrument
+
+
+def test_counter_renders_prometheus_text():
+    registry = Registry()
+    counter = Counter("tokens_total", "Tokens used", ("kind",), registry=registry)
+    counter.inc(3, kind="prompt")
+    counter.inc(2, kind="prompt")
+    counter.inc(kind='a "quoted" kind')
+
+    assert registry.render().splitlines() == [
+        "# HELP tokens_total Tokens used",
+        "# TYPE tokens_total counter",
+        'tokens_total{kind="prompt"} 5.0',
+        'tokens_total{kind="a \\"quoted\\" kind"} 1.0',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    histogram = Histogram(
+        "latency_seconds", "Latency", ("stage",), buckets=(0.1, 1), registry=registry
+    )
+    for value in (0.05, 0.5, 0.7, 3):
+        histogram.observe(value, stage="search")
+
+    lines = registry.render().splitlines()
+    assert lines[2:] == [
+        'latency_seconds_bucket{stage="search",le="0.1"} 1',
+        'latency_seconds_bucket{stage="search",le="1.0"} 3',
+        'latency_seconds_bucket{stage="search",le="+Inf"} 4',
+        'latency_seconds_sum{stage="search"} 4.25',
+        'latency_seconds_count{stage="search"} 4',
+    ]
+
+
+def test_callbacks_are_read_at_render_time():
+    registry = Registry()
+    queued = {"llm": 1}
+    registry.register_callback(
+        "queued",
+        "Callers waiting",
+        "gauge",
+        lambda: [({"service": name}, value) for name, value in queued.items()],
+    )
+    queued["llm"] = 4
+
+    assert 'queued{service="llm"} 4.0' in registry.render()
+
+
+def test_instrument_times_sync_functions():
+    @instrument("test_sync")
+    def add(a, b):
+        """Add two numbers."""
+        return a + b
+
+    calls = metrics.stage_seconds.count(stage="test_sync")
+    assert add(1, 2) == 3
+    assert add.__name__ == "add" and add.__doc__ == "Add two numbers."
+    assert metrics.stage_seconds.count(stage="test_sync") == calls + 1
+
+
+@pytest.mark.anyio
+async def test_instrument_times_async_functions_and_counts_errors():
+    @instrument("test_async")
+    async def fail():
+        raise ValueError("boom")
+
+    calls = metrics.stage_seconds.count(stage="test_async")
+    errors = metrics.stage_errors.value(stage="test_async")
+    with pytest.raises(ValueError):
+        await fail()
+    assert metrics.stage_seconds.count(stage="test_async") == calls + 1
+    assert metrics.stage_errors.value(stage="test_async") == errors + 1
+
+
+def test_timed_iterator_observes_each_item():
+    calls = metrics.stage_seconds.count(stage="test_iter")
+    pages = TimedIterator(iter(["a", "b", "c"]), "test_iter")
+
+    assert list(pages) == ["a", "b", "c"]
+    assert metrics.stage_seconds.count(stage="test_iter") == calls + 3
+    assert pages.seconds >= 0
+
+
+def test_spans_are_no_ops_without_tracing():
+    assert metrics.get_tracer() is None
+    with metrics.span("request"):
+        metrics.annotate(tokens=1)
@@ -0,0 +1,76 @@
+import uuid
+from unittest.mock import MagicMock
+
+import pytest
+from qdrant_client import AsyncQdrantClient, models
+
+from src.embedders import FakeEmbedder
+from src.migrate import migrate
+
+
+@pytest.fixture(autouse=True)
+def mock_logger(monkeypatch):
+    monkeypatch.setattr("src.migrate.logger", MagicMock())
+    monkeypatch.setattr("src.vectorstore.logger", MagicMock())
+
+
+@pytest.fixture(autouse=True)
+def reset_shared_collection(monkeypatch):
+    monkeypatch.setattr("src.vectorstore._shared_collection_ready", False)
+    monkeypatch.setattr("src.emb._embedder", FakeEmbedder(dimension=2))
+
+
+@pytest.fixture
+async def client():
+    client = AsyncQdrantClient(location=":memory:")
+    yield client
+    await client.close()
+
+
+async def create_document_collection(client, texts):
+    document_id = str(uuid.uuid4())
+    await client.create_collection(
+        collection_name=document_id,
+        vectors_config=models.VectorParams(size=2, distance=models.Distance.DOT),
+    )
+    await client.upsert(
+        collection_name=document_id,
+        points=[
+            models.PointStruct(
+                id=str(uuid.uuid4()), vector=[1.0, i], payload={"text": t}
+            )
+            for i, t in enumerate(texts)
+        ],
+    )
+    return document_id
+
+
+class TestMigrate:
+    @pytest.mark.anyio
+    async def test_migrate_moves_documents(self, client):
+        first = await create_document_collection(client, ["a", "b", "c"])
+        second = await create_document_collection(client, ["d"])
+
+        migrated = await migrate(client, delete_source=True, batch_size=2)
+
+        assert migrated == {first: 3, second: 1}
+        collections = {c.name for c in (await client.get_collections()).collections}
+        assert collections == {"documents"}
+
+        points, _ = await client.scroll(
+            collection_name="documents",
+            scroll_filter=models.Filter(
+                must=[
+                    models.FieldCondition(
+                        key="document_id", match=models.MatchValue(value=first)
+                    )
+                ]
+            ),
+        )
+        assert sorted(p.payload["text"] for p in points) == ["a", "b", "c"]
+
+    @pytest.mark.anyio
+    async def test_migrate_keeps_sources_by_default(self, client):
+        document_id = await create_document_collection(client, ["a"])
+        await migrate(client)
+        assert await client.collection_exists(document_id)
@@ -0,0 +1,48 @@
+import io
+
+import pymupdf
+import pytest
+
+from src import pdf
+
+from . import PDF_FILE_PATH, WORDS_IN_DOCUMENT
+
+
+@pytest.fixture
+def large_pdf_file():
+    """The sample PDF replicated ten times, as a byte stream."""
+    with pymupdf.open(PDF_FILE_PATH) as sample, pymupdf.open() as doc:
+        for _ in range(10):
+            doc.insert_pdf(sample)
+        pdf_file = io.BytesIO(doc.tobytes())
+    pdf_file.name = "large.pdf"
+    return pdf_file
+
+
+@pytest.fixture(scope="module", autouse=True)
+def shutdown_executor():
+    yield
+    pdf.shutdown_executor()
+
+
+class TestPdf:
+    def test_extract_text_offsets(self):
+        text, offsets = pdf.extract_text(PDF_FILE_PATH)
+        with pymupdf.open(PDF_FILE_PATH) as doc:
+            pages = [page.get_text() for page in doc]
+
+        assert offsets[0] == 0
+        assert [text[offset:][:50] for offset in offsets] == [p[:50] for p in pages]
+        assert all(word in text for word in WORDS_IN_DOCUMENT)
+
+    def test_parallel_extraction_matches_serial(self, monkeypatch, large_pdf_file):
+        serial = list(pdf.iter_pages(large_pdf_file))
+
+        monkeypatch.setattr("src.pdf.PDF_PARALLEL_PAGE_THRESHOLD", 10)
+        monkeypatch.setattr("src.pdf.PDF_EXTRACTION_WORKERS", 2)
+        monkeypatch.setattr("src.pdf.PDF_EXTRACTION_SHARD_PAGES", 7)
+        pdf.shutdown_executor()
+        parallel = list(pdf.iter_pages(large_pdf_file))
+
+        assert len(serial) == 60
+        assert parallel == serial
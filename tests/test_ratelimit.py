@@ -0,0 +1,140 @@
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import httpx
+import pytest
+
+from src.ratelimit import (
+    AdaptiveConcurrency,
+    RateLimiter,
+    TokenBucket,
+    is_retryable,
+    retry_after_seconds,
+)
+
+
+def http_error(status: int, headers: dict | None = None) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "http://upstream")
+    response = httpx.Response(status, headers=headers, request=request)
+    return httpx.HTTPStatusError("error", request=request, response=response)
+
+
+@pytest.fixture
+def mock_sleep():
+    with patch("src.ratelimit.asyncio.sleep", new_callable=AsyncMock) as mock:
+        yield mock
+
+
+class TestTokenBucket:
+    def test_waits_once_the_budget_is_spent(self):
+        bucket = TokenBucket(rate_per_minute=60)
+        with patch("src.ratelimit.time.time", return_value=1000.0):
+            bucket._state["updated_at"] = 1000.0
+            assert bucket.reserve(60) == 0
+            assert bucket.reserve(1) == pytest.approx(1.0)
+            assert bucket.reserve(2) == pytest.approx(3.0)
+        with patch("src.ratelimit.time.time", return_value=1010.0):
+            assert bucket.reserve(1) == 0
+
+    def test_unlimited_bucket_never_waits(self):
+        assert TokenBucket(rate_per_minute=0).reserve(10**6) == 0
+
+    def test_file_state_is_shared(self, tmp_path):
+        path = str(tmp_path / "bucket.json")
+        first = TokenBucket(rate_per_minute=60, path=path)
+        second = TokenBucket(rate_per_minute=60, path=path)
+        with patch("src.ratelimit.time.time", return_value=1000.0):
+            assert first.reserve(60) == 0
+            assert second.reserve(6) == pytest.approx(6.0)
+
+
+def test_retry_after_seconds():
+    assert retry_after_seconds(http_error(429, {"Retry-After": "7"})) == 7
+    assert retry_after_seconds(http_error(429)) is None
+    assert retry_after_seconds(ValueError()) is None
+    date = "Wed, 21 Oct 2015 07:28:10 GMT"
+    with patch("src.ratelimit.time.time", return_value=1445412480.0):
+        assert retry_after_seconds(http_error(503, {"Retry-After": date})) == 10
+
+
+def test_is_retryable():
+    openai = pytest.importorskip("openai")
+    request = httpx.Request("POST", "http://upstream")
+
+    assert is_retryable(http_error(429))
+    assert is_retryable(http_error(502))
+    assert not is_retryable(http_error(404))
+    assert is_retryable(httpx.ReadTimeout("timed out"))
+    assert is_retryable(openai.APIConnectionError(request=request))
+    assert is_retryable(openai.APITimeoutError(request=request))
+    assert not is_retryable(ValueError("bad input"))
+
+
+def test_adaptive_concurrency_aimd():
+    concurrency = AdaptiveConcurrency(max_limit=8, latency_target=1.0, cooldown=0)
+    concurrency.decrease()
+    assert int(concurrency.limit) == 4
+    concurrency.record_success(latency=2.0)
+    assert int(concurrency.limit) == 2
+    for _ in range(3):
+        concurrency.record_success(latency=0.1)
+    assert int(concurrency.limit) == 3
+
+
+class TestRateLimiter:
+    @pytest.mark.anyio
+    async def test_retries_after_rate_limit(self, mock_sleep):
+        limiter = RateLimiter("test", max_concurrency=4)
+        fn = AsyncMock(side_effect=[http_error(429, {"Retry-After": "2"}), "ok"])
+
+        assert await limiter.call(fn) == "ok"
+        assert fn.await_count == 2
+        mock_sleep.assert_awaited_once()
+        assert mock_sleep.await_args.args[0] == pytest.approx(2.0, abs=0.1)
+        assert limiter.rate_limited == 1
+        assert int(limiter.concurrency.limit) == 2
+
+    @pytest.mark.anyio
+    async def test_does_not_retry_client_errors(self, mock_sleep):
+        limiter = RateLimiter("test")
+        fn = AsyncMock(side_effect=http_error(400))
+
+        with pytest.raises(httpx.HTTPStatusError):
+            await limiter.call(fn)
+        fn.assert_awaited_once()
+
+    @pytest.mark.anyio
+    async def test_gives_up_after_max_retries(self, mock_sleep):
+        limiter = RateLimiter("test", max_retries=2, retry_backoff=1)
+        fn = AsyncMock(side_effect=http_error(503))
+
+        with pytest.raises(httpx.HTTPStatusError):
+            await limiter.call(fn)
+        assert fn.await_count == 3
+        # Full jitter: each delay is anywhere up to the exponential bound
+        delays = [call.args[0] for call in mock_sleep.await_args_list]
+        assert 0 <= delays[0] <= 1 and 0 <= delays[1] <= 2
+
+    @pytest.mark.anyio
+    async def test_limits_concurrency(self):
+        limiter = RateLimiter("test", max_concurrency=2)
+        running = peak = 0
+
+        async def fn():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        await asyncio.gather(*(limiter.call(fn) for _ in range(6)))
+        assert peak == 2
+
+    @pytest.mark.anyio
+    async def test_rate_limit_pauses_other_processes(self, tmp_path, mock_sleep):
+        first = RateLimiter("test", state_dir=str(tmp_path))
+        second = RateLimiter("test", state_dir=str(tmp_path))
+        fn = AsyncMock(side_effect=[http_error(429, {"Retry-After": "30"}), "ok"])
+
+        await first.call(fn)
+        assert 25 < second._pause_remaining() <= 30
@@ -0,0 +1,92 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from src.models import DocumentMetadata
+from src.registry import (
+    DocumentRegistry,
+    find_duplicate,
+    normalize_text,
+    register_document,
+)
+from src.utils import UploadedDocument
+
+from . import PDF_FILE_PATH
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = DocumentRegistry(":memory:")
+    monkeypatch.setattr("src.registry.document_registry", registry)
+    return registry
+
+
+@pytest.fixture
+def upload():
+    return UploadedDocument(
+        path=PDF_FILE_PATH, name="sample.pdf", size=0, sha256="abc123"
+    )
+
+
+@pytest.fixture
+def mock_document_exists(monkeypatch):
+    mock_func = AsyncMock(return_value=True)
+    monkeypatch.setattr("src.registry.document_exists", mock_func)
+    return mock_func
+
+
+class TestDocumentRegistry:
+    def test_put_and_get(self, registry):
+        metadata = DocumentMetadata(id="doc-1", file_name="a.pdf")
+        registry.put(["sha256:1", "text:1"], metadata)
+
+        assert registry.get(["sha256:2", "text:1"]) == metadata
+        assert registry.get(["sha256:2"]) is None
+
+    def test_remove(self, registry):
+        registry.put(["sha256:1"], DocumentMetadata(id="doc-1", file_name="a.pdf"))
+        registry.remove("doc-1")
+        assert registry.get(["sha256:1"]) is None
+
+
+def test_normalize_text():
+    assert normalize_text("Gradient\n  DESCENT\tﬁts ") == "gradient descent fits"
+
+
+class TestFindDuplicate:
+    @pytest.mark.anyio
+    async def test_finds_registered_upload(
+        self, registry, upload, mock_document_exists
+    ):
+        client = MagicMock()
+        assert await find_duplicate(upload, client) is None
+
+        metadata = DocumentMetadata(id="doc-1", file_name="sample.pdf")
+        await register_document(upload, metadata)
+
+        assert await find_duplicate(upload, client) == metadata
+        mock_document_exists.assert_awaited_once_with(client, "doc-1")
+
+    @pytest.mark.anyio
+    async def test_drops_stale_entries(self, registry, upload, mock_document_exists):
+        await register_document(
+            upload, DocumentMetadata(id="deleted", file_name="sample.pdf")
+        )
+        mock_document_exists.return_value = False
+
+        assert await find_duplicate(upload, MagicMock()) is None
+        assert registry.get(["sha256:abc123"]) is None
+
+    @pytest.mark.anyio
+    async def test_matches_text_fingerprint(
+        self, monkeypatch, registry, upload, mock_document_exists
+    ):
+        monkeypatch.setattr("src.registry.DEDUP_TEXT_FINGERPRINT", True)
+        metadata = DocumentMetadata(id="doc-1", file_name="sample.pdf")
+        await register_document(upload, metadata)
+
+        reexported = UploadedDocument(
+            path=PDF_FILE_PATH, name="copy.pdf", size=0, sha256="different"
+        )
+        assert await find_duplicate(reexported, MagicMock()) == metadata
+        assert reexported.text_sha256 == upload.text_sha256
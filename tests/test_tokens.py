@@ -0,0 +1,34 @@
+from unittest.mock import patch
+
+import pytest
+
+from src.tokens import count_tokens, truncate_tokens
+
+tiktoken = pytest.importorskip("tiktoken")
+
+
+@pytest.fixture
+def byte_encoding():
+    """A tiktoken encoding with one token per byte, which needs no download."""
+    encoding = tiktoken.Encoding(
+        name="bytes",
+        pat_str=r"\S+|\s+",
+        mergeable_ranks={bytes([i]): i for i in range(256)},
+        special_tokens={},
+    )
+    with patch("src.tokens.get_encoding", return_value=encoding):
+        yield encoding
+
+
+def test_count_tokens_uses_the_tokenizer(byte_encoding):
+    assert count_tokens("héllo") == 6
+
+
+def test_truncate_tokens_decodes_the_kept_tokens(byte_encoding):
+    assert truncate_tokens("hello world", 5) == "hello"
+    assert truncate_tokens("short", 10) == "short"
+
+
+def test_count_tokens_estimates_without_the_tokenizer():
+    with patch("src.tokens.get_encoding", return_value=None):
+        assert count_tokens("x" * 10) == 3
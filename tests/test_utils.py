@@ -0,0 +1,103 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+from starlette.datastructures import UploadFile
+
+from src.utils import JsonFormatter, create_logger, process_uploaded_file
+
+from . import PDF_FILE_PATH
+
+
+@pytest.fixture
+def upload_file():
+    with open(PDF_FILE_PATH, "rb") as f:
+        content = f.read()
+    return UploadFile(file=io.BytesIO(content), filename="sample.pdf")
+
+
+class TestProcessUploadedFile:
+    @pytest.mark.anyio
+    async def test_spools_upload_to_disk(self, upload_file):
+        document = await process_uploaded_file(upload_file)
+        try:
+            assert Path(document.path).read_bytes() == upload_file.file.getvalue()
+            assert document.name == "sample.pdf"
+            assert document.size == len(upload_file.file.getvalue())
+            assert (
+                document.sha256
+                == hashlib.sha256(upload_file.file.getvalue()).hexdigest()
+            )
+        finally:
+            document.close()
+        assert not os.path.exists(document.path)
+
+    @pytest.mark.anyio
+    async def test_rejects_oversized_upload(self, monkeypatch, upload_file, tmp_path):
+        monkeypatch.setattr("src.utils.UPLOAD_MAX_BYTES", 1024)
+        monkeypatch.setattr("src.utils.UPLOAD_CHUNK_SIZE", 256)
+        monkeypatch.setattr("src.utils.UPLOAD_TMP_DIR", str(tmp_path))
+
+        with pytest.raises(HTTPException) as exc_info:
+            await process_uploaded_file(upload_file)
+        assert exc_info.value.status_code == 413
+        assert os.listdir(tmp_path) == []
+
+
+def wait_for_lines(path: str, count: int) -> list[str]:
+    """Wait for the log listener's thread to write `count` lines."""
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        if os.path.exists(path):
+            with open(path) as f:
+                lines = f.read().splitlines()
+            if len(lines) >= count:
+                return lines
+        time.sleep(0.01)
+    raise AssertionError(f"{path} did not get {count} lines")
+
+
+class TestCreateLogger:
+    def test_handlers_are_not_duplicated(self, tmp_path):
+        log_file = str(tmp_path / "test.log")
+        logger = create_logger("test-dedup", log_file, "info")
+        create_logger("test-dedup", log_file, "info")
+        assert len(logger.handlers) == 1
+
+        logger.info("written %s", "once")
+        assert wait_for_lines(log_file, 1)[0].endswith("| written once]")
+
+    def test_records_below_the_level_are_not_formatted(self, tmp_path):
+        logger = create_logger("test-lazy", str(tmp_path / "test.log"), "info")
+
+        class Expensive:
+            def __str__(self):
+                raise AssertionError("formatted a dropped record")
+
+        logger.debug("context: %s", Expensive())
+
+    def test_json_formatter(self):
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            record = logging.LogRecord(
+                "llm",
+                logging.ERROR,
+                __file__,
+                1,
+                "failed %s",
+                ("topic",),
+                sys.exc_info(),
+            )
+        entry = json.loads(JsonFormatter().format(record))
+        assert entry["logger"] == "llm"
+        assert entry["level"] == "ERROR"
+        assert entry["message"] == "failed topic"
+        assert "ValueError: boom" in entry["exception"]
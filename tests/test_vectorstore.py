@@ -1,18 +1,31 @@
+import asyncio
 import io
 import json
 import uuid
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
-from qdrant_client import QdrantClient, models
+from qdrant_client import AsyncQdrantClient, models
 from qdrant_client.models import Distance, VectorParams
 
-from src.emb import EMBEDDING_DIMENSION
+from src.embedders import EMBEDDING_DIMENSION
+from src.local_index import LocalIndex
 from src.models import DocumentMetadata
 from src.vectorstore import (
+    SPLIT_WINDOW,
+    STORAGE_PROFILES,
+    QdrantConnection,
+    document_filter,
+    ensure_shared_collection,
+    fit_vector,
     ingest_document,
+    iter_chunk_spans,
+    iter_chunks,
     load_and_split_document,
+    merge_chunks,
+    point_id,
     retrieve_relevant_context,
+    retrieve_relevant_contexts,
     split_text,
 )
 
@@ -71,18 +84,24 @@ def mock_search_result():
 
 @pytest.fixture
 def mock_client(mock_search_result):
-    client = MagicMock(spec=QdrantClient)
+    client = MagicMock(spec=AsyncQdrantClient)
     client.create_collection.return_value = None
     client.upsert.return_value = None
     client.query_points.return_value = mock_search_result
+    client.get_collection.return_value.config.params.vectors.size = EMBEDDING_DIMENSION
     return client
 
 
+@pytest.fixture(autouse=True)
+def reset_vector_sizes(monkeypatch):
+    monkeypatch.setattr("src.vectorstore._vector_sizes", {})
+
+
 @pytest.fixture(autouse=True)
 def mock_qdrant_client(monkeypatch, mock_client):
-    monkeypatch.setattr(
-        "src.vectorstore.QdrantClient", MagicMock(return_value=mock_client)
-    )
+    mock_constructor = MagicMock(return_value=mock_client)
+    monkeypatch.setattr("src.vectorstore.AsyncQdrantClient", mock_constructor)
+    return mock_constructor
 
 
 @pytest.fixture
@@ -92,14 +111,17 @@ def mock_query_embeddings():
 
 @pytest.fixture(autouse=True)
 def mock_embed_query(monkeypatch, mock_query_embeddings):
-    mock_func = MagicMock(return_value=mock_query_embeddings)
+    mock_func = AsyncMock(return_value=mock_query_embeddings)
     monkeypatch.setattr("src.vectorstore.embed_query", mock_func)
     return mock_func
 
 
 @pytest.fixture(autouse=True)
 def mock_embed_texts(monkeypatch, mock_vectors):
-    mock_func = MagicMock(return_value=mock_vectors)
+    async def fake_embed_texts(texts):
+        return [mock_vectors[i % len(mock_vectors)] for i in range(len(texts))]
+
+    mock_func = AsyncMock(side_effect=fake_embed_texts)
     monkeypatch.setattr("src.vectorstore.embed_texts", mock_func)
     return mock_func
 
@@ -111,9 +133,7 @@ def mock_pymupdf(monkeypatch, mock_chunks):
     mock_page = MagicMock()
     mock_page.get_text.return_value = " ".join(mock_chunks)
     mock_doc.__iter__.return_value = [mock_page]
-    monkeypatch.setattr(
-        "src.vectorstore.pymupdf.Document", MagicMock(return_value=mock_doc)
-    )
+    monkeypatch.setattr("pymupdf.Document", MagicMock(return_value=mock_doc))
 
 
 @pytest.fixture(autouse=True)
@@ -144,15 +164,94 @@ class TestVectorstore:
         full_text = "\n".join(chunks)
         assert all(word in full_text for word in WORDS_IN_DOCUMENT)
 
-    def test_ingest_document(
+    def test_iter_chunks_streams_pages(self):
+        pages = ["\n\n This is a very long text block. Again, too long\n\n" * 40] * 20
+        chunks = list(iter_chunks(pages))
+        assert max(len(chunk) for chunk in chunks) <= 512
+        assert len(chunks) == len(split_text("".join(pages)))
+
+    @pytest.mark.anyio
+    async def test_ingest_document_upserts_in_groups(
+        self, monkeypatch, mock_pdf_file, mock_chunks, mock_client
+    ):
+        monkeypatch.setattr("src.vectorstore.INGEST_CHUNK_BATCH_SIZE", 2)
+        monkeypatch.setattr("src.vectorstore.INGEST_UPSERT_BATCH_SIZE", 3)
+        await ingest_document(mock_pdf_file, client=mock_client)
+
+        upserted = [
+            call.kwargs["points"].payloads
+            for call in mock_client.upsert.await_args_list
+        ]
+        assert all(len(payloads) <= 3 for payloads in upserted)
+        assert len(upserted) > 1
+        texts = " ".join(p["text"] for payloads in upserted for p in payloads)
+        assert all(word in texts for word in WORDS_IN_DOCUMENT)
+        indexes = [p["chunk_index"] for payloads in upserted for p in payloads]
+        assert indexes == list(range(len(indexes)))
+
+    def test_iter_chunk_spans_offsets(self):
+        pages = [
+            f"Page {i}. " + "Some sentence about convolution. " * 60 for i in range(20)
+        ]
+        text = "".join(pages)
+        spans = list(iter_chunk_spans(pages))
+        assert len(spans) > SPLIT_WINDOW * 2 // 512
+        assert all(text[start : start + len(chunk)] == chunk for start, chunk in spans)
+
+    def test_merge_chunks_stitches_neighbours(self):
+        text = "one two three four five six seven eight nine ten"
+        payloads = [
+            {"text": text[14:29], "chunk_index": 2, "start": 14},
+            {"text": "unrelated", "chunk_index": 9, "start": 100},
+            {"text": text[0:18], "chunk_index": 1, "start": 0},
+            {"text": "legacy chunk without offsets"},
+        ]
+        assert merge_chunks(payloads) == [
+            text[0:29],
+            "unrelated",
+            "legacy chunk without offsets",
+        ]
+
+    @pytest.mark.anyio
+    async def test_ingest_document_propagates_embedding_errors(
+        self, mock_pdf_file, mock_embed_texts, mock_client
+    ):
+        mock_embed_texts.side_effect = Exception("embedding failed")
+        with pytest.raises(Exception, match="embedding failed"):
+            await ingest_document(mock_pdf_file, client=mock_client)
+        mock_client.upsert.assert_not_awaited()
+
+    @pytest.mark.anyio
+    async def test_failed_ingest_deletes_the_collection(
+        self, mock_pdf_file, mock_client
+    ):
+        mock_client.upsert.side_effect = Exception("upsert failed")
+        with pytest.raises(Exception, match="upsert failed"):
+            await ingest_document(mock_pdf_file, client=mock_client, document_id="doc")
+        mock_client.delete_collection.assert_awaited_once_with("doc")
+
+    @pytest.mark.anyio
+    async def test_point_ids_are_deterministic(self, mock_pdf_file, mock_client):
+        for _ in range(2):
+            await ingest_document(mock_pdf_file, client=mock_client, document_id="doc")
+        first, second = (
+            call.kwargs["points"].ids for call in mock_client.upsert.await_args_list
+        )
+        assert first == second
+        assert first[0] == point_id("doc", 0)
+        assert len(set(first)) == len(first)
+
+    @pytest.mark.anyio
+    async def test_ingest_document(
         self, mock_pdf_file, mock_chunks, mock_embed_texts, mock_vectors, mock_client
     ):
         chunks_uuids = [uuid.uuid4() for _ in range(len(mock_chunks))]
         with patch(
             "src.vectorstore.uuid.uuid4",
-            side_effect=[uuid.UUID("71a18a69-2dbd-466b-99e5-4e3e213430a9")] + chunks_uuids,
+            side_effect=[uuid.UUID("71a18a69-2dbd-466b-99e5-4e3e213430a9")]
+            + chunks_uuids,
         ):
-            metadata = ingest_document(mock_pdf_file, client=mock_client)
+            metadata = await ingest_document(mock_pdf_file, client=mock_client)
             mock_client.create_collection.assert_called_once_with(
                 collection_name="71a18a69-2dbd-466b-99e5-4e3e213430a9",
                 vectors_config=VectorParams(
@@ -171,22 +270,231 @@ class TestVectorstore:
             # )
             assert metadata == DocumentMetadata(id=DOCUMENT_ID, file_name=PDF_FILE_PATH)
 
-    def test_retrieve_relevant_context(
+    @pytest.mark.anyio
+    async def test_retrieve_relevant_context(
         self, mock_embed_query, mock_query_embeddings, mock_client, mock_search_result
     ):
         global embed_query
         topic = "specific example topic"
         document_id = DOCUMENT_ID
 
-        retrieved_chunks = retrieve_relevant_context(topic, document_id, mock_client)
-        mock_embed_query.assert_called_once_with(query=topic)
+        retrieved_chunks = await retrieve_relevant_context(
+            topic, document_id, mock_client
+        )
+        mock_embed_query.assert_awaited_once_with(query=topic)
 
-        mock_client.query_points.assert_called_once_with(
+        mock_client.query_points.assert_awaited_once_with(
             collection_name=document_id,
             query=mock_query_embeddings,
+            query_filter=None,
             with_payload=True,
             limit=10,
         )
 
         expected_chunks = [point.payload["text"] for point in mock_search_result.points]
         assert retrieved_chunks == expected_chunks
+
+    @pytest.mark.anyio
+    async def test_small_documents_are_searched_locally(
+        self, monkeypatch, tmp_path, mock_pdf_file, mock_chunks, mock_client
+    ):
+        monkeypatch.setattr("src.vectorstore.local_index", LocalIndex(str(tmp_path)))
+        metadata = await ingest_document(mock_pdf_file, client=mock_client)
+
+        chunks = await retrieve_relevant_context("topic", metadata.id, mock_client)
+        # Neighbouring hits are merged into spans
+        assert 1 <= len(chunks) <= 10
+        mock_client.query_points.assert_not_called()
+
+    @pytest.mark.anyio
+    async def test_retrieve_relevant_contexts_batches(
+        self, monkeypatch, mock_client, mock_search_result
+    ):
+        mock_embed_queries = AsyncMock(return_value=[[0.1, 0.2, 0.3]] * 3)
+        monkeypatch.setattr("src.vectorstore.embed_queries", mock_embed_queries)
+        mock_client.query_batch_points.return_value = [mock_search_result] * 3
+
+        contexts = await retrieve_relevant_contexts(
+            ["a", "b", "c"], DOCUMENT_ID, mock_client
+        )
+
+        assert contexts == [["chunk1", "chunk2"]] * 3
+        mock_embed_queries.assert_awaited_once_with(queries=["a", "b", "c"])
+        kwargs = mock_client.query_batch_points.await_args.kwargs
+        assert kwargs["collection_name"] == DOCUMENT_ID
+        assert len(kwargs["requests"]) == 3
+        mock_client.query_points.assert_not_called()
+
+    @pytest.mark.anyio
+    async def test_retrieval_is_cached_per_document_and_topic(
+        self, mock_embed_query, mock_client, mock_search_result
+    ):
+        first = await retrieve_relevant_context("topic", DOCUMENT_ID, mock_client)
+        first.append("modified by the caller")
+        second = await retrieve_relevant_context("topic", DOCUMENT_ID, mock_client)
+        contexts = await retrieve_relevant_contexts(["topic"], DOCUMENT_ID, mock_client)
+
+        assert second == ["chunk1", "chunk2"]
+        assert contexts == [["chunk1", "chunk2"]]
+        mock_embed_query.assert_awaited_once()
+        mock_client.query_points.assert_awaited_once()
+        mock_client.query_batch_points.assert_not_called()
+
+        await retrieve_relevant_context("other topic", DOCUMENT_ID, mock_client)
+        assert mock_client.query_points.await_count == 2
+
+    @pytest.mark.anyio
+    async def test_concurrent_retrievals_are_coalesced(
+        self, mock_embed_query, mock_client, mock_search_result
+    ):
+        results = await asyncio.gather(
+            *(
+                retrieve_relevant_context("topic", DOCUMENT_ID, mock_client)
+                for _ in range(5)
+            )
+        )
+
+        assert results == [["chunk1", "chunk2"]] * 5
+        mock_client.query_points.assert_awaited_once()
+
+
+class TestQdrantConnection:
+    @pytest.mark.anyio
+    async def test_client_is_shared(self, mock_qdrant_client, mock_client):
+        connection = QdrantConnection(health_check_interval=0)
+        assert await connection.get_client() is mock_client
+        assert await connection.get_client() is mock_client
+        mock_qdrant_client.assert_called_once()
+
+    @pytest.mark.anyio
+    async def test_failed_health_check_reconnects(
+        self, mock_qdrant_client, mock_client
+    ):
+        connection = QdrantConnection(health_check_interval=0)
+        mock_client.get_collections.side_effect = Exception("connection refused")
+
+        assert await connection.health_check() is False
+        assert mock_qdrant_client.call_count == 2
+        mock_client.close.assert_awaited_once()
+
+    @pytest.mark.anyio
+    async def test_mark_unhealthy_reconnects(self, mock_qdrant_client):
+        connection = QdrantConnection(health_check_interval=0)
+        await connection.get_client()
+        connection.mark_unhealthy()
+        await connection.get_client()
+        assert mock_qdrant_client.call_count == 2
+
+
+class TestSharedCollection:
+    @pytest.fixture(autouse=True)
+    def shared_storage_mode(self, monkeypatch):
+        monkeypatch.setattr("src.vectorstore.QDRANT_STORAGE_MODE", "shared")
+        monkeypatch.setattr("src.vectorstore._shared_collection_ready", False)
+
+    @pytest.mark.anyio
+    async def test_ingest_document_into_shared_collection(
+        self, mock_pdf_file, mock_client
+    ):
+        mock_client.collection_exists.return_value = False
+        metadata = await ingest_document(mock_pdf_file, client=mock_client)
+
+        mock_client.create_collection.assert_awaited_once()
+        assert (
+            mock_client.create_collection.await_args.kwargs["collection_name"]
+            == "documents"
+        )
+        mock_client.create_payload_index.assert_awaited_once()
+        for call in mock_client.upsert.await_args_list:
+            assert call.kwargs["collection_name"] == "documents"
+            payloads = call.kwargs["points"].payloads
+            assert all(p["document_id"] == metadata.id for p in payloads)
+
+    @pytest.mark.anyio
+    async def test_failed_ingest_deletes_the_documents_points(
+        self, mock_pdf_file, mock_client, mock_embed_texts
+    ):
+        mock_client.collection_exists.return_value = True
+        mock_embed_texts.side_effect = Exception("embedding failed")
+        with pytest.raises(Exception, match="embedding failed"):
+            await ingest_document(mock_pdf_file, client=mock_client, document_id="doc")
+
+        mock_client.delete_collection.assert_not_awaited()
+        selector = mock_client.delete.await_args.kwargs["points_selector"]
+        assert selector.filter == document_filter("doc")
+
+    @pytest.mark.anyio
+    async def test_concurrent_ingests_create_the_collection_once(self, mock_client):
+        async def collection_exists(name):
+            await asyncio.sleep(0.01)
+            return mock_client.create_collection.await_count > 0
+
+        mock_client.collection_exists.side_effect = collection_exists
+        await asyncio.gather(
+            ensure_shared_collection(mock_client),
+            ensure_shared_collection(mock_client),
+        )
+
+        mock_client.create_collection.assert_awaited_once()
+
+    @pytest.mark.anyio
+    async def test_collection_created_by_another_replica_is_used(self, mock_client):
+        mock_client.collection_exists.side_effect = [False, True]
+        mock_client.create_collection.side_effect = Exception("already exists")
+
+        await ensure_shared_collection(mock_client)
+
+        mock_client.create_payload_index.assert_not_awaited()
+
+    @pytest.mark.anyio
+    async def test_retrieve_relevant_context_filters_by_document(self, mock_client):
+        await retrieve_relevant_context("topic", DOCUMENT_ID, mock_client)
+
+        kwargs = mock_client.query_points.await_args.kwargs
+        assert kwargs["collection_name"] == "documents"
+        condition = kwargs["query_filter"].must[0]
+        assert condition.key == "document_id"
+        assert condition.match.value == DOCUMENT_ID
+
+
+class TestStorageProfiles:
+    @pytest.fixture(autouse=True)
+    def compact_profile(self, monkeypatch):
+        monkeypatch.setattr("src.vectorstore.QDRANT_STORAGE_PROFILE", "compact")
+
+    def test_fit_vector(self):
+        assert fit_vector([0.6, 0.8], 4) == [0.6, 0.8]
+        assert fit_vector([3.0, 4.0, 12.0], 2) == pytest.approx([0.6, 0.8])
+
+    @pytest.mark.anyio
+    async def test_ingest_document_uses_profile(
+        self, mock_pdf_file, mock_embed_texts, mock_client
+    ):
+        mock_embed_texts.side_effect = lambda texts: [
+            [1.0] * EMBEDDING_DIMENSION for _ in texts
+        ]
+        await ingest_document(mock_pdf_file, client=mock_client)
+
+        kwargs = mock_client.create_collection.await_args.kwargs
+        assert kwargs["vectors_config"] == VectorParams(
+            size=512, distance=Distance.DOT, on_disk=True
+        )
+        assert isinstance(kwargs["quantization_config"], models.ScalarQuantization)
+        vectors = mock_client.upsert.await_args.kwargs["points"].vectors
+        assert all(len(vector) == 512 for vector in vectors)
+        assert sum(x * x for x in vectors[0]) == pytest.approx(1.0)
+
+    @pytest.mark.anyio
+    async def test_retrieve_relevant_context_rescores(
+        self, mock_embed_query, mock_client
+    ):
+        mock_embed_query.return_value = [1.0] * EMBEDDING_DIMENSION
+        mock_client.get_collection.return_value.config.params.vectors.size = 512
+
+        await retrieve_relevant_context("topic", DOCUMENT_ID, mock_client)
+
+        kwargs = mock_client.query_points.await_args.kwargs
+        assert len(kwargs["query"]) == 512
+        quantization = kwargs["search_params"].quantization
+        assert quantization.rescore
+        assert quantization.oversampling == STORAGE_PROFILES["compact"].oversampling